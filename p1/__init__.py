@@ -0,0 +1,5 @@
+"""Part 1: reliable file transfer over UDP (Go-Back-N or selective repeat, optional FEC).
+
+p1_server and p1_client can be imported without side effects; their
+main() functions back the p1-server and p1-client commands.
+"""
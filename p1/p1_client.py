@@ -1,15 +1,20 @@
 import socket
+import sys
 import argparse
 import json
+import base64
+import time
 
 # Constants
 MSS = 1400  # Maximum Segment Size
-BUFFER_SIZE = MSS + 200  # Increased buffer size to accommodate larger packet size with headers
+BUFFER_SIZE = 65535  # Largest UDP datagram; JSON-escaped payloads can be several times MSS
+FEC_SEQ_NUM = -2  # Sequence number marking a parity packet
+FEC_HISTORY = 64  # Packets kept behind the expected one for rebuilding lost packets
 
 def receive_file(server_ip, server_port):
     """
     Receive the file from the server with reliability, handling packet loss
-    and reordering.
+    and reordering. Returns True once the server has signalled the end of the file.
     """
     # Initialize UDP socket
     client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -22,6 +27,14 @@ def receive_file(server_ip, server_port):
     # Buffer to hold out-of-order packets
     packet_buffer = {}
 
+    # Recently received packets and pending parity blocks, for FEC recovery
+    recent_packets = {}
+    parity_blocks = {}
+    fec_recovered = 0
+    highest_seq_num = -1  # Latest data packet seen, to tell a lost packet from a late one
+    selective = False
+    complete = False
+
     # Send initial connection request to server
     client_socket.sendto(b"START", server_address)
 
@@ -31,38 +44,47 @@ def receive_file(server_ip, server_port):
                 # Receive the packet
                 packet, _ = client_socket.recvfrom(BUFFER_SIZE)
                 
-                seq_num, data = parse_packet(packet)
-                #print(f"Received packet: seq_num={seq_num}, data={data}")  # Log received packet details
+                seq_num, data, fields = parse_packet(packet)
 
                 if seq_num == -1:  # Check for the END signal
                     print("Received END signal from server, file transfer complete")
+                    complete = True
                     break
 
-                if seq_num == expected_seq_num:
-                    # Write data to the file for the expected packet
-                    file.write(data.encode('latin1'))  # Ensure data is written as bytes
-                    print(f"Writing packet {seq_num} to file")  # Log the write action
-                    
-                    # Update expected seq number and send cumulative ACK for the received packet
-                    send_ack(client_socket, server_address, seq_num)
-                    expected_seq_num += 1
-                    
-                    # Check for any buffered packets that can now be written
-                    while expected_seq_num in packet_buffer:
-                        buffered_data = packet_buffer.pop(expected_seq_num)
-                        file.write(buffered_data.encode('latin1'))  # Write buffered data to file
-                        print(f"Writing buffered packet {expected_seq_num} to file")  # Log buffered write
-                        send_ack(client_socket, server_address, expected_seq_num)
-                        expected_seq_num += 1
-
-                elif seq_num < expected_seq_num:
-                    # Duplicate or old packet, send ACK again
-                    print(f"Duplicate packet {seq_num} received. Sending ACK again.")
-                    send_ack(client_socket, server_address, seq_num)
+                if seq_num == FEC_SEQ_NUM:
+                    # Parity packet: remember it and try to rebuild a lost packet
+                    parity_blocks[fields['base']] = (fields['lengths'], base64.b64decode(data))
+                    print(f"Received parity for packets {fields['base']}-{fields['base'] + len(fields['lengths']) - 1}")
                 else:
-                    # Packet arrived out of order, store it in the buffer
-                    print(f"Out-of-order packet {seq_num}, expected {expected_seq_num}, buffering it")
-                    packet_buffer[seq_num] = data
+                    # A selective-repeat sender marks its packets; it needs each one acknowledged as it arrives
+                    selective = fields.get('sr', False)
+                    expected_seq_num = handle_data_packet(client_socket, server_address, file, packet_buffer,
+                                                          expected_seq_num, seq_num, data, selective=selective)
+                    recent_packets[seq_num] = data
+                    highest_seq_num = max(highest_seq_num, seq_num)
+
+                # A block's missing packet only counts as lost once a packet sent after the
+                # block has arrived; until then it may just have been overtaken by the parity
+                blocks = [base for base, (lengths, _) in parity_blocks.items()
+                          if base + len(lengths) <= highest_seq_num]
+
+                for base in blocks:
+                    rebuilt = recover_from_parity(base, parity_blocks, recent_packets)
+                    if rebuilt is not None:
+                        lost_seq_num, lost_data = rebuilt
+                        fec_recovered += 1
+                        print(f"Rebuilt lost packet {lost_seq_num} from parity")
+                        recent_packets[lost_seq_num] = lost_data
+                        expected_seq_num = handle_data_packet(client_socket, server_address, file, packet_buffer,
+                                                              expected_seq_num, lost_seq_num, lost_data,
+                                                              recovered=True, selective=selective)
+
+                # Forget packets and parity too old to matter
+                horizon = expected_seq_num - FEC_HISTORY
+                for old_seq_num in [s for s in recent_packets if s < horizon]:
+                    del recent_packets[old_seq_num]
+                for base in [b for b, (lengths, _) in parity_blocks.items() if b + len(lengths) <= horizon]:
+                    del parity_blocks[base]
 
             except socket.timeout:
                 print("Timeout waiting for data")
@@ -70,37 +92,127 @@ def receive_file(server_ip, server_port):
                 print("Connection reset by server. Exiting.")
                 break
 
+    if fec_recovered:
+        print(f"Recovered {fec_recovered} lost packets from parity")
+    return complete
+
+
+def handle_data_packet(client_socket, server_address, file, packet_buffer, expected_seq_num, seq_num, data,
+                       recovered=False, selective=False):
+    """
+    Write or buffer a data packet and acknowledge it. Returns the new expected sequence number.
+
+    For a Go-Back-N sender, ACKs are cumulative and go out as packets are
+    written. For a selective-repeat sender every packet is acknowledged as
+    it arrives, along with the first packet not yet written.
+    """
+    if seq_num == expected_seq_num:
+        # Write data to the file for the expected packet
+        file.write(data.encode('latin1'))  # Ensure data is written as bytes
+        print(f"Writing packet {seq_num} to file")  # Log the write action
+
+        if not selective:
+            # Update expected seq number and send cumulative ACK for the received packet
+            send_ack(client_socket, server_address, seq_num, recovered)
+        expected_seq_num += 1
+
+        # Check for any buffered packets that can now be written
+        while expected_seq_num in packet_buffer:
+            buffered_data = packet_buffer.pop(expected_seq_num)
+            file.write(buffered_data.encode('latin1'))  # Write buffered data to file
+            print(f"Writing buffered packet {expected_seq_num} to file")  # Log buffered write
+            if not selective:
+                send_ack(client_socket, server_address, expected_seq_num)
+            # A selective-repeat sender had it acknowledged when it arrived out of order
+            expected_seq_num += 1
+
+        if selective:
+            # Acknowledge the received packet, along with how far the file is now complete
+            send_ack(client_socket, server_address, seq_num, recovered, expected_seq_num)
+
+    elif seq_num < expected_seq_num:
+        # Duplicate or old packet, send ACK again
+        print(f"Duplicate packet {seq_num} received. Sending ACK again.")
+        send_ack(client_socket, server_address, seq_num, next_expected=expected_seq_num if selective else None)
+    else:
+        # Packet arrived out of order, store it in the buffer
+        print(f"Out-of-order packet {seq_num}, expected {expected_seq_num}, buffering it")
+        packet_buffer[seq_num] = data
+        if selective:
+            # Acknowledge it individually so the sender never resends it
+            send_ack(client_socket, server_address, seq_num, recovered, expected_seq_num)
+    return expected_seq_num
+
+
+def recover_from_parity(base, parity_blocks, recent_packets):
+    """
+    Rebuild the one missing packet of a parity block, if exactly one is missing.
+    Returns (seq_num, data) of the rebuilt packet, or None.
+    """
+    if base not in parity_blocks:
+        return None
+    lengths, parity = parity_blocks[base]
+    missing = [s for s in range(base, base + len(lengths)) if s not in recent_packets]
+    if len(missing) != 1:
+        if not missing:
+            del parity_blocks[base]  # Block complete, parity no longer needed
+        return None
+
+    size = len(parity)
+    value = int.from_bytes(parity, 'big')
+    for s in range(base, base + len(lengths)):
+        if s != missing[0]:
+            value ^= int.from_bytes(recent_packets[s].encode('latin1').ljust(size, b'\0'), 'big')
+    del parity_blocks[base]
+    lost_data = value.to_bytes(size, 'big')[:lengths[missing[0] - base]]
+    return missing[0], lost_data.decode('latin1')
+
 
 def parse_packet(packet):
     """
-    Parse the packet to extract the sequence number and data.
+    Parse the packet to extract the sequence number, data and the full
+    packet fields (parity packets carry their block description there).
     """
     try:
         parsed_packet = json.loads(packet.decode())
         seq_num = parsed_packet['seq_num']
         data = parsed_packet['data']
-        return seq_num, data
+        return seq_num, data, parsed_packet
     except json.JSONDecodeError:
         print("Received a non-JSON packet. Ignoring...")
-        return -1, None  # Return a default value to indicate an error in parsing
+        return -1, None, None  # Return a default value to indicate an error in parsing
 
 
 
-def send_ack(client_socket, server_address, seq_num):
+def send_ack(client_socket, server_address, seq_num, recovered=False, next_expected=None):
     """
-    Send a cumulative acknowledgment for the received packet.
+    Send an acknowledgment for the received packet: cumulative for a
+    Go-Back-N sender, selective with next_expected, the first packet not
+    yet written, which covers earlier ACKs that were lost.
     """
-    ack_packet = json.dumps({'ack_seq': seq_num}).encode()  # Format ACK as JSON
+    ack = {'ack_seq': seq_num}
+    if next_expected is not None:
+        ack['next'] = next_expected
+    if recovered:
+        ack['fec'] = True  # Tell the sender this loss was repaired without a retransmit
+    ack_packet = json.dumps(ack).encode()  # Format ACK as JSON
     client_socket.sendto(ack_packet, server_address)
-    print(f"Sent cumulative ACK for packet {seq_num}")
+    print(f"Sent {'selective' if next_expected is not None else 'cumulative'} ACK for packet {seq_num}")
+
 
+def main(argv=None):
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description='Reliable file receiver over UDP.')
+    parser.add_argument('server_ip', help='IP address of the server')
+    parser.add_argument('server_port', type=int, help='Port number of the server')
 
-# Parse command-line arguments
-parser = argparse.ArgumentParser(description='Reliable file receiver over UDP.')
-parser.add_argument('server_ip', help='IP address of the server')
-parser.add_argument('server_port', type=int, help='Port number of the server')
+    args = parser.parse_args(argv)
 
-args = parser.parse_args()
+    # Run the client, timed in-process so the experiments can leave interpreter startup out
+    start_time = time.time()
+    ok = receive_file(args.server_ip, args.server_port)
+    print(f"Transfer time: {time.time() - start_time:.6f} s")
+    sys.exit(0 if ok else 1)
 
-# Run the client
-receive_file(args.server_ip, args.server_port)
+if __name__ == "__main__":
+    main()
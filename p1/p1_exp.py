@@ -38,6 +38,21 @@ def compute_md5(file_path):
         print(f"File not found: {file_path}")
         return None
 
+def read_retransmissions(log_path):
+    """Return the retransmission count from the server's closing summary, if any."""
+    # The server may still be flushing its log when the client exits
+    for _ in range(10):
+        try:
+            with open(log_path) as log:
+                match = re.search(r"(\d+) retransmissions", log.read())
+            if match:
+                return int(match.group(1))
+        except FileNotFoundError:
+            pass
+        time.sleep(0.2)
+    print(f"No transfer summary in {log_path}")
+    return None
+
 def run(expname):
     # Set the log level to info to see detailed output
     setLogLevel('info')
@@ -49,7 +64,7 @@ def run(expname):
     # Output file 
     output_file = f'reliability_{expname}.csv'
     f_out = open(output_file, 'w')
-    f_out.write("loss,delay,fast_recovery,md5_hash,ttc\n")
+    f_out.write("loss,delay,fast_recovery,fec,selective_repeat,md5_hash,ttc,retransmissions\n")
 
 
     SERVER_IP = "10.0.0.1"
@@ -69,10 +84,9 @@ def run(expname):
     # Loop to create the topology 10 times with varying loss (1% to 10%)
     for LOSS in loss_list:
         for DELAY in delay_list:
-            # for FAST_RECOVERY in [True, False]:
-            for FAST_RECOVERY in [1, 0]:
+            for FAST_RECOVERY, FEC, SR in [(1, 0, 0), (0, 0, 0), (1, 1, 0), (1, 0, 1)]:
                 for i in range(0, NUM_ITERATIONS):
-                    print(f"\n--- Running topology with {LOSS}% packet loss, {DELAY}ms delay and fast recovery {FAST_RECOVERY}")
+                    print(f"\n--- Running topology with {LOSS}% packet loss, {DELAY}ms delay, fast recovery {FAST_RECOVERY}, FEC {FEC} and selective repeat {SR}")
 
                     # Create the custom topology with the specified loss
                     topo = CustomTopo(loss=LOSS, delay=DELAY)
@@ -93,16 +107,19 @@ def run(expname):
                     start_time = time.time()
                     
                     # h1.cmd(f"python3 p1_server.py {SERVER_IP} {SERVER_PORT} {FAST_RECOVERY} &")
-                    h1.cmd(f"python p1_server.py {SERVER_IP} {SERVER_PORT} {FAST_RECOVERY} > server_output.log 2>&1 &")
+                    h1.cmd(f"python p1_server.py {SERVER_IP} {SERVER_PORT} {FAST_RECOVERY} --fec {FEC} --sr {SR} > server_output.log 2>&1 &")
 
                     # result = h2.cmd(f"python3 p1_client.py {SERVER_IP} {SERVER_PORT}")
                     result = h2.cmd(f"python3 p1_client.py {SERVER_IP} {SERVER_PORT} ")
 
                     end_time = time.time()
-                    ttc = end_time-start_time
+                    # The client times the transfer itself, leaving out its interpreter startup
+                    match = re.search(r"Transfer time: ([0-9.]+) s", result)
+                    ttc = float(match.group(1)) if match else end_time-start_time
                     md5_hash = compute_md5('received_file.txt')
+                    retransmissions = read_retransmissions('server_output.log')
                     # write the result to a file 
-                    f_out.write(f"{LOSS},{DELAY},{FAST_RECOVERY},{md5_hash},{ttc}\n")
+                    f_out.write(f"{LOSS},{DELAY},{FAST_RECOVERY},{FEC},{SR},{md5_hash},{ttc},{retransmissions}\n")
                             
 
                     # Stop the network
@@ -3,23 +3,37 @@ import time
 import json
 import argparse
 import os
+import base64
 
 # Constants
 MSS = 1400  # Maximum Segment Size
 WINDOW_SIZE = 5  # Number of packets in flight
+SR_WINDOW_SIZE = 64  # Default window for selective repeat, which only resends what was lost
 DUP_ACK_THRESHOLD = 3  # Threshold for duplicate ACKs to trigger fast recovery
 FILE_PATH = "input.txt"  # Example file path
+FEC_SEQ_NUM = -2  # Sequence number marking a parity packet
+
+# Forward error correction parameters
+INITIAL_FEC_K = 4  # Data packets per parity packet before any loss is measured
+MIN_FEC_K = 2
+MAX_FEC_K = 8
 
 # RTT estimation parameters
 ALPHA = 0.125
 BETA = 0.25
 INITIAL_TIMEOUT = 1.0  # Initial timeout before RTT measurements
+MIN_TIMEOUT = 0.2  # Floor for selective-repeat timers, which see many more RTT samples per loss
 EstimatedRTT = INITIAL_TIMEOUT  # Initialize EstimatedRTT with a default value
 DevRTT = 0.0  # Initialize deviation RTT
 
-def send_file(server_ip, server_port, enable_fast_recovery):
+def send_file(server_ip, server_port, enable_fast_recovery, enable_fec=False, selective_repeat=False,
+              window_size=None):
     global EstimatedRTT, DevRTT
 
+    if window_size is None:
+        window_size = SR_WINDOW_SIZE if selective_repeat else WINDOW_SIZE
+    print(f"{'Selective repeat' if selective_repeat else 'Go-Back-N'} with a window of {window_size} packets")
+
     # Initialize UDP socket
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     server_socket.bind((server_ip, server_port))
@@ -41,6 +55,15 @@ def send_file(server_ip, server_port, enable_fast_recovery):
             last_ack_received = -1
             TimeoutInterval = INITIAL_TIMEOUT
             duplicate_ack_count = 0  # Initialize duplicate ACK counter
+            fec_k = INITIAL_FEC_K  # Current code rate: one parity packet per fec_k data packets
+            fec_block = []  # (seq_num, chunk) sent since the last parity packet
+            packets_sent = 0
+            parity_sent = 0
+            retransmissions = 0
+            lost = set()  # Distinct packets judged lost on their first transmission, for the FEC rate
+            fec_recovered = 0
+            retries = {}  # Selective repeat: {seq_num: times retransmitted}, for timer backoff
+            later_acks = {}  # Selective repeat: {seq_num: ACKs seen for packets sent after it}
 
             # Wait for client connection
             while client_address is None:
@@ -51,50 +74,93 @@ def send_file(server_ip, server_port, enable_fast_recovery):
             # Now we can start sending packets
             while True:
                 # Window-based sending logic
-                while len(unacked_packets) < WINDOW_SIZE and seq_num < window_base + WINDOW_SIZE:
+                while len(unacked_packets) < window_size and seq_num < window_base + window_size:
                     chunk = file.read(MSS)
                     if not chunk:
                         break  # End of file
 
                     # Create and send the packet
-                    packet = create_packet(seq_num, chunk)
+                    packet = create_packet(seq_num, chunk, selective_repeat)
                     server_socket.sendto(packet, client_address)
                     unacked_packets[seq_num] = (packet, time.time())  # Track sent packets with timestamp
                     print(f"Sent packet {seq_num}")
+                    packets_sent += 1
+
+                    if enable_fec:
+                        fec_block.append((seq_num, chunk))
+                        if len(fec_block) >= fec_k:
+                            send_parity(server_socket, client_address, fec_block)
+                            parity_sent += 1
+                            fec_block = []
+                            fec_k = fec_block_size(len(lost) + fec_recovered, packets_sent)
                     seq_num += 1
 
+                if enable_fec and fec_block and not chunk:
+                    # Protect the final, partial block as well
+                    send_parity(server_socket, client_address, fec_block)
+                    parity_sent += 1
+                    fec_block = []
+
                 if not unacked_packets and not chunk:
                     # If there are no unacknowledged packets and we reached EOF, break the loop
                     break
 
                 # Wait for ACKs and retransmit if needed
                 try:
-                    server_socket.settimeout(TimeoutInterval)  # Use the current timeout interval
+                    if selective_repeat:
+                        # Sleep only until the earliest per-packet timer fires
+                        server_socket.settimeout(next_timer(unacked_packets, retries, TimeoutInterval))
+                    else:
+                        server_socket.settimeout(TimeoutInterval)  # Use the current timeout interval
                     ack_packet, _ = server_socket.recvfrom(1024)
 
                     print(f"Received ACK packet: {ack_packet.decode()}")  # Log received ACK packet
 
                     # Validate that the ACK packet is JSON
-                    ack_seq_num = get_seq_no_from_ack_pkt(ack_packet)
+                    ack_seq_num, recovered, next_expected = get_seq_no_from_ack_pkt(ack_packet)
+
+                    if selective_repeat and next_expected is not None:
+                        # Everything below the client's next expected packet has arrived,
+                        # even if its own ACK was lost
+                        for acked in [s for s in unacked_packets if s < next_expected and s != ack_seq_num]:
+                            del unacked_packets[acked]
+                            retries.pop(acked, None)
+                            later_acks.pop(acked, None)
+                        window_base = min(unacked_packets, default=seq_num)
 
                     if ack_seq_num in unacked_packets:
+                        if recovered:
+                            fec_recovered += 1
+                            print(f"Packet {ack_seq_num} was rebuilt from parity by the client")
                         # Acknowledge received ACKs
                         print(f"Received ACK for packet {ack_seq_num}")
-                        send_time = unacked_packets[ack_seq_num][1]
-                        SampleRTT = time.time() - send_time
-                        print(f"SampleRTT for packet {ack_seq_num}: {SampleRTT:.4f} seconds")
-
-                        # Update EstimatedRTT and DevRTT
-                        EstimatedRTT = (1 - ALPHA) * EstimatedRTT + ALPHA * SampleRTT
-                        DevRTT = (1 - BETA) * DevRTT + BETA * abs(SampleRTT - EstimatedRTT)
-                        TimeoutInterval = EstimatedRTT + 4 * DevRTT
-                        print(f"Updated TimeoutInterval: {TimeoutInterval:.4f} seconds")
+                        # Karn's rule: an ACK for a retransmitted packet is ambiguous
+                        if ack_seq_num not in retries:
+                            send_time = unacked_packets[ack_seq_num][1]
+                            SampleRTT = time.time() - send_time
+                            print(f"SampleRTT for packet {ack_seq_num}: {SampleRTT:.4f} seconds")
+
+                            # Update EstimatedRTT and DevRTT
+                            EstimatedRTT = (1 - ALPHA) * EstimatedRTT + ALPHA * SampleRTT
+                            DevRTT = (1 - BETA) * DevRTT + BETA * abs(SampleRTT - EstimatedRTT)
+                            TimeoutInterval = EstimatedRTT + 4 * DevRTT
+                            print(f"Updated TimeoutInterval: {TimeoutInterval:.4f} seconds")
 
                         # Update state
                         del unacked_packets[ack_seq_num]  # Remove acknowledged packet
-
+                        retries.pop(ack_seq_num, None)
+                        later_acks.pop(ack_seq_num, None)
+
+                        if selective_repeat:
+                            # The window starts at the oldest packet still missing
+                            window_base = min(unacked_packets, default=seq_num)
+                            if enable_fast_recovery:
+                                resent = fast_retransmit_selective(server_socket, client_address, unacked_packets,
+                                                                   retries, later_acks, ack_seq_num)
+                                retransmissions += len(resent)
+                                lost.update(resent)
                         # Slide window forward if necessary
-                        if ack_seq_num > last_ack_received:
+                        elif ack_seq_num > last_ack_received:
                             last_ack_received = ack_seq_num
                             # Update window base
                             window_base = ack_seq_num
@@ -105,23 +171,37 @@ def send_file(server_ip, server_port, enable_fast_recovery):
                         duplicate_ack_count += 1
                         print(f"Duplicate ACK received for packet {ack_seq_num}, count={duplicate_ack_count}")
 
-                        # Check for fast recovery condition
-                        if enable_fast_recovery and duplicate_ack_count >= DUP_ACK_THRESHOLD:
+                        # Check for fast recovery condition (selective repeat detects losses
+                        # from the ACKs of later packets instead)
+                        if enable_fast_recovery and not selective_repeat and duplicate_ack_count >= DUP_ACK_THRESHOLD:
                             print("Entering fast recovery mode")
                             fast_recovery(server_socket, client_address, unacked_packets)
+                            retransmissions += 1
+                            lost.add(min(unacked_packets))
 
                 except socket.timeout:
-                    # Timeout handling: retransmit all unacknowledged packets
-                    print("Timeout occurred, retransmitting unacknowledged packets")
-                    retransmit_unacked_packets(server_socket, client_address, unacked_packets)
-                    # for seq in list(unacked_packets.keys()):
-                    #     print(f"Retransmitting packet {seq}")
-                    #     server_socket.sendto(unacked_packets[seq][0], client_address)
+                    if not selective_repeat:
+                        # Timeout handling: retransmit all unacknowledged packets
+                        print("Timeout occurred, retransmitting unacknowledged packets")
+                        retransmissions += retransmit_unacked_packets(server_socket, client_address, unacked_packets)
+                        # Only the window's first packet is known lost; the client discarded the rest
+                        if unacked_packets:
+                            lost.add(min(unacked_packets))
+
+                if selective_repeat:
+                    # Resend only the packets whose own timer has expired
+                    resent = retransmit_expired_packets(server_socket, client_address, unacked_packets,
+                                                        retries, TimeoutInterval)
+                    retransmissions += len(resent)
+                    lost.update(resent)
 
             # After all packets are sent and acknowledged
             end_packet = json.dumps({'seq_num': -1, 'data': ''}).encode()
             server_socket.sendto(end_packet, client_address)
             print("Sent END signal to client")
+            print(f"Sent {packets_sent} data packets, {parity_sent} parity packets, "
+                  f"{retransmissions} retransmissions, {fec_recovered} packets recovered by FEC, "
+                  f"{len(lost)} packets lost")
 
     except Exception as e:
         print(f"An error occurred: {e}")  # Handle any exceptions that occur in the try block
@@ -131,22 +211,61 @@ def send_file(server_ip, server_port, enable_fast_recovery):
 
 
 
-def create_packet(seq_num, data):
+def create_packet(seq_num, data, selective_repeat=False):
     """
-    Create a packet with the sequence number and data.
+    Create a packet with the sequence number and data. Selective-repeat
+    packets are marked, so the client acknowledges each on arrival.
     """
     packet = {
         'seq_num': seq_num,
         'data': data.decode('latin1')  # Convert bytes to a string for serialization
     }
+    if selective_repeat:
+        packet['sr'] = True
     return json.dumps(packet).encode()
 
+def create_parity_packet(block):
+    """
+    Create an XOR parity packet over a block of consecutive data packets.
+    Any single lost packet of the block can be rebuilt from the others.
+    """
+    size = max(len(chunk) for _, chunk in block)
+    parity = 0
+    for _, chunk in block:
+        parity ^= int.from_bytes(chunk.ljust(size, b'\0'), 'big')
+    packet = {
+        'seq_num': FEC_SEQ_NUM,
+        'base': block[0][0],
+        'lengths': [len(chunk) for _, chunk in block],
+        # XOR output is mostly unprintable, so base64 keeps it from tripling under JSON escaping
+        'data': base64.b64encode(parity.to_bytes(size, 'big')).decode('ascii')
+    }
+    return json.dumps(packet).encode()
+
+def send_parity(server_socket, client_address, block):
+    """
+    Send the parity packet protecting the given block.
+    """
+    server_socket.sendto(create_parity_packet(block), client_address)
+    print(f"Sent parity for packets {block[0][0]}-{block[-1][0]}")
+
+def fec_block_size(losses, packets_sent):
+    """
+    Pick the data packets per parity packet from the measured loss rate,
+    aiming for about a quarter of a loss per block so one parity usually suffices.
+    """
+    if packets_sent == 0 or losses == 0:
+        return MAX_FEC_K
+    loss_rate = losses / packets_sent
+    return max(MIN_FEC_K, min(MAX_FEC_K, int(1 / (4 * loss_rate))))
+
 def get_seq_no_from_ack_pkt(ack_packet):
     """
-    Extract sequence number from the ACK packet.
+    Extract sequence number from the ACK packet, whether the client
+    rebuilt that packet from parity, and the client's next expected packet.
     """
     ack = json.loads(ack_packet.decode())
-    return ack['ack_seq']
+    return ack['ack_seq'], ack.get('fec', False), ack.get('next')
 
 def retransmit_unacked_packets(server_socket, client_address, unacked_packets):
     """
@@ -155,6 +274,55 @@ def retransmit_unacked_packets(server_socket, client_address, unacked_packets):
     for seq_num, (packet, _) in unacked_packets.items():
         print(f"Retransmitting packet {seq_num}")
         server_socket.sendto(packet, client_address)
+    return len(unacked_packets)
+
+def next_timer(unacked_packets, retries, timeout_interval):
+    """
+    Seconds until the earliest per-packet retransmission timer expires.
+    Each retransmission of a packet doubles its timer.
+    """
+    if not unacked_packets:
+        return timeout_interval
+    timeout_interval = max(timeout_interval, MIN_TIMEOUT)
+    now = time.time()
+    deadline = min(sent + timeout_interval * 2 ** retries.get(seq_num, 0)
+                   for seq_num, (_, sent) in unacked_packets.items())
+    return max(deadline - now, 0.001)
+
+def retransmit_expired_packets(server_socket, client_address, unacked_packets, retries, timeout_interval):
+    """
+    Retransmit the unacknowledged packets whose own timer has expired and
+    restart their timers. Returns the sequence numbers retransmitted.
+    """
+    timeout_interval = max(timeout_interval, MIN_TIMEOUT)
+    now = time.time()
+    resent = []
+    for seq_num, (packet, sent) in unacked_packets.items():
+        if now - sent >= timeout_interval * 2 ** retries.get(seq_num, 0):
+            print(f"Timer expired, retransmitting packet {seq_num}")
+            server_socket.sendto(packet, client_address)
+            unacked_packets[seq_num] = (packet, now)
+            retries[seq_num] = retries.get(seq_num, 0) + 1
+            resent.append(seq_num)
+    return resent
+
+def fast_retransmit_selective(server_socket, client_address, unacked_packets, retries, later_acks, ack_seq_num):
+    """
+    Retransmit, once, each unacknowledged packet that DUP_ACK_THRESHOLD
+    packets sent after it have overtaken. Returns the sequence numbers retransmitted.
+    """
+    resent = []
+    for seq_num in unacked_packets:
+        if seq_num < ack_seq_num:
+            later_acks[seq_num] = later_acks.get(seq_num, 0) + 1
+            if later_acks[seq_num] == DUP_ACK_THRESHOLD:
+                print(f"Packet {seq_num} overtaken by {DUP_ACK_THRESHOLD} later packets, retransmitting it")
+                packet = unacked_packets[seq_num][0]
+                server_socket.sendto(packet, client_address)
+                unacked_packets[seq_num] = (packet, time.time())
+                retries.setdefault(seq_num, 0)  # No timer backoff, but no RTT sample either
+                resent.append(seq_num)
+    return resent
 
 def fast_recovery(server_socket, client_address, unacked_packets):
     """
@@ -165,13 +333,21 @@ def fast_recovery(server_socket, client_address, unacked_packets):
     packet, _ = unacked_packets[earliest_unacked_seq_num]
     server_socket.sendto(packet, client_address)
 
-# Parse command-line arguments
-parser = argparse.ArgumentParser(description='Reliable file transfer server over UDP.')
-parser.add_argument('server_ip', help='IP address of the server')
-parser.add_argument('server_port', type=int, help='Port number of the server')
-parser.add_argument('fast_recovery', type=int, help='Enable fast recovery (1 for True, 0 for False)')
+def main(argv=None):
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description='Reliable file transfer server over UDP.')
+    parser.add_argument('server_ip', help='IP address of the server')
+    parser.add_argument('server_port', type=int, help='Port number of the server')
+    parser.add_argument('fast_recovery', type=int, help='Enable fast recovery (1 for True, 0 for False)')
+    parser.add_argument('--fec', type=int, default=0, help='Enable XOR forward error correction (1 for True, 0 for False)')
+    parser.add_argument('--sr', type=int, default=0, help='Use selective repeat instead of Go-Back-N (1 for True, 0 for False)')
+    parser.add_argument('--window', type=int, default=None,
+                        help=f'Packets in flight (default {WINDOW_SIZE}, or {SR_WINDOW_SIZE} with selective repeat)')
+
+    args = parser.parse_args(argv)
 
-args = parser.parse_args()
+    # Run the server
+    send_file(args.server_ip, args.server_port, args.fast_recovery == 1, args.fec == 1, args.sr == 1, args.window)
 
-# Run the server
-send_file(args.server_ip, args.server_port, args.fast_recovery == 1)
+if __name__ == "__main__":
+    main()
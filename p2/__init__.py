@@ -0,0 +1,6 @@
+"""Part 2: TCP Reno-like congestion control over UDP.
+
+p2_server (sender) and p2_client (receiver) can be imported without side
+effects, e.g. ``from p2.p2_server import CongestionControl, create_packet``;
+their main() functions back the p2-server and p2-client commands.
+"""
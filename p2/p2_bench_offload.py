@@ -0,0 +1,80 @@
+"""Loopback benchmark for UDP segmentation and receive offload (GSO/GRO).
+
+Sends the same p2 data segments over loopback with one sendto per
+datagram and through OffloadSocket batches, to a receiver process
+reading one datagram per call or with GRO, and prints packets/s for
+both ends. Packets are built up front, so only the socket path is timed.
+
+Usage: python3 p2_bench_offload.py [packets]
+"""
+import base64
+import multiprocessing
+import os
+import socket
+import sys
+import time
+
+from p2_server import OffloadSocket, create_packet, MSS, GSO_MAX_SEGMENTS
+from p2_client import enable_gro, receive_datagrams
+
+SOCKET_BUFFER = 4 * 1024 * 1024  # Receive buffer asked for, so the receiver drops as little as it can
+IDLE_TIMEOUT = 0.5  # Seconds without a datagram before the receiver reports
+
+def receive(gro, ready, results):
+    """Count datagrams until the sender goes quiet; report (count, seconds from first to last)"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER)
+    sock.bind(('127.0.0.1', 0))
+    if gro:
+        gro = enable_gro(sock)
+    ready.put(sock.getsockname())
+    sock.settimeout(IDLE_TIMEOUT)
+    count, first, last = 0, None, None
+    try:
+        while True:
+            count += len(receive_datagrams(sock, gro))
+            last = time.perf_counter()
+            if first is None:
+                first = last
+    except socket.timeout:
+        pass
+    results.put((count, (last - first) if count > 1 else None))
+
+def send(packets, address, offload):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if offload:
+        if not OffloadSocket.supported(sock):
+            return None
+        sock = OffloadSocket(sock)
+    started = time.perf_counter()
+    for i, packet in enumerate(packets, 1):
+        sock.sendto(packet, address)
+        if offload and i % GSO_MAX_SEGMENTS == 0:
+            sock.flush()
+    if offload:
+        sock.flush()
+    elapsed = time.perf_counter() - started
+    sock.close()
+    return elapsed
+
+def run(count):
+    data = base64.b64encode(os.urandom(MSS))[:MSS]
+    packets = [create_packet(i * MSS, data, cid=0x1234abcd, ts=time.time()) for i in range(count)]
+    print(f"{count} packets of {len(packets[0])} bytes over loopback\n")
+    print(f"{'send':<8}{'receive':<9}{'send pkt/s':>12}{'recv pkt/s':>12}{'received':>10}")
+    for offload, gro in ((False, False), (True, False), (False, True), (True, True)):
+        ready, results = multiprocessing.Queue(), multiprocessing.Queue()
+        receiver = multiprocessing.Process(target=receive, args=(gro, ready, results))
+        receiver.start()
+        address = ready.get()
+        elapsed = send(packets, address, offload)
+        received, receive_time = results.get()
+        receiver.join()
+        if elapsed is None:
+            print(f"{'gso':<8}{'-':<9}  not supported here")
+            continue
+        print(f"{'gso' if offload else 'sendto':<8}{'gro' if gro else 'recvfrom':<9}{count / elapsed:>12.0f}"
+              f"{received / receive_time if receive_time else 0:>12.0f}{received:>10}")
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
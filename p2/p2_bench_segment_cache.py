@@ -0,0 +1,52 @@
+"""CPU cost of sending a file's segments to many clients, with and without a SegmentCache.
+
+Cuts a file into MSS segments and sends it once per client the way
+send_segment does: read the segment (hashing it into the stream
+digest), then build its packet. Each client has its own connection ID
+and sequence numbers, so only the segment itself can be shared. Prints
+microseconds per segment, MB/s of CPU and the cache's hit rate, and
+checks every client's stream digest against the file's.
+
+Usage: python3 p2_bench_segment_cache.py [file] [clients]
+"""
+import hashlib
+import os
+import sys
+import time
+
+from p2_server import SegmentCache, create_packet, open_source, MSS
+
+def build(path, clients, cache, digest):
+    started = time.process_time()
+    for client in range(clients):
+        cid = 0x1000 + client
+        stream = open_source(path)
+        offset = 0
+        while True:
+            if cache:
+                entry = cache.read(stream, offset, MSS)
+                data, encoded = (entry.data, entry.encoded) if entry else (b'', None)
+            else:
+                data, encoded = stream.read(MSS), None
+            if not data:
+                break
+            create_packet(offset + client, data, cid=cid, ts=time.time(), encoded=encoded)
+            offset += len(data)
+        stream.close()
+        assert stream.hasher.hexdigest() == digest, f"client {client} sent a different stream"
+    return time.process_time() - started
+
+def run(path, clients):
+    with open(path, 'rb') as f:
+        content = f.read()
+    digest = hashlib.md5(content).hexdigest()
+    total = -(-len(content) // MSS) * clients
+    print(f"{path}: {len(content)} bytes, {total // clients} segments, {clients} clients\n")
+    print(f"{'':<12}{'us/segment':>12}{'MB/s':>10}{'hit rate':>10}")
+    for name, cache in (('no cache', None), ('cache', SegmentCache())):
+        elapsed = build(path, clients, cache, digest)
+        hit_rate = f"{cache.hits / (cache.hits + cache.misses):.1%}" if cache else '-'
+        print(f"{name:<12}{elapsed / total * 1e6:>12.2f}{len(content) * clients / elapsed / 1e6:>10.1f}{hit_rate:>10}")
+
+if __name__ == "__main__":
+    run(sys.argv[1] if len(sys.argv) > 1 else 'input.txt', int(sys.argv[2]) if len(sys.argv) > 2 else 10)
@@ -2,109 +2,873 @@ import socket
 import argparse
 import json
 import time
+import os
+import hashlib
+import zlib
+import base64
+import random
+import struct
+import functools
+import sys
+import selectors
+
+try:
+    from .p2_common import StageProfiler, encode_options, decode_options
+except ImportError:
+    # Run as a script from this directory
+    from p2_common import StageProfiler, encode_options, decode_options
 
 # Constants
 MSS = 1400  # Maximum Segment Size
-BUFFER_SIZE = MSS + 200  # Buffer size for receiving packets
+BUFFER_SIZE = 65535  # Largest UDP datagram; JSON-escaped binary segments can be several times MSS
+CHECKPOINT_INTERVAL = 1.0  # Seconds between checkpoint flushes
+MAX_IDLE_TIMEOUTS = 15  # Consecutive timeouts before giving up (the checkpoint is kept)
+COMPRESSION = 'zlib'  # Compression scheme offered to the server
+MAX_SYN_RETRIES = 8  # SYN retransmissions before giving up on the server
+INITIAL_SYN_TIMEOUT = 1.0  # First SYN retransmission timeout, doubled on every retry
+MAX_EARLY_PACKETS = 64  # Fast-open segments kept while the SYN-ACK is outstanding
+MAX_SACK_BLOCKS = 8  # Out-of-order ranges reported per ACK
+SEQ_BITS = 32  # Width of wire sequence and ACK numbers; they wrap, stream offsets never do
+RCV_WINDOW = 16 * 1024 * 1024  # Default receive window: bytes the server may have beyond our cumulative ACK
+MAX_WSCALE = 14  # Largest window scale shift (RFC 7323)
+UDP_GRO = 104  # Linux UDP receive coalescing (GRO) option, from <linux/udp.h>
+PAWS_WINDOW = 1.0  # Seconds a segment's timestamp may lag TS.Recent before it counts as an old duplicate
+WINDOW_UPDATE_INTERVAL = 0.05  # Seconds between checks for window freed by the disk while it is shut
+STREAM_WINDOW = 1024 * 1024  # Bytes each stream of a multiplexed session may run ahead of its delivered data
 
 class CongestionControl:
-    def __init__(self):
-        self.rwnd = float('inf')  # Receive window (unlimited for this implementation)
+    def __init__(self, rwnd=RCV_WINDOW):
+        self.rwnd = rwnd  # Receive window advertised to the server
         self.last_byte_received = -1
         self.out_of_order_packets = {}
-        print("Initialized CongestionControl with unlimited receive window")
+        print(f"Initialized CongestionControl with a {rwnd}-byte receive window")
+
+class Connection:
+    """Client end of a connection, identified by a random connection ID"""
+    def __init__(self, client_socket, server_address):
+        self.socket = client_socket
+        self.server_address = server_address
+        self.cid = random.getrandbits(32)
+        self.isn = None  # Server's wire sequence number for stream byte 0
+        self.seq_bits = SEQ_BITS  # Agreed width of sequence numbers
+        self.rwnd = RCV_WINDOW  # Receive window; what is left of it goes in every ACK
+        self.buffered = 0  # Out-of-order bytes held beyond the cumulative ACK
+        self.writer = None  # WriteBehind, if writes are taken off the receive path
+        self.advertised = RCV_WINDOW  # Window in our latest ACK
+        self.options = {}  # Options the server agreed to in its SYN-ACK
+        self.requests = []  # Session requests [id, name] the server has not started yet
+        self.ts_recent = None  # Latest send timestamp of a segment at the left edge, echoed in ACKs
+        self.ts_last = None  # Send timestamp of the segment just received, echoed once to time its path
+        self.streams = None  # StreamReassembler, if the session is multiplexed
+
+    def wire_seq(self, offset):
+        """Translate a stream offset into a wire sequence number, modulo the sequence space"""
+        return (self.isn + offset) & ((1 << self.seq_bits) - 1)
+
+    def stream_offset(self, wire_seq, near):
+        """Translate a wire sequence number into the stream offset closest to near.
+
+        Serial number arithmetic (RFC 1982): the number is taken to lie
+        within half the sequence space of near, before or after it.
+        """
+        space = 1 << self.seq_bits
+        delta = (wire_seq - self.isn - near) % space
+        if delta >= space // 2:
+            delta -= space
+        return near + delta
 
-def receive_file(server_ip, server_port, output_file_path):
+    def window(self):
+        """Receive window left: out-of-order data and writes still queued for the disk come out of it"""
+        queued = self.writer.queued if self.writer else 0
+        return max(self.rwnd - self.buffered - queued, 0)
+
+    def window_closed(self):
+        """True while our latest ACK left the server no room for a full segment"""
+        return 'wscale' in self.options and self.advertised < self.options.get('mss', MSS)
+
+class PathSockets:
+    """One UDP socket per path, behind the socket calls the receive loop makes.
+
+    paths is [(socket, server_address)], path 0 being the connection's own.
+    Datagrams are taken from the paths in turn; replies go out on the path
+    the latest one came in on, so each ACK retraces its segment's path.
     """
-    Receive file from server with reliability and flow control
+    def __init__(self, paths):
+        self.paths = paths
+        self.selector = selectors.DefaultSelector()
+        for i, (sock, _) in enumerate(paths):
+            sock.setblocking(False)
+            self.selector.register(sock, selectors.EVENT_READ, i)
+        self.timeout = None
+        self.ready = []  # Paths that may have datagrams waiting
+        self.last = 0  # Path of the latest datagram
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def recvfrom(self, size):
+        while True:
+            while self.ready:
+                i = self.ready.pop(0)
+                try:
+                    packet, address = self.paths[i][0].recvfrom(size)
+                except BlockingIOError:
+                    continue
+                self.ready.append(i)
+                self.last = i
+                return packet, address
+            events = self.selector.select(self.timeout)
+            if not events:
+                raise socket.timeout('timed out')
+            self.ready = [key.data for key, _ in events]
+
+    def sendto(self, data, address):
+        """Send on the latest datagram's path, to that path's server address"""
+        return self.send_on(self.last, data)
+
+    def send_on(self, i, data):
+        sock, server_address = self.paths[i]
+        return sock.sendto(data, server_address)
+
+    def close(self):
+        self.selector.close()
+        for sock, _ in self.paths:
+            sock.close()
+
+class WriteBehind:
+    """Writes segments to the output file on a background thread, so a slow disk never holds up an ACK.
+
+    Queued segments stay readable until they are on disk. Their bytes come
+    out of the receive window, which is what bounds the queue; write only
+    blocks if a sender ignores the window and max_bytes fill up. Checkpoints
+    are queued behind the writes they cover and saved, fsync and all, by
+    the same thread.
+    """
+    def __init__(self, file, max_bytes):
+        # Only imported when write-behind is on, keeping startup fast
+        import queue
+        import threading
+        self.fd = file.fileno()
+        self.max_bytes = max_bytes
+        self.queue = queue.Queue()
+        self.pending = {}  # {offset: data} not yet on disk
+        self.queued = 0  # Bytes not yet on disk
+        self.space = threading.Condition()
+        self.error = None
+        self.checkpointing = False  # A checkpoint is queued and not saved yet
+        self.thread = threading.Thread(target=self.run, name='write-behind', daemon=True)
+        self.thread.start()
+
+    def write(self, offset, data):
+        if self.error:
+            raise self.error
+        with self.space:
+            while self.queued and self.queued + len(data) > self.max_bytes:
+                self.space.wait()
+            self.pending[offset] = data
+            self.queued += len(data)
+        self.queue.put((offset, data))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            offset, data = item
+            if offset is None:
+                # Every write queued before the checkpoint is done; a failed one voids it
+                if not self.error:
+                    try:
+                        data()
+                    except OSError as e:
+                        print(f"Checkpoint failed: {e}")
+                self.checkpointing = False
+                continue
+            written = False
+            try:
+                # Positional, so reads on the receive thread never move a shared file offset
+                os.pwrite(self.fd, data, offset)
+                written = True
+            except OSError as e:
+                self.error = e
+            with self.space:
+                # A failed write stays pending, so no checkpoint claims it
+                if written and self.pending.get(offset) is data:
+                    del self.pending[offset]
+                self.queued -= len(data)
+                self.space.notify()
+
+    def read(self, offset, length):
+        """Return length bytes at offset, from the queue if they are not on disk yet"""
+        with self.space:
+            data = self.pending.get(offset)
+        if data is not None and len(data) >= length:
+            return data[:length]
+        return os.pread(self.fd, length, offset)
+
+    def checkpoint(self, save):
+        """Queue save to run once everything written so far is on disk; skipped while one is pending"""
+        if self.checkpointing:
+            return
+        self.checkpointing = True
+        self.queue.put((None, save))
+
+    def durable(self, expected_seq_num, packet_buffer):
+        """The prefix and out-of-order ranges already on disk, for a checkpoint"""
+        with self.space:
+            pending = set(self.pending)
+        prefix = min([offset for offset in pending if offset < expected_seq_num], default=expected_seq_num)
+        return prefix, {start: length for start, length in packet_buffer.items() if start not in pending}
+
+    def close(self):
+        """Finish every queued write"""
+        self.queue.put(None)
+        self.thread.join()
+
+class SessionDemuxer:
+    """Splits the in-order session stream back into files.
+
+    Stands in for the stream hasher, so it sees every byte exactly once and
+    in order. The server frames each file as a length-prefixed JSON header,
+    the raw bytes, and a length-prefixed JSON trailer with the file's MD5.
+    """
+    def __init__(self, prefix, requests):
+        self.prefix = prefix
+        self.requests = requests  # Pruned as each file's header arrives
+        self.stream_hasher = hashlib.md5()
+        self.buffer = b''
+        self.header = None  # Header of the file being received
+        self.file = None
+        self.file_hasher = None
+        self.remaining = 0
+        self.received = 0
+        self.failed = 0
+        self.last_done = time.time()
+
+    def update(self, data):
+        self.stream_hasher.update(data)
+        self.buffer += data
+        while True:
+            if self.remaining:
+                chunk = self.buffer[:self.remaining]
+                if not chunk:
+                    return
+                self.file.write(chunk)
+                self.file_hasher.update(chunk)
+                self.remaining -= len(chunk)
+                self.buffer = self.buffer[len(chunk):]
+                continue
+            payload = self.next_frame()
+            if payload is None:
+                return
+            if self.header is None:
+                self.start_file(payload)
+            else:
+                self.finish_file(payload)
+
+    def next_frame(self):
+        """Pop the next length-prefixed JSON frame, or None if incomplete"""
+        if len(self.buffer) < 4:
+            return None
+        length = struct.unpack_from('!I', self.buffer)[0]
+        if len(self.buffer) < 4 + length:
+            return None
+        payload = json.loads(self.buffer[4:4 + length])
+        self.buffer = self.buffer[4 + length:]
+        return payload
+
+    def start_file(self, header):
+        self.header = header
+        self.requests[:] = [r for r in self.requests if r[0] != header['id']]
+        if 'error' in header:
+            return
+        path = self.prefix + os.path.basename(header['name'])
+        self.file = open(path, 'wb')
+        self.file_hasher = hashlib.md5()
+        self.remaining = header['size']
+        print(f"Receiving {header['name']} ({header['size']} bytes) into {path}")
+
+    def finish_file(self, trailer):
+        name = self.header['name']
+        elapsed = time.time() - self.last_done
+        self.last_done = time.time()
+        if 'error' in self.header:
+            print(f"Server could not send {name}: {self.header['error']}")
+            self.failed += 1
+        else:
+            self.file.close()
+            if trailer.get('digest') == self.file_hasher.hexdigest():
+                print(f"Received {name}: {self.header['size']} bytes in {elapsed:.3f}s, digest verified")
+                self.received += 1
+            else:
+                print(f"Received {name} with a digest MISMATCH")
+                self.failed += 1
+        self.header = None
+        self.file = None
+
+    def hexdigest(self):
+        return self.stream_hasher.hexdigest()
+
+class StreamReassembler:
+    """Puts each stream of a multiplexed session back in order, independently of the others.
+
+    Segments carry their stream id and the offset in that stream. A
+    stream's bytes reach its own SessionDemuxer as soon as they are
+    contiguous, so a loss on one stream never holds up the rest. Every ACK
+    grants each unfinished stream window bytes past what it has delivered.
+    """
+    def __init__(self, prefix, requests, window=STREAM_WINDOW):
+        self.prefix = prefix
+        self.requests = requests
+        self.window = window
+        self.streams = {}  # Stream id -> [next offset, {offset: data held out of order}, SessionDemuxer]
+
+    def deliver(self, stream_id, offset, data):
+        if stream_id not in self.streams:
+            self.streams[stream_id] = [0, {}, SessionDemuxer(self.prefix, self.requests)]
+        stream = self.streams[stream_id]
+        if offset < stream[0] or offset in stream[1]:
+            return
+        stream[1][offset] = data
+        while stream[0] in stream[1]:
+            chunk = stream[1].pop(stream[0])
+            stream[2].update(chunk)
+            stream[0] += len(chunk)
+
+    def grants(self):
+        """[stream id, offset it may be sent up to] for every stream still open"""
+        return [[stream_id, stream[0] + self.window] for stream_id, stream in self.streams.items()
+                if not (stream[2].received or stream[2].failed)]
+
+    @property
+    def received(self):
+        return sum(stream[2].received for stream in self.streams.values())
+
+    @property
+    def failed(self):
+        return sum(stream[2].failed for stream in self.streams.values())
+
+def receive_file(server_ip, server_port, output_file_path, compress=False, fast_open=False,
+                 requests=None, session_prefix='', cc_algorithm=None, weight=None, profiler=None, seq_bits=SEQ_BITS,
+                 window=RCV_WINDOW, sock_buffer=None, offload=False, write_behind=False, paths=None,
+                 streams=False, priorities=None):
+    """
+    Receive file from server with reliability and flow control.
+
+    Progress is checkpointed next to the output file so an interrupted
+    transfer resumes from the byte ranges already on disk.
+
+    With requests, the connection is a session fetching each named file in
+    turn; each file is written to session_prefix + its base name, and
+    output_file_path only spools segments that arrive ahead of the
+    in-order prefix until it catches up with them. With streams, the
+    files come on streams of their own instead, all at once, with the
+    given priorities (lowest first, in request order); each stream is
+    written straight to its file and nothing is spooled.
+
+    A StageProfiler, if given, times the socket calls, file writes and
+    digest updates. A small seq_bits makes sequence numbers wrap early,
+    for testing. window is the receive window offered to the server and
+    sock_buffer the SO_RCVBUF size to ask for. offload has the kernel
+    coalesce arriving segments (UDP GRO) where it can. write_behind moves
+    file writes onto a WriteBehind thread, shrinking the window instead
+    of delaying ACKs while the disk is slow.
+
+    paths lists extra paths to the server as (server_ip, server_port,
+    local_ip or None); if the server agrees to multipath, each is joined
+    to the connection and the server spreads segments over all of them.
     """
     print(f"\nInitializing client connecting to {server_ip}:{server_port}")
     client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     client_socket.settimeout(2)
     print("Socket created with 2 second timeout")
+    path_sockets = [(client_socket, (server_ip, server_port))]
+    for path_ip, path_port, local_ip in paths or []:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((local_ip or '', 0))
+        print(f"Path {len(path_sockets)}: {sock.getsockname()[0]} to {path_ip}:{path_port}")
+        path_sockets.append((sock, (path_ip, path_port)))
+    if sock_buffer:
+        for sock, _ in path_sockets:
+            size_socket_buffer(sock, sock_buffer)
+    if paths:
+        client_socket = PathSockets(path_sockets)
+        client_socket.settimeout(2)
+    if profiler:
+        client_socket = profiler.wrap(client_socket, sendto='sendto', recvfrom='recvfrom')
     
     server_address = (server_ip, server_port)
-    cc = CongestionControl()
+    cc = CongestionControl(window)
     
     print(f"Output will be written to: {output_file_path}")
+    checkpoint_path = output_file_path + '.ckpt'
+    checkpoint = load_checkpoint(checkpoint_path)
     
+    # Out-of-order segments are written to disk at their offset right away;
+    # the buffer only remembers {seq_num: length} until the prefix reaches them
     packet_buffer = {}
     expected_seq_num = 0
+    file = None
+    writer = None
+    file_id = None
+    complete = False
+    idle_timeouts = 0
+    received = []  # Datagrams split out of the last coalesced receive
+    gro = False
+    joining = set()  # Extra paths whose JOIN the server has not confirmed
+    last_checkpoint = time.time()
+    corrupt_segments = 0
+    paws_drops = 0
+    # Digest of the contiguous prefix, updated as it is written in order
+    hasher = hashlib.md5()
+    digest_verified = False
     
-    # Initial connection
-    print("Sending START signal to server...")
-    client_socket.sendto(b"START", server_address)
-    print("START signal sent")
+    # Offer our options, and the checkpoint if there is one
+    # The window goes in every ACK as well, scaled down to fit 16 bits
+    wscale = min(max(cc.rwnd.bit_length() - 16, 0), MAX_WSCALE)
+    options = {'mss': MSS, 'window': min(cc.rwnd, 0xFFFFFFFF), 'fast_open': fast_open, 'sack': True,
+               'timestamps': True, 'seq_bits': seq_bits, 'wscale': wscale}
+    if compress:
+        options['compress'] = COMPRESSION
+    if cc_algorithm:
+        options['cc'] = cc_algorithm
+    if weight:
+        options['weight'] = weight
+    if paths:
+        options['multipath'] = len(path_sockets)
+    if checkpoint:
+        print(f"Found checkpoint {checkpoint_path}, asking server to resume")
+        options['resume'] = checkpoint
+    conn = Connection(client_socket, server_address)
+    conn.rwnd = cc.rwnd
+    if requests:
+        # Every request is pipelined up front
+        conn.requests = [[i, name] for i, name in enumerate(requests)]
+        options['session'] = {'requests': conn.requests, 'last': True}
+        hasher = SessionDemuxer(session_prefix, conn.requests)
+        if streams:
+            options['streams'] = {'window': STREAM_WINDOW,
+                                  'priority': [[i, priority] for i, priority in enumerate(priorities or [])]}
     
-    with open(output_file_path, 'wb') as file:
-        print("Output file opened for writing")
+    try:
+        early_packets = connect(conn, options)
+        if early_packets is None:
+            return False
+        if requests and 'session' not in conn.options:
+            print("Server is not serving sessions, closing")
+            return False
+        if streams and 'streams' in conn.options:
+            # Each stream is reordered on its own and checked against its files' digests, so
+            # the connection only tracks which byte ranges have arrived and keeps no bytes
+            conn.streams = StreamReassembler(session_prefix, conn.requests)
+            hasher = None
+            print("Server is multiplexing the files as streams")
+        elif streams:
+            print("Server does not multiplex streams, receiving the files in turn")
+        if profiler and hasher is not None:
+            hasher = profiler.wrap(hasher, update='digest')
+        
+        file_id = conn.options.get('file_id')
+        if conn.options.get('compress'):
+            print(f"Server agreed to {conn.options['compress']} compression")
+        if conn.options.get('cc'):
+            print(f"Server is using {conn.options['cc']} congestion control")
+        if paths:
+            agreed = conn.options.get('multipath', 1)
+            print(f"Server agreed to {agreed} of {len(path_sockets)} paths")
+            joining = set(range(1, agreed))
+        if conn.streams:
+            print("Streams are written straight to their files, nothing to spool")
+        elif conn.options.get('resumed') and checkpoint:
+            expected_seq_num, packet_buffer = restore_checkpoint(checkpoint)
+            conn.buffered = sum(packet_buffer.values())
+            cc.last_byte_received = expected_seq_num - 1
+            file = open(output_file_path, 'r+b')
+            hash_range(file, hasher, 0, expected_seq_num)
+            print(f"Resuming at byte {expected_seq_num} with {len(packet_buffer)} buffered ranges")
+        else:
+            file = open(output_file_path, 'w+b')
+            print("Output file opened for writing")
+        if write_behind and file is not None:
+            # The window bounds what can be queued
+            writer = conn.writer = WriteBehind(file, conn.rwnd)
+        if profiler:
+            if writer:
+                writer = profiler.wrap(writer, write='write')
+            elif file is not None:
+                file = profiler.wrap(file, write='write')
+        # Only now, so fast-open data that raced the SYN-ACK is never coalesced into it
+        if offload and paths:
+            print("UDP receive offload is not used with several paths")
+        elif offload:
+            gro = enable_gro(client_socket)
+        # Completes the handshake
+        send_ack(conn, expected_seq_num - 1)
+        for path in sorted(joining):
+            send_join(conn, path)
+        
         while True:
             try:
-                print(f"\nWaiting for packet... (expecting sequence number {expected_seq_num})")
-                packet, _ = client_socket.recvfrom(BUFFER_SIZE)
-                packet_data = parse_packet(packet)
+                if early_packets:
+                    packet_data = early_packets.pop(0)
+                else:
+                    if not received:
+                        print(f"\nWaiting for packet... (expecting sequence number {expected_seq_num})")
+                        # While the disk holds the window shut, wake up to reopen it
+                        client_socket.settimeout(WINDOW_UPDATE_INTERVAL if conn.window_closed() else 2)
+                        received = receive_datagrams(client_socket, gro)
+                    packet_data = parse_packet(received.pop(0))
                 
                 if packet_data is None:
                     print("Received invalid packet, continuing...")
                     continue
+                if packet_data.get('cid') != conn.cid:
+                    print("Packet for another connection, ignoring")
+                    continue
+                idle_timeouts = 0
+                
+                if packet_data.get('keepalive'):
+                    # The server's source is quiet, but the server is still there
+                    print("Keepalive received, server has nothing to send yet")
+                    continue
+                if 'join' in packet_data:
+                    if packet_data['join'] in joining:
+                        joining.discard(packet_data['join'])
+                        print(f"Path {packet_data['join']} joined")
+                    continue
+                if packet_data.get('syn'):
+                    # Our handshake ACK was lost; confirm again
+                    send_ack(conn, expected_seq_num - 1)
+                    continue
                     
-                seq_num = packet_data['seq_num']
-                data = packet_data['data']
+                wire_seq = packet_data['seq_num']
+                data = packet_data['data'].encode('latin1')
+                seq_num = conn.stream_offset(wire_seq, expected_seq_num)
                 print(f"Received packet with sequence number {seq_num}")
                 
-                if seq_num == -1:
-                    print("\n=== File transfer complete ===")
-                    break
+                # Drop corrupted segments before they reach the file
+                if 'crc' in packet_data and packet_data['crc'] != segment_checksum(wire_seq, data):
+                    corrupt_segments += 1
+                    print(f"Checksum mismatch on segment {seq_num}, dropping it ({corrupt_segments} corrupt so far)")
+                    continue
+                if packet_data.get('z'):
+                    try:
+                        data = zlib.decompress(base64.b64decode(data))
+                    except (ValueError, zlib.error):
+                        corrupt_segments += 1
+                        print(f"Segment {seq_num} failed to decompress, dropping it")
+                        continue
+                # PAWS (RFC 7323): once numbers wrap, a segment delayed long enough could
+                # alias new data; its send timestamp gives it away
+                ts = packet_data.get('ts')
+                if ts is not None and conn.ts_recent is not None and ts < conn.ts_recent - PAWS_WINDOW:
+                    paws_drops += 1
+                    print(f"Segment {seq_num} sent {conn.ts_recent - ts:.3f} s before TS.Recent, dropping it (PAWS)")
+                    continue
+                # Echoed in ACKs so the server can tell which copy of a segment arrived. As in
+                # RFC 7323, only segments at the left edge count and the value never goes back,
+                # so a late original overtaken by its retransmission cannot pass for it
+                if ts is not None and seq_num <= expected_seq_num and (conn.ts_recent is None or ts > conn.ts_recent):
+                    conn.ts_recent = ts
+                conn.ts_last = ts
+                
+                if packet_data.get('fin'):
+                    # FIN carries the final stream length; only accept it once
+                    # every byte before it has been written
+                    if seq_num == expected_seq_num:
+                        print(f"FIN received after {expected_seq_num} bytes, sending FIN-ACK")
+                        if conn.streams:
+                            # Every stream has been delivered up to here, so every file has been checked
+                            digest_verified = conn.streams.received == len(requests) and not conn.streams.failed
+                            print(f"Streams complete, {conn.streams.received} of {len(requests)} file digests verified")
+                        elif packet_data.get('digest') == hasher.hexdigest():
+                            digest_verified = True
+                            print(f"File digest verified: {hasher.hexdigest()}")
+                        else:
+                            print(f"File digest MISMATCH: expected {packet_data.get('digest')}, got {hasher.hexdigest()}")
+                        send_ack(conn, expected_seq_num - 1, fin=True, verified=digest_verified)
+                        complete = True
+                        print("\n=== File transfer complete ===")
+                        break
+                    print(f"FIN received early (seq={seq_num}, expected={expected_seq_num}), ignoring")
+                    send_ack(conn, cc.last_byte_received, sack=sack_blocks(packet_buffer))
+                    continue
+                    
+                # A stream's bytes are delivered as soon as that stream is contiguous
+                if conn.streams and 'sid' in packet_data and seq_num >= expected_seq_num and seq_num not in packet_buffer:
+                    conn.streams.deliver(packet_data['sid'], packet_data['off'], data)
                     
                 # Handle in-order packet
                 if seq_num == expected_seq_num:
                     print(f"In-order packet received (seq={seq_num})")
-                    file.write(data.encode('latin1'))
+                    # In a session the demuxer writes the files, so only early segments are spooled
+                    if requests:
+                        pass
+                    elif writer:
+                        writer.write(seq_num, data)
+                    else:
+                        file.seek(seq_num)
+                        file.write(data)
+                    if hasher is not None:
+                        hasher.update(data)
                     print(f"Wrote {len(data)} bytes to file")
                     expected_seq_num += len(data)
                     
-                    # Process any buffered in-order packets
+                    # Skip over buffered segments that are already on disk,
+                    # reading them back (from the page cache) for the digest
                     while expected_seq_num in packet_buffer:
                         print(f"Processing buffered packet (seq={expected_seq_num})")
-                        buffered_data = packet_buffer.pop(expected_seq_num)
-                        file.write(buffered_data.encode('latin1'))
-                        print(f"Wrote buffered data of {len(buffered_data)} bytes to file")
-                        expected_seq_num += len(buffered_data)
+                        length = packet_buffer.pop(expected_seq_num)
+                        conn.buffered -= length
+                        if hasher is None:
+                            pass
+                        elif writer:
+                            hasher.update(writer.read(expected_seq_num, length))
+                        else:
+                            hash_range(file, hasher, expected_seq_num, length)
+                        expected_seq_num += length
                         
                     # Send cumulative ACK
                     print(f"Sending cumulative ACK for sequence number {expected_seq_num - 1}")
-                    send_ack(client_socket, server_address, expected_seq_num - 1)
+                    send_ack(conn, expected_seq_num - 1, sack=sack_blocks(packet_buffer))
                     cc.last_byte_received = expected_seq_num - 1
                     
                 # Handle out-of-order packet
                 elif seq_num > expected_seq_num:
                     print(f"Out-of-order packet received (seq={seq_num}, expected={expected_seq_num})")
-                    packet_buffer[seq_num] = data
+                    dsack = (seq_num, seq_num + len(data)) if seq_num in packet_buffer else None
+                    if file is None:
+                        pass
+                    elif writer:
+                        writer.write(seq_num, data)
+                    else:
+                        file.seek(seq_num)
+                        file.write(data)
+                    if dsack is None:
+                        conn.buffered += len(data)
+                    packet_buffer[seq_num] = len(data)
                     print(f"Packet buffered. Current buffer size: {len(packet_buffer)} packets")
                     # Send duplicate ACK for the last in-order byte received
                     print(f"Sending duplicate ACK for last in-order byte {cc.last_byte_received}")
-                    send_ack(client_socket, server_address, cc.last_byte_received)
+                    send_ack(conn, cc.last_byte_received, sack=sack_blocks(packet_buffer, seq_num), dsack=dsack)
                     
                 # Handle duplicate packet
                 else:
                     print(f"Duplicate or old packet received (seq={seq_num}, expected={expected_seq_num})")
                     # Send duplicate ACK
                     print(f"Sending duplicate ACK for sequence number {cc.last_byte_received}")
-                    send_ack(client_socket, server_address, cc.last_byte_received)
+                    send_ack(conn, cc.last_byte_received, sack=sack_blocks(packet_buffer),
+                             dsack=(seq_num, seq_num + len(data)))
+                
+                if file_id and time.time() - last_checkpoint >= CHECKPOINT_INTERVAL:
+                    if writer:
+                        # The writer thread saves it behind the writes it covers, keeping fsync off this loop
+                        writer.checkpoint(functools.partial(save_checkpoint, checkpoint_path, file, file_id,
+                                                            expected_seq_num, dict(packet_buffer)))
+                    else:
+                        save_checkpoint(checkpoint_path, file, file_id, expected_seq_num, packet_buffer)
+                    last_checkpoint = time.time()
                     
             except socket.timeout:
+                if conn.window_closed():
+                    # A stalled disk, not an idle server: tell the server as soon as room frees up
+                    if conn.window() >= conn.options.get('mss', MSS):
+                        print(f"Disk caught up, reopening the window to {conn.window()} bytes")
+                        send_ack(conn, cc.last_byte_received, sack=sack_blocks(packet_buffer))
+                    continue
                 print("\nTimeout occurred while waiting for data")
-                # Send duplicate ACK on timeout
-                if cc.last_byte_received >= 0:
+                for path in sorted(joining):
+                    send_join(conn, path)
+                idle_timeouts += 1
+                if idle_timeouts >= MAX_IDLE_TIMEOUTS:
+                    print(f"No data for {idle_timeouts} timeouts, giving up")
+                    break
+                # Send duplicate ACK on timeout, which also repeats pending requests
+                if cc.last_byte_received >= 0 or conn.requests:
                     print(f"Sending timeout-triggered duplicate ACK for sequence number {cc.last_byte_received}")
-                    send_ack(client_socket, server_address, cc.last_byte_received)
+                    send_ack(conn, cc.last_byte_received, sack=sack_blocks(packet_buffer))
             except Exception as e:
                 print(f"\nError occurred: {e}")
                 break
+    finally:
+        if writer:
+            writer.close()
+            if writer.error:
+                print(f"Writing {output_file_path} failed: {writer.error}")
+                complete = False
+        if corrupt_segments:
+            print(f"Dropped {corrupt_segments} corrupt segments")
+        if paws_drops:
+            print(f"Dropped {paws_drops} old duplicate segments (PAWS)")
+        if file is not None:
+            if complete:
+                file.truncate(expected_seq_num)
+                # A digest mismatch means the checkpointed data is bad as well
+                if os.path.exists(checkpoint_path):
+                    os.remove(checkpoint_path)
+            elif file_id:
+                if writer:
+                    save_checkpoint(checkpoint_path, file, file_id, *writer.durable(expected_seq_num, packet_buffer))
+                else:
+                    save_checkpoint(checkpoint_path, file, file_id, expected_seq_num, packet_buffer)
+                print(f"Transfer incomplete, progress saved to {checkpoint_path}")
+            file.close()
+            if complete and requests:
+                os.remove(output_file_path)
+        # Here, so a failed handshake does not leave the socket bound
+        print("\nClosing client socket")
+        client_socket.close()
+        print("Client socket closed")
     
-    print("\nClosing client socket")
-    client_socket.close()
-    print("Client socket closed")
+    if requests:
+        files = conn.streams or hasher
+        print(f"Session finished: {files.received} files received, {files.failed} failed")
+        return complete and digest_verified and not files.failed
+    return complete and digest_verified
+
+def send_join(conn, path):
+    """Ask the server to add the path to the connection; the JOIN goes out on the path itself"""
+    print(f"Sending JOIN on path {path}")
+    conn.socket.send_on(path, json.dumps({'cid': conn.cid, 'join': path}).encode())
+
+def connect(conn, options):
+    """Send SYN until the server's SYN-ACK arrives, backing off exponentially.
+
+    Returns the data segments that arrived ahead of the SYN-ACK (fast open),
+    or None if the server never answered.
+    """
+    syn_packet = json.dumps({
+        'syn': True,
+        'cid': conn.cid,
+        'opts': base64.b64encode(encode_options(options)).decode('ascii')
+    }).encode()
+    early_packets = []
+    timeout = INITIAL_SYN_TIMEOUT
+    for attempt in range(MAX_SYN_RETRIES):
+        print(f"Sending SYN (cid={conn.cid:08x}, attempt {attempt + 1})")
+        conn.socket.sendto(syn_packet, conn.server_address)
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            conn.socket.settimeout(max(deadline - time.time(), 0.001))
+            try:
+                packet, _ = conn.socket.recvfrom(BUFFER_SIZE)
+            except socket.timeout:
+                break
+            packet_data = parse_packet(packet)
+            if not packet_data or packet_data.get('cid') != conn.cid:
+                continue
+            if packet_data.get('syn') and packet_data.get('ack'):
+                conn.isn = packet_data['isn']
+                conn.options = decode_options(base64.b64decode(packet_data.get('opts', '')))
+                conn.seq_bits = conn.options.get('seq_bits', SEQ_BITS)
+                conn.socket.settimeout(2)
+                print(f"SYN-ACK received: isn={conn.isn}, options={sorted(conn.options)}")
+                return early_packets
+            if 'seq_num' in packet_data and len(early_packets) < MAX_EARLY_PACKETS:
+                # Fast-open data that overtook a lost SYN-ACK
+                early_packets.append(packet_data)
+        timeout *= 2
+    print(f"No SYN-ACK after {MAX_SYN_RETRIES} attempts, giving up")
+    return None
+
+def hash_range(file, hasher, start, length):
+    """Feed length bytes of the output file starting at start into hasher"""
+    file.seek(start)
+    while length > 0:
+        chunk = file.read(min(length, 64 * 1024))
+        if not chunk:
+            break
+        hasher.update(chunk)
+        length -= len(chunk)
+
+def segment_checksum(seq_num, data):
+    """CRC32 over the sequence number and payload, as computed by the server"""
+    return zlib.crc32(data, zlib.crc32(seq_num.to_bytes(8, 'big', signed=True)))
+
+def load_checkpoint(checkpoint_path):
+    """Load the checkpoint of an interrupted transfer, if any"""
+    try:
+        with open(checkpoint_path) as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+def restore_checkpoint(checkpoint):
+    """Rebuild the contiguous prefix and out-of-order buffer from a checkpoint"""
+    expected_seq_num = 0
+    packet_buffer = {}
+    for start, end in checkpoint['ranges']:
+        if start == 0:
+            expected_seq_num = end
+        else:
+            packet_buffer[start] = end - start
+    return expected_seq_num, packet_buffer
+
+def save_checkpoint(checkpoint_path, file, file_id, expected_seq_num, packet_buffer):
+    """Flush received data, then atomically record which byte ranges are on disk"""
+    file.flush()
+    os.fsync(file.fileno())
+    ranges = [[0, expected_seq_num]] if expected_seq_num > 0 else []
+    for start in sorted(packet_buffer):
+        end = start + packet_buffer[start]
+        if ranges and start <= ranges[-1][1]:
+            ranges[-1][1] = max(ranges[-1][1], end)
+        else:
+            ranges.append([start, end])
+    tmp_path = checkpoint_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'file_id': file_id, 'ranges': ranges}, f)
+    os.replace(tmp_path, checkpoint_path)
+    print(f"Checkpoint saved: {len(ranges)} ranges, contiguous up to byte {expected_seq_num}")
+
+def sack_blocks(packet_buffer, latest=None):
+    """Merge buffered segments into [start, end) ranges for a SACK.
+
+    The range holding the latest arrival goes first so the sender always
+    learns of the most recent delivery; the rest follow lowest first.
+    """
+    blocks = []
+    for start in sorted(packet_buffer):
+        end = start + packet_buffer[start]
+        if blocks and start <= blocks[-1][1]:
+            blocks[-1][1] = max(blocks[-1][1], end)
+        else:
+            blocks.append([start, end])
+    if latest is not None:
+        blocks.sort(key=lambda block: not block[0] <= latest < block[1])
+    return blocks[:MAX_SACK_BLOCKS]
+
+def size_socket_buffer(sock, size):
+    """Ask for a size-byte receive buffer, so a large window's bursts are not dropped at the socket"""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+    # Linux doubles the request for bookkeeping, then caps it at net.core.rmem_max
+    granted = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    print(f"SO_RCVBUF: asked for {size} bytes, got {granted}")
+    if granted < size:
+        print("Warning: SO_RCVBUF capped by the kernel; raise net.core.rmem_max")
+
+def enable_gro(sock):
+    """Ask the kernel to coalesce arriving datagrams (Linux 5.0 or later). Returns whether it will"""
+    try:
+        sock.setsockopt(socket.IPPROTO_UDP, UDP_GRO, 1)
+    except (OSError, AttributeError):
+        print("UDP receive offload not supported here, receiving datagrams one by one")
+        return False
+    print("Using UDP receive offload")
+    return True
+
+def receive_datagrams(sock, gro=False):
+    """Receive the next datagram, or with GRO every segment the kernel coalesced into one buffer"""
+    if not gro:
+        packet, _ = sock.recvfrom(BUFFER_SIZE)
+        return [packet]
+    data, ancdata, _, _ = sock.recvmsg(BUFFER_SIZE, socket.CMSG_SPACE(4))
+    for level, kind, value in ancdata:
+        if level == socket.IPPROTO_UDP and kind == UDP_GRO:
+            # All segments are this size but the last; padding is JSON whitespace
+            size = struct.unpack('=i', value[:4])[0]
+            return [data[i:i + size] for i in range(0, len(data), size)]
+    return [data]
 
 def parse_packet(packet):
     """Parse received packet"""
@@ -114,293 +878,129 @@ def parse_packet(packet):
         print("Error: Failed to decode packet as JSON")
         return None
 
-def send_ack(client_socket, server_address, ack_num):
-    """Send acknowledgment packet"""
-    ack_packet = json.dumps({
-        'ack_num': ack_num,
+def send_ack(conn, ack_num, fin=False, verified=False, sack=None, dsack=None):
+    """Send acknowledgment packet for the given stream offset"""
+    ack = {
+        'cid': conn.cid,
+        'ack_num': conn.wire_seq(ack_num),
         'timestamp': time.time()
-    }).encode()
-    client_socket.sendto(ack_packet, server_address)
-    print(f"Sent ACK packet: ack_num={ack_num}")
-
-parser = argparse.ArgumentParser(description='TCP Reno-like UDP client')
-parser.add_argument('server_ip', help='Server IP address')
-parser.add_argument('server_port', type=int, help='Server port number')
-parser.add_argument('--pref_outfile', type=str, default='received_file.txt', help='Output file path prefix')
-
-args = parser.parse_args()
-print(f"\n=== Starting TCP Reno-like UDP Client ===")
-print(f"Server IP: {args.server_ip}")
-print(f"Server Port: {args.server_port}")
-
-# Construct the output file name based on the prefix
-output_file_path = f"{args.pref_outfile}received_file.txt"
-print(f"Output File: {output_file_path}")
-
-receive_file(args.server_ip, args.server_port, output_file_path)
-
-# if __name__ == "__main__":
-#     parser = argparse.ArgumentParser(description='TCP Reno-like UDP client')
-#     parser.add_argument('server_ip', help='Server IP address')
-#     parser.add_argument('server_port', type=int, help='Server port number')
-#     parser.add_argument('--pref_outfile', type=str, default='received_file.txt', help='Output file path prefix')
-
-#     args = parser.parse_args()
-#     print(f"\n=== Starting TCP Reno-like UDP Client ===")
-#     print(f"Server IP: {args.server_ip}")
-#     print(f"Server Port: {args.server_port}")
-
-#     # Construct the output file name based on the prefix
-#     output_file_path = f"{args.pref_outfile}received_file.txt"
-#     print(f"Output File: {output_file_path}")
-    
-#     receive_file(args.server_ip, args.server_port, output_file_path)
-
-
-
-# code works properly but writes by default to received file txt need to update that
-# import socket
-# import argparse
-# import json
-# import time
-
-# # Constants
-# MSS = 1400  # Maximum Segment Size
-# BUFFER_SIZE = MSS + 200  # Buffer size for receiving packets
-
-# class CongestionControl:
-#     def __init__(self):
-#         self.rwnd = float('inf')  # Receive window (unlimited for this implementation)
-#         self.last_byte_received = -1
-#         self.out_of_order_packets = {}
-#         print("Initialized CongestionControl with unlimited receive window")
-
-# def receive_file(server_ip, server_port):
-#     """
-#     Receive file from server with reliability and flow control
-#     """
-#     print(f"\nInitializing client connecting to {server_ip}:{server_port}")
-#     client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-#     client_socket.settimeout(2)
-#     print("Socket created with 2 second timeout")
-    
-#     server_address = (server_ip, server_port)
-#     cc = CongestionControl()
-    
-#     output_file_path = "received_file.txt"
-#     print(f"Output will be written to: {output_file_path}")
-    
-#     packet_buffer = {}
-#     expected_seq_num = 0
-    
-#     # Initial connection
-#     print("Sending START signal to server...")
-#     client_socket.sendto(b"START", server_address)
-#     print("START signal sent")
-    
-#     with open(output_file_path, 'wb') as file:
-#         print("Output file opened for writing")
-#         while True:
-#             try:
-#                 print(f"\nWaiting for packet... (expecting sequence number {expected_seq_num})")
-#                 packet, _ = client_socket.recvfrom(BUFFER_SIZE)
-#                 packet_data = parse_packet(packet)
-                
-#                 if packet_data is None:
-#                     print("Received invalid packet, continuing...")
-#                     continue
-                    
-#                 seq_num = packet_data['seq_num']
-#                 data = packet_data['data']
-#                 print(f"Received packet with sequence number {seq_num}")
-                
-#                 if seq_num == -1:
-#                     print("\n=== File transfer complete ===")
-#                     break
-                    
-#                 # Handle in-order packet
-#                 if seq_num == expected_seq_num:
-#                     print(f"In-order packet received (seq={seq_num})")
-#                     file.write(data.encode('latin1'))
-#                     print(f"Wrote {len(data)} bytes to file")
-#                     expected_seq_num += len(data)
-                    
-#                     # Process any buffered in-order packets
-#                     while expected_seq_num in packet_buffer:
-#                         print(f"Processing buffered packet (seq={expected_seq_num})")
-#                         buffered_data = packet_buffer.pop(expected_seq_num)
-#                         file.write(buffered_data.encode('latin1'))
-#                         print(f"Wrote buffered data of {len(buffered_data)} bytes to file")
-#                         expected_seq_num += len(buffered_data)
-                        
-#                     # Send cumulative ACK
-#                     print(f"Sending cumulative ACK for sequence number {expected_seq_num - 1}")
-#                     send_ack(client_socket, server_address, expected_seq_num - 1)
-#                     cc.last_byte_received = expected_seq_num - 1
-                    
-#                 # Handle out-of-order packet
-#                 elif seq_num > expected_seq_num:
-#                     print(f"Out-of-order packet received (seq={seq_num}, expected={expected_seq_num})")
-#                     packet_buffer[seq_num] = data
-#                     print(f"Packet buffered. Current buffer size: {len(packet_buffer)} packets")
-#                     # Send duplicate ACK for the last in-order byte received
-#                     print(f"Sending duplicate ACK for last in-order byte {cc.last_byte_received}")
-#                     send_ack(client_socket, server_address, cc.last_byte_received)
-                    
-#                 # Handle duplicate packet
-#                 else:
-#                     print(f"Duplicate or old packet received (seq={seq_num}, expected={expected_seq_num})")
-#                     # Send duplicate ACK
-#                     print(f"Sending duplicate ACK for sequence number {cc.last_byte_received}")
-#                     send_ack(client_socket, server_address, cc.last_byte_received)
-                    
-#             except socket.timeout:
-#                 print("\nTimeout occurred while waiting for data")
-#                 # Send duplicate ACK on timeout
-#                 if cc.last_byte_received >= 0:
-#                     print(f"Sending timeout-triggered duplicate ACK for sequence number {cc.last_byte_received}")
-#                     send_ack(client_socket, server_address, cc.last_byte_received)
-#             except Exception as e:
-#                 print(f"\nError occurred: {e}")
-#                 break
-    
-#     print("\nClosing client socket")
-#     client_socket.close()
-#     print("Client socket closed")
-
-# def parse_packet(packet):
-#     """Parse received packet"""
-#     try:
-#         return json.loads(packet.decode())
-#     except json.JSONDecodeError:
-#         print("Error: Failed to decode packet as JSON")
-#         return None
-
-# def send_ack(client_socket, server_address, ack_num):
-#     """Send acknowledgment packet"""
-#     ack_packet = json.dumps({
-#         'ack_num': ack_num,
-#         'timestamp': time.time()
-#     }).encode()
-#     client_socket.sendto(ack_packet, server_address)
-#     print(f"Sent ACK packet: ack_num={ack_num}")
-
-# if __name__ == "__main__":
-#     parser = argparse.ArgumentParser(description='TCP Reno-like UDP client')
-#     parser.add_argument('server_ip', help='Server IP address')
-#     parser.add_argument('server_port', type=int, help='Server port number')
-    
-#     args = parser.parse_args()
-#     print(f"\n=== Starting TCP Reno-like UDP Client ===")
-#     print(f"Server IP: {args.server_ip}")
-#     print(f"Server Port: {args.server_port}")
-#     receive_file(args.server_ip, args.server_port)
-
-# import socket
-# import argparse
-# import json
-# import time
-
-# # Constants
-# MSS = 1400  # Maximum Segment Size
-# BUFFER_SIZE = MSS + 200  # Buffer size for receiving packets
-
-# class CongestionControl:
-#     def __init__(self):
-#         self.rwnd = float('inf')  # Receive window (unlimited for this implementation)
-#         self.last_byte_received = -1
-#         self.out_of_order_packets = {}
-
-# def receive_file(server_ip, server_port):
-#     """
-#     Receive file from server with reliability and flow control
-#     """
-#     client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-#     client_socket.settimeout(2)
-#     server_address = (server_ip, server_port)
-#     cc = CongestionControl()
-    
-#     output_file_path = "received_file.txt"
-#     packet_buffer = {}
-#     expected_seq_num = 0
-    
-#     # Initial connection
-#     client_socket.sendto(b"START", server_address)
-    
-#     with open(output_file_path, 'wb') as file:
-#         while True:
-#             try:
-#                 packet, _ = client_socket.recvfrom(BUFFER_SIZE)
-#                 packet_data = parse_packet(packet)
-                
-#                 if packet_data is None:
-#                     continue
-                    
-#                 seq_num = packet_data['seq_num']
-#                 data = packet_data['data']
-                
-#                 if seq_num == -1:  # End of transmission
-#                     print("File transfer complete")
-#                     break
-                    
-#                 # Handle in-order packet
-#                 if seq_num == expected_seq_num:
-#                     file.write(data.encode('latin1'))
-#                     expected_seq_num += len(data)
-                    
-#                     # Process any buffered in-order packets
-#                     while expected_seq_num in packet_buffer:
-#                         buffered_data = packet_buffer.pop(expected_seq_num)
-#                         file.write(buffered_data.encode('latin1'))
-#                         expected_seq_num += len(buffered_data)
-                        
-#                     # Send cumulative ACK
-#                     send_ack(client_socket, server_address, expected_seq_num - 1)
-#                     cc.last_byte_received = expected_seq_num - 1
-                    
-#                 # Handle out-of-order packet
-#                 elif seq_num > expected_seq_num:
-#                     packet_buffer[seq_num] = data
-#                     # Send duplicate ACK for the last in-order byte received
-#                     send_ack(client_socket, server_address, cc.last_byte_received)
-                    
-#                 # Handle duplicate packet
-#                 else:
-#                     # Send duplicate ACK
-#                     send_ack(client_socket, server_address, cc.last_byte_received)
-                    
-#             except socket.timeout:
-#                 print("Timeout waiting for data")
-#                 # Send duplicate ACK on timeout
-#                 if cc.last_byte_received >= 0:
-#                     send_ack(client_socket, server_address, cc.last_byte_received)
-#             except Exception as e:
-#                 print(f"Error: {e}")
-#                 break
-    
-#     client_socket.close()
-
-# def parse_packet(packet):
-#     """Parse received packet"""
-#     try:
-#         return json.loads(packet.decode())
-#     except json.JSONDecodeError:
-#         print("Error decoding packet")
-#         return None
-
-# def send_ack(client_socket, server_address, ack_num):
-#     """Send acknowledgment packet"""
-#     ack_packet = json.dumps({
-#         'ack_num': ack_num,
-#         'timestamp': time.time()
-#     }).encode()
-#     client_socket.sendto(ack_packet, server_address)
-
-# if __name__ == "__main__":
-#     parser = argparse.ArgumentParser(description='TCP Reno-like UDP client')
-#     parser.add_argument('server_ip', help='Server IP address')
-#     parser.add_argument('server_port', type=int, help='Server port number')
-    
-#     args = parser.parse_args()
-#     receive_file(args.server_ip, args.server_port)
+    }
+    if fin:
+        ack['fin'] = True
+        ack['verified'] = verified
+    if sack and conn.options.get('sack'):
+        ack['sack'] = [[conn.wire_seq(start), conn.wire_seq(end)] for start, end in sack]
+    if dsack and conn.options.get('sack'):
+        # Report a segment that arrived twice, so the sender can tell its retransmission was needless
+        ack['dsack'] = [conn.wire_seq(dsack[0]), conn.wire_seq(dsack[1])]
+    if conn.ts_recent is not None and conn.options.get('timestamps'):
+        ack['ts_echo'] = conn.ts_recent
+    if conn.ts_last is not None and 'multipath' in conn.options:
+        # Times the path this ACK goes back on; only the ACK for that segment may carry it
+        ack['ts_path'] = conn.ts_last
+        conn.ts_last = None
+    if 'wscale' in conn.options:
+        # Flow control: out-of-order data we hold, and writes the disk has not taken yet, come out of the window
+        conn.advertised = conn.window()
+        ack['wnd'] = conn.advertised >> conn.options['wscale']
+    if conn.requests:
+        ack['get'] = conn.requests
+        ack['last'] = True
+    if conn.streams:
+        ack['smax'] = conn.streams.grants()
+    ack_packet = json.dumps(ack).encode()
+    conn.socket.sendto(ack_packet, conn.server_address)
+    print(f"Sent ACK packet: ack_num={ack_num}{' (FIN-ACK)' if fin else ''}")
+
+def instrument(profiler):
+    """Time the packet loop's stages by rebinding this module's functions; callers need no change.
+
+    Returns a function that puts the originals back.
+    """
+    module = sys.modules[__name__]
+    return profiler.patch([
+        (module, 'print', 'print'),
+        (module, 'parse_packet', 'parse_packet'),
+        (module, 'segment_checksum', 'checksum'),
+        (module, 'send_ack', 'send_ack'),
+        (module, 'sack_blocks', 'sack_blocks'),
+        (module, 'hash_range', 'hash_range'),
+        (module, 'save_checkpoint', 'checkpoint'),
+        (module, 'receive_datagrams', 'receive'),
+    ])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='TCP Reno-like UDP client')
+    parser.add_argument('server_ip', help='Server IP address')
+    parser.add_argument('server_port', type=int, help='Server port number')
+    parser.add_argument('--pref_outfile', type=str, default='received_file.txt', help='Output file path prefix')
+    parser.add_argument('--compress', action='store_true', help='Offer per-segment compression to the server')
+    parser.add_argument('--fast_open', action='store_true', help='Ask the server to send data along with its SYN-ACK')
+    parser.add_argument('--get', nargs='+', metavar='NAME', help='Fetch these files over one session connection')
+    parser.add_argument('--streams', action='store_true',
+                        help='With --get, fetch the files at once on independent streams, so a loss in one delays no other')
+    parser.add_argument('--priority', nargs='+', type=int, metavar='N',
+                        help='With --streams, priority of each --get file in order; lower values are sent first')
+    parser.add_argument('--cc', choices=['reno', 'ledbat'], help='Ask for this congestion control; ledbat makes a background transfer')
+    parser.add_argument('--weight', type=int, help="This transfer's share relative to others from the same server")
+    parser.add_argument('--seq_bits', type=int, default=SEQ_BITS,
+                        help='Ask for sequence numbers this many bits wide (18 or more); small values test wraparound')
+    parser.add_argument('--window', type=int, default=RCV_WINDOW, help='Receive window in bytes offered to the server')
+    parser.add_argument('--sock_buffer', type=int, help='SO_RCVBUF size in bytes; size it near the window on fast, long paths')
+    parser.add_argument('--offload', action='store_true',
+                        help='Have the kernel coalesce arriving segments (UDP GRO, Linux), falling back if unsupported')
+    parser.add_argument('--write_behind', action='store_true',
+                        help='Write to disk on a background thread, so a slow disk shrinks the window instead of delaying ACKs')
+    parser.add_argument('--path', action='append', metavar='SERVER_IP:PORT[/LOCAL_IP]',
+                        help='Offer multipath and add a path to the server through this address, '
+                             'optionally sending from LOCAL_IP; repeat for more paths')
+    parser.add_argument('--profile', nargs='?', const='', metavar='PSTATS',
+                        help='Time each stage of the packet loop and print latency percentiles at exit; '
+                             'with PSTATS, also write cProfile stats there')
+
+    args = parser.parse_args(argv)
+    profiler = StageProfiler() if args.profile is not None else None
+    # Only for this run, so later transfers in the same process are not timed
+    restore = instrument(profiler) if profiler else None
+    try:
+        print(f"\n=== Starting TCP Reno-like UDP Client ===")
+        print(f"Server IP: {args.server_ip}")
+        print(f"Server Port: {args.server_port}")
+
+        # Construct the output file name based on the prefix
+        if args.get:
+            output_file_path = f"{args.pref_outfile}session.spool"
+        else:
+            output_file_path = f"{args.pref_outfile}received_file.txt"
+        print(f"Output File: {output_file_path}")
+
+        profile = None
+        if args.profile:
+            import cProfile
+            profile = cProfile.Profile()
+            profile.enable()
+        paths = []
+        for path in args.path or []:
+            address, _, local_ip = path.partition('/')
+            path_ip, _, path_port = address.rpartition(':')
+            paths.append((path_ip, int(path_port), local_ip or None))
+        start_time = time.time()
+        ok = receive_file(args.server_ip, args.server_port, output_file_path, args.compress, args.fast_open,
+                          args.get, args.pref_outfile, args.cc, args.weight, profiler, args.seq_bits,
+                          args.window, args.sock_buffer, args.offload, args.write_behind, paths,
+                          args.streams, args.priority)
+        # Measured in-process, so the experiments can leave interpreter startup out
+        print(f"Transfer time: {time.time() - start_time:.6f} s")
+        if profile:
+            profile.disable()
+            profile.dump_stats(args.profile)
+            print(f"cProfile stats written to {args.profile}")
+        if profiler:
+            profiler.report()
+    finally:
+        if restore:
+            restore()
+    sys.exit(0 if ok else 1)
 
+if __name__ == "__main__":
+    main()
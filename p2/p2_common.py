@@ -0,0 +1,162 @@
+"""Pieces both p2 endpoints must agree on or share: the handshake option
+codec and the --profile stage timer.
+"""
+import builtins
+import functools
+import json
+import struct
+import time
+
+HISTOGRAM_BUCKETS = 64  # Power-of-two latency buckets per profiled stage, 1 ns up
+
+# Handshake options, encoded as TLV: 1-byte type, 2-byte length, value
+OPTION_TYPES = {
+    'mss': (1, 'u16'),
+    'window': (2, 'u32'),
+    'timestamps': (3, 'flag'),
+    'sack': (4, 'flag'),
+    'compress': (5, 'str'),
+    'cc': (6, 'str'),
+    'resume': (7, 'json'),
+    'fast_open': (8, 'flag'),
+    'file_id': (9, 'str'),
+    'resumed': (10, 'flag'),
+    'session': (11, 'json'),
+    'weight': (12, 'u16'),
+    'seq_bits': (13, 'u16'),
+    'wscale': (14, 'u16'),
+    'multipath': (15, 'u16'),
+    'streams': (16, 'json'),
+}
+
+def encode_options(options):
+    """Encode an options dict as a TLV block, leaving out unset options"""
+    block = b''
+    for name, value in options.items():
+        if value is None or value is False:
+            continue
+        code, kind = OPTION_TYPES[name]
+        if kind == 'u16':
+            body = struct.pack('!H', value)
+        elif kind == 'u32':
+            body = struct.pack('!I', min(int(value), 0xFFFFFFFF))
+        elif kind == 'flag':
+            body = b''
+        elif kind == 'str':
+            body = value.encode()
+        else:
+            body = json.dumps(value).encode()
+        block += struct.pack('!BH', code, len(body)) + body
+    return block
+
+def decode_options(block):
+    """Decode a TLV block into an options dict, skipping unknown types"""
+    kinds = {code: (name, kind) for name, (code, kind) in OPTION_TYPES.items()}
+    options = {}
+    offset = 0
+    while offset + 3 <= len(block):
+        code, length = struct.unpack_from('!BH', block, offset)
+        body = block[offset + 3:offset + 3 + length]
+        offset += 3 + length
+        if code not in kinds:
+            continue
+        name, kind = kinds[code]
+        if kind == 'u16':
+            options[name] = struct.unpack('!H', body)[0]
+        elif kind == 'u32':
+            options[name] = struct.unpack('!I', body)[0]
+        elif kind == 'flag':
+            options[name] = True
+        elif kind == 'str':
+            options[name] = body.decode()
+        else:
+            options[name] = json.loads(body)
+    return options
+
+class ProfiledObject:
+    """Stands in for an object, timing some of its methods; the rest pass through"""
+    def __init__(self, target, methods):
+        self.target = target
+        for method, timed in methods.items():
+            setattr(self, method, timed)
+
+    def __getattr__(self, name):
+        return getattr(self.target, name)
+
+class StageProfiler:
+    """Latency histograms for the stages of the packet loop (--profile).
+
+    Each stage keeps a call count, total time and a fixed histogram of
+    power-of-two nanosecond buckets, so recording a call never allocates.
+    Stages can nest (a stage's own log lines also count under print).
+    """
+    def __init__(self):
+        self.stages = {}  # {stage: [calls, total ns, bucket counts]}
+        self.start = time.perf_counter_ns()
+
+    def timed(self, stage, func):
+        """Return func, recording the latency of every call under stage"""
+        stats = self.stages.setdefault(stage, [0, 0, [0] * HISTOGRAM_BUCKETS])
+        buckets = stats[2]
+        clock = time.perf_counter_ns
+
+        @functools.wraps(func)
+        def timed_call(*args, **kwargs):
+            started = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = clock() - started
+                stats[0] += 1
+                stats[1] += elapsed
+                buckets[elapsed.bit_length()] += 1
+        return timed_call
+
+    def patch(self, targets):
+        """Time each (owner, attribute, stage) in targets in place; returns a function undoing it.
+
+        Owners are modules or classes. A module's print shadows the builtin
+        until undone, so timing lasts one run and is never stacked.
+        """
+        saved = []
+        for owner, name, stage in targets:
+            original = vars(owner).get(name)
+            saved.append((owner, name, original))
+            setattr(owner, name, self.timed(stage, original or getattr(builtins, name)))
+
+        def undo():
+            for owner, name, original in reversed(saved):
+                if original is None:
+                    delattr(owner, name)
+                else:
+                    setattr(owner, name, original)
+        return undo
+
+    def wrap(self, target, **methods):
+        """Time target's methods, given as method=stage"""
+        return ProfiledObject(target, {method: self.timed(stage, getattr(target, method))
+                                       for method, stage in methods.items()})
+
+    @staticmethod
+    def percentile(buckets, calls, fraction):
+        """Upper bound, in ns, of the bucket holding the given fraction of calls"""
+        rank = fraction * calls
+        seen = 0
+        for bits, count in enumerate(buckets):
+            seen += count
+            if seen >= rank:
+                return 1 << bits
+        return 1 << (len(buckets) - 1)
+
+    def report(self):
+        wall = time.perf_counter_ns() - self.start
+        lines = [f"\n=== Profile: {wall / 1e9:.3f} s wall time ===",
+                 f"{'stage':<16}{'calls':>9}{'p50 us':>10}{'p99 us':>10}{'mean us':>10}{'total ms':>11}{'wall %':>8}"]
+        for stage, (calls, total, buckets) in sorted(self.stages.items(), key=lambda s: -s[1][1]):
+            if not calls:
+                continue
+            lines.append(f"{stage:<16}{calls:>9}{self.percentile(buckets, calls, 0.5) / 1e3:>10.1f}"
+                         f"{self.percentile(buckets, calls, 0.99) / 1e3:>10.1f}{total / calls / 1e3:>10.1f}"
+                         f"{total / 1e6:>11.1f}{100 * total / wall:>8.1f}")
+        # Built up first: printing is itself a stage
+        print("\n".join(lines))
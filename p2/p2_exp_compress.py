@@ -0,0 +1,92 @@
+"""Loopback experiment for per-segment compression.
+
+Sends the same text file with and without --compress in two ways:
+- straight over loopback, where the window is large and the RTT tiny,
+  so the compressor should mostly back off and send raw;
+- through a Relay from p2_exp_multipath, whose rate and 20 ms delay
+  stand in for a bandwidth-limited path with a real RTT, where
+  compression should cut both wire bytes and transfer time.
+
+Transfer times, the bytes the server put on the wire and digest checks
+are written to p2_compress.csv. The payload is a scratch INPUT_FILE,
+leaving input.txt to the other experiments.
+
+Usage: python3 p2_exp_compress.py [size_bytes]
+"""
+import hashlib
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+
+from p2_exp_multipath import Relay, read_client_log
+
+SERVER_PORT = 6580
+INPUT_FILE = 'compress_input.txt'
+# (name, (rate in bytes/s, one-way delay in s) of the relay towards the client); None goes straight to the server
+PATHS = [('loopback', None), ('relay', (2000000, 0.020))]
+WORDS = ['packet', 'window', 'segment', 'sender', 'receiver', 'ack', 'timeout', 'congestion',
+         'loss', 'delay', 'throughput', 'retransmit', 'sequence', 'server', 'client', 'stream']
+NUM_ITERATIONS = 3
+
+def write_text(size):
+    """Write at least size bytes of word-list text, which compresses about as well as logs or source"""
+    lines = []
+    written = 0
+    while written < size:
+        line = " ".join(random.choice(WORDS) for _ in range(10)) + f" {len(lines)}\n"
+        lines.append(line)
+        written += len(line)
+    with open(INPUT_FILE, 'w') as f:
+        f.write("".join(lines))
+
+def read_wire_bytes(log_path):
+    """Return (raw bytes, wire bytes) from the server's compression summary, or None without one"""
+    # The server may still be flushing its log when the client exits
+    for _ in range(10):
+        with open(log_path) as log:
+            match = re.search(r"Compression: (\d+) bytes sent as (\d+) wire bytes", log.read())
+        if match:
+            return int(match.group(1)), int(match.group(2))
+        time.sleep(0.2)
+    return None
+
+def transfer(path, compress):
+    """Send INPUT_FILE over path; returns (transfer time, digest, (raw, wire) bytes or None)"""
+    flag = ['--compress'] if compress else []
+    server = subprocess.Popen([sys.executable, 'p2_server.py', '127.0.0.1', str(SERVER_PORT),
+                               '--input', INPUT_FILE] + flag,
+                              stdout=open('server_output.log', 'w'), stderr=subprocess.STDOUT)
+    time.sleep(0.5)
+    port = SERVER_PORT
+    if path:
+        rate, delay = path
+        port = Relay(('127.0.0.1', SERVER_PORT), rate, delay, 0).port
+    subprocess.run([sys.executable, 'p2_client.py', '127.0.0.1', str(port), '--pref_outfile', 'compress_'] + flag,
+                   stdout=open('client_output.log', 'w'), stderr=subprocess.STDOUT, timeout=300)
+    server.wait(timeout=10)
+    ttc, digest = read_client_log('client_output.log')
+    return ttc, digest, read_wire_bytes('server_output.log') if compress else None
+
+def run(size):
+    write_text(size)
+    size = os.path.getsize(INPUT_FILE)
+    with open(INPUT_FILE, 'rb') as f:
+        expected = hashlib.md5(f.read()).hexdigest()
+    with open('p2_compress.csv', 'w') as f_out:
+        f_out.write("path,compress,iteration,match,ttc,raw_bytes,wire_bytes\n")
+        for name, path in PATHS:
+            for compress in (False, True):
+                for i in range(NUM_ITERATIONS):
+                    print(f"\n--- {name}, compression {'on' if compress else 'off'}, iteration {i + 1} ---")
+                    ttc, digest, sizes = transfer(path, compress)
+                    raw, wire = sizes or (size, size)
+                    print(f"Transfer time {ttc} s, {raw} bytes sent as {wire} ({raw / max(wire, 1):.2f}x), "
+                          f"digest {'OK' if digest == expected else 'MISMATCH'}")
+                    f_out.write(f"{name},{compress},{i},{digest == expected},{ttc},{raw},{wire}\n")
+    print("\n--- Completed all tests ---")
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 4 * 1024 * 1024)
@@ -0,0 +1,137 @@
+from mininet.topo import Topo
+from mininet.net import Mininet
+from mininet.link import TCLink
+from mininet.node import RemoteController
+from mininet.log import setLogLevel
+import time, re, os
+import sys
+import hashlib
+
+class LossyTopo(Topo):
+    def build(self, loss, delay, bw=None):
+        # Add two hosts
+        h1 = self.addHost('h1')
+        h2 = self.addHost('h2')
+
+        # Add a single switch
+        s1 = self.addSwitch('s1')
+
+        # Link between h1 and s1 with the specified packet loss, and rate in Mbps if given
+        self.addLink(h1, s1, loss=loss, delay=f'{delay}ms', bw=bw)
+
+        # Link between h2 and s1 with no packet loss
+        self.addLink(h2, s1, loss=0)
+
+def compute_md5(file_path):
+    """Compute the MD5 hash of a file."""
+    hasher = hashlib.md5()
+    try:
+        with open(file_path, 'rb') as file:
+            while chunk := file.read(8192):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+    except FileNotFoundError:
+        print(f"File not found: {file_path}")
+        return None
+
+def read_transfer_stats(log_path):
+    """Return (timeouts, fast recoveries, partial ACKs, retransmissions, spurious) from the server log."""
+    # The server may still be flushing its log when the client exits
+    for _ in range(10):
+        try:
+            with open(log_path) as log:
+                match = re.search(r"Transfer stats: (\d+) timeouts, (\d+) fast recoveries, "
+                                  r"(\d+) partial ACKs, (\d+) retransmissions, (\d+) spurious", log.read())
+            if match:
+                return tuple(int(x) for x in match.groups())
+        except FileNotFoundError:
+            pass
+        time.sleep(0.2)
+    print(f"No transfer stats in {log_path}")
+    return (None, None, None, None, None)
+
+def read_transfer_time(log_path):
+    """Return the transfer time the client measured in-process, leaving out its interpreter startup."""
+    try:
+        with open(log_path) as log:
+            match = re.search(r"Transfer time: ([0-9.]+) s", log.read())
+        return float(match.group(1)) if match else None
+    except FileNotFoundError:
+        print(f"File not found: {log_path}")
+        return None
+
+def run(expname):
+    # Set the log level to info to see detailed output
+    setLogLevel('info')
+
+    # IP and port of the remote controller
+    controller_ip = '127.0.0.1'
+    controller_port = 6653
+
+    output_file = f'p2_{expname}.csv'
+    f_out = open(output_file, 'w')
+    f_out.write("loss,delay,md5_hash,ttc,goodput_mbps,timeouts,fast_recoveries,partial_acks,retransmissions,spurious\n")
+
+    SERVER_IP = "10.0.0.1"
+    SERVER_PORT = 6555
+
+    NUM_ITERATIONS = 5
+    OUTFILE = 'received_file.txt'
+    BDP_WINDOW = 4 * 1024 * 1024  # Over twice the bandwidth-delay product of the slowest bdp path
+    delay_list, loss_list = [], []
+    bw, server_args, client_args = None, "", ""
+    if expname == "loss":
+        loss_list = [x * 0.5 for x in range(0, 11)]
+        delay_list = [20]
+    elif expname == "delay":
+        delay_list = [x for x in range(0, 201, 20)]
+        loss_list = [1]
+    elif expname == "bdp":
+        # A long fat path: goodput should track the link rate at every delay once the window is raised
+        delay_list = [x for x in range(25, 201, 25)]
+        loss_list = [0]
+        bw = 10
+        server_args = f"--max_window {BDP_WINDOW}"
+        client_args = f"--sock_buffer {BDP_WINDOW}"
+    print(loss_list, delay_list)
+
+    for LOSS in loss_list:
+        for DELAY in delay_list:
+            for i in range(0, NUM_ITERATIONS):
+                print(f"\n--- Running topology with {LOSS}% packet loss and {DELAY}ms delay")
+
+                topo = LossyTopo(loss=LOSS, delay=DELAY, bw=bw)
+                net = Mininet(topo=topo, link=TCLink, controller=None)
+                remote_controller = RemoteController('c0', ip=controller_ip, port=controller_port)
+                net.addController(remote_controller)
+                net.start()
+
+                h1 = net.get('h1')
+                h2 = net.get('h2')
+
+                start_time = time.time()
+
+                h1.cmd(f"python3 p2_server.py {SERVER_IP} {SERVER_PORT} {server_args} > server_output.log 2>&1 &")
+                h2.cmd(f"python3 p2_client.py {SERVER_IP} {SERVER_PORT} --pref_outfile '' {client_args} > client_output.log 2>&1")
+
+                end_time = time.time()
+                ttc = read_transfer_time('client_output.log') or end_time - start_time
+                md5_hash = compute_md5(OUTFILE)
+                goodput = os.path.getsize(OUTFILE) * 8 / ttc / 1e6 if os.path.exists(OUTFILE) else None
+                stats = read_transfer_stats('server_output.log')
+                f_out.write(f"{LOSS},{DELAY},{md5_hash},{ttc},{goodput}," + ",".join(str(x) for x in stats) + "\n")
+
+                net.stop()
+
+                # Wait a moment before starting the next iteration
+                time.sleep(1)
+
+    f_out.close()
+    print("\n--- Completed all tests ---")
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python p2_exp_loss.py <loss|delay|bdp>")
+    else:
+        expname = sys.argv[1].lower()
+        run(expname)
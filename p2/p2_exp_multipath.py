@@ -0,0 +1,127 @@
+"""Loopback experiment for multipath transfers.
+
+Each path is a UDP relay on loopback with its own rate, delay and loss
+towards the client, and the client sends from its own 127.0.0.x address
+on each path. The same random file, INPUT_FILE, is fetched over one
+path, over all of them, and over all of them with the last path failing
+part way through; transfer times and whether the digest matched
+INPUT_FILE are written to p2_multipath.csv.
+
+Usage: python3 p2_exp_multipath.py [size_bytes]
+"""
+import hashlib
+import heapq
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+SERVER_PORT = 6560
+INPUT_FILE = 'multipath_input.bin'  # Scratch payload, so input.txt is left for the other experiments
+# (rate in bytes/s, one-way delay in s, loss) of each path from server to client
+PATHS = [(1500000, 0.010, 0.01), (1000000, 0.030, 0.01)]
+QUEUE_PACKETS = 100  # Relay queue, in packets, before it drops like a full bottleneck
+FAIL_AFTER = 1.0  # Seconds into the transfer when the failing path goes dark
+NUM_ITERATIONS = 3
+
+class Relay:
+    """Forwards datagrams between the client and the server, delaying, rate-limiting and dropping them"""
+    def __init__(self, server_address, rate, delay, loss, fail_after=None):
+        self.server_address = server_address
+        self.rate, self.delay, self.loss = rate, delay, loss
+        self.fail_at = time.time() + fail_after if fail_after is not None else None
+        self.downstream = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.downstream.bind(('127.0.0.1', 0))
+        self.upstream = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.upstream.bind(('127.0.0.1', 0))
+        self.port = self.downstream.getsockname()[1]
+        self.client_address = None
+        self.queue = []  # (due time, count, socket, data, address)
+        self.count = 0
+        self.busy_until = 0.0
+        self.lock = threading.Lock()
+        for target in (self.from_client, self.from_server, self.pump):
+            threading.Thread(target=target, daemon=True).start()
+
+    def schedule(self, sock, data, address, rate_limited):
+        now = time.time()
+        if (self.fail_at and now >= self.fail_at) or random.random() < self.loss:
+            return
+        due = now + self.delay
+        if rate_limited:
+            start = max(now, self.busy_until)
+            if (start - now) * self.rate / len(data) > QUEUE_PACKETS:
+                return
+            self.busy_until = start + len(data) / self.rate
+            due = self.busy_until + self.delay
+        with self.lock:
+            self.count += 1
+            heapq.heappush(self.queue, (due, self.count, sock, data, address))
+
+    def from_client(self):
+        while True:
+            data, self.client_address = self.downstream.recvfrom(65535)
+            self.schedule(self.upstream, data, self.server_address, False)
+
+    def from_server(self):
+        while True:
+            data, _ = self.upstream.recvfrom(65535)
+            if self.client_address:
+                self.schedule(self.downstream, data, self.client_address, True)
+
+    def pump(self):
+        while True:
+            with self.lock:
+                now = time.time()
+                while self.queue and self.queue[0][0] <= now:
+                    _, _, sock, data, address = heapq.heappop(self.queue)
+                    sock.sendto(data, address)
+            time.sleep(0.0002)
+
+def read_client_log(log_path):
+    """Return (transfer time, verified digest) from the client's log"""
+    with open(log_path) as log:
+        text = log.read()
+    ttc = re.search(r"Transfer time: ([0-9.]+) s", text)
+    digest = re.search(r"File digest verified: ([0-9a-f]+)", text)
+    return (float(ttc.group(1)) if ttc else None), (digest.group(1) if digest else None)
+
+def transfer(paths, fail_last=False, input_file=INPUT_FILE):
+    """Fetch input_file over relays for the given paths; returns (transfer time, digest)"""
+    server = subprocess.Popen([sys.executable, 'p2_server.py', '127.0.0.1', str(SERVER_PORT),
+                               '--input', input_file, '--max_paths', str(len(paths))],
+                              stdout=open('server_output.log', 'w'), stderr=subprocess.STDOUT)
+    time.sleep(0.5)
+    relays = [Relay(('127.0.0.1', SERVER_PORT), rate, delay, loss,
+                    FAIL_AFTER if fail_last and i == len(paths) - 1 else None)
+              for i, (rate, delay, loss) in enumerate(paths)]
+    command = [sys.executable, 'p2_client.py', '127.0.0.1', str(relays[0].port)]
+    for i, relay in enumerate(relays[1:], 1):
+        command += ['--path', f'127.0.0.1:{relay.port}/127.0.0.{i + 1}']
+    subprocess.run(command, stdout=open('client_output.log', 'w'), stderr=subprocess.STDOUT, timeout=300)
+    server.wait(timeout=10)
+    return read_client_log('client_output.log')
+
+def run(size):
+    with open(INPUT_FILE, 'wb') as f:
+        f.write(os.urandom(size))
+    with open(INPUT_FILE, 'rb') as f:
+        expected = hashlib.md5(f.read()).hexdigest()
+    with open('p2_multipath.csv', 'w') as f_out:
+        f_out.write("paths,iteration,md5_hash,match,ttc\n")
+        for name, paths, fail_last in (('single', PATHS[:1], False), ('multipath', PATHS, False),
+                                       ('failover', PATHS, True)):
+            for i in range(NUM_ITERATIONS):
+                print(f"\n--- {name}: {len(paths)} paths, iteration {i + 1} ---")
+                ttc, digest = transfer(paths, fail_last)
+                match = digest == expected
+                print(f"Transfer time {ttc} s, digest {digest}: {'OK' if match else 'MISMATCH'}")
+                f_out.write(f"{name},{i},{digest},{match},{ttc}\n")
+    print("\n--- Completed all tests ---")
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 4 * 1024 * 1024)
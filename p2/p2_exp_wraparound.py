@@ -0,0 +1,79 @@
+"""Loopback stress test for sequence number wraparound.
+
+The client asks for the smallest sequence space the server allows, so
+a transfer of a few MB wraps the wire sequence numbers many times. It
+goes through a Relay from p2_exp_multipath that drops datagrams, and
+holds some back so that later ones overtake them. The payload is a
+random INPUT_FILE, leaving input.txt to the other experiments. Every
+run must end with the client's file and verified digest matching
+INPUT_FILE; the script exits non-zero if any run does not.
+
+Usage: python3 p2_exp_wraparound.py [size_bytes] [runs]
+"""
+import hashlib
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+from p2_exp_multipath import Relay, read_client_log
+
+SERVER_PORT = 6570
+INPUT_FILE = 'wraparound_input.bin'
+SEQ_BITS = 18  # The server's MIN_SEQ_BITS
+RATE, DELAY, LOSS = 1500000, 0.010, 0.02  # Path from server to client, as in p2_exp_multipath.PATHS
+REORDER = 0.05  # Share of datagrams held back
+REORDER_DELAY = 0.020  # Seconds they are held back, long enough for several later ones to pass
+
+class ReorderingRelay(Relay):
+    """A Relay that also holds back some datagrams, delivering them out of order"""
+    def __init__(self, server_address, rate, delay, loss, reorder):
+        # Set before the relay's threads start
+        self.reorder = reorder
+        super().__init__(server_address, rate, delay, loss)
+
+    def schedule(self, sock, data, address, rate_limited):
+        if random.random() < self.reorder:
+            threading.Timer(REORDER_DELAY, super().schedule, (sock, data, address, rate_limited)).start()
+        else:
+            super().schedule(sock, data, address, rate_limited)
+
+def transfer(input_file=INPUT_FILE):
+    """Fetch input_file with wrapping sequence numbers; returns (exit code, transfer time, digest)"""
+    server = subprocess.Popen([sys.executable, 'p2_server.py', '127.0.0.1', str(SERVER_PORT),
+                               '--input', input_file],
+                              stdout=open('server_output.log', 'w'), stderr=subprocess.STDOUT)
+    time.sleep(0.5)
+    relay = ReorderingRelay(('127.0.0.1', SERVER_PORT), RATE, DELAY, LOSS, REORDER)
+    client = subprocess.run([sys.executable, 'p2_client.py', '127.0.0.1', str(relay.port),
+                             '--seq_bits', str(SEQ_BITS), '--pref_outfile', 'wrap_'],
+                            stdout=open('client_output.log', 'w'), stderr=subprocess.STDOUT, timeout=300)
+    server.wait(timeout=10)
+    return (client.returncode,) + read_client_log('client_output.log')
+
+def run(size, runs):
+    with open(INPUT_FILE, 'wb') as f:
+        f.write(os.urandom(size))
+    with open(INPUT_FILE, 'rb') as f:
+        expected = hashlib.md5(f.read()).hexdigest()
+    print(f"{size} bytes in a {1 << SEQ_BITS}-byte sequence space: {size >> SEQ_BITS} wraps per transfer")
+    failures = 0
+    for i in range(runs):
+        print(f"\n--- Run {i + 1} of {runs}: {LOSS:.0%} loss, {REORDER:.0%} reordered ---")
+        if os.path.exists('wrap_received_file.txt'):
+            os.remove('wrap_received_file.txt')
+        code, ttc, digest = transfer()
+        received = None
+        if os.path.exists('wrap_received_file.txt'):
+            with open('wrap_received_file.txt', 'rb') as f:
+                received = hashlib.md5(f.read()).hexdigest()
+        ok = code == 0 and digest == expected and received == expected
+        failures += not ok
+        print(f"Transfer time {ttc} s, digest {digest}, received file {received}: {'OK' if ok else 'MISMATCH'}")
+    print(f"\n--- {runs - failures} of {runs} runs matched {expected} ---")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 4 * 1024 * 1024, int(sys.argv[2]) if len(sys.argv) > 2 else 3)
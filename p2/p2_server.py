@@ -1,79 +1,423 @@
 import socket
+import selectors
 import time
 import json
 import argparse
 import os
+import sys
+import hashlib
+import zlib
+import base64
+import random
+import struct
+import math
+import bisect
+import collections
+
+try:
+    from .p2_common import StageProfiler, encode_options, decode_options
+except ImportError:
+    # Run as a script from this directory
+    from p2_common import StageProfiler, encode_options, decode_options
 
 # Constants
 MSS = 1400  # Maximum Segment Size
 INITIAL_CWND = MSS  # Initial congestion window size
 INITIAL_SSTHRESH = 65535  # Initial slow start threshold
+MAX_WINDOW = 65535  # Default cap on the send window; long fat paths need --max_window
+MAX_WSCALE = 14  # Largest shift a client may apply to the receive window in its ACKs (RFC 7323)
+UDP_SEGMENT = 103  # Linux UDP segmentation offload (GSO) option, from <linux/udp.h>
+GSO_MAX_SEGMENTS = 64  # Most datagrams the kernel cuts one send into
+GSO_MAX_BYTES = 65000  # One offloaded send must still fit a single IP datagram
 INITIAL_RTO = 1.0  # Initial retransmission timeout
 ALPHA = 0.125  # RTT smoothing factor
 BETA = 0.25  # RTT deviation factor
 MIN_RTO = 0.2  # Minimum RTO value
 MAX_RTO = 60.0  # Maximum RTO value
+MAX_FIN_RETRIES = 5  # FIN retransmissions before closing without a FIN-ACK
+MAX_HANDSHAKE_RETRIES = 8  # SYN-ACK retransmissions before giving up on a client
+BUFFER_SIZE = 65535  # Largest UDP datagram; a SYN can carry a resume checkpoint
+CC_ALGORITHMS = ('reno', 'ledbat')  # Congestion control a transfer can run; ledbat is the background class
+IDENTITY_SAMPLE = 64 * 1024  # Bytes hashed from each end of a file for its identity
+COMPRESSION = 'zlib'  # Only compression scheme offered at connection setup
+COMPRESS_LEVEL = 1  # zlib level; favours speed over ratio
+MAX_COMPRESS_SPAN = 16 * MSS  # Most raw bytes folded into one compressed segment
+MIN_COMPRESS_RATIO = 1.2  # Below this a segment is sent raw
+COMPRESS_BACKOFF = 64  # Segments sent raw before compression is probed again
+MIN_TIMER = 0.001  # Shortest interval the server measures, in seconds
+MAX_READ_BATCH = 64  # Packets taken per wakeup before the flows get to send again
+READ_AHEAD_CHUNK = 64 * 1024  # Bytes per disk read on the read-ahead thread
+READ_AHEAD_DEPTH = 16  # Chunks read ahead of the sender before the thread waits for it
+KEEPALIVE_INTERVAL = 10.0  # Seconds a flow with nothing in flight stays silent before telling the client it is alive
+MAX_PATH_TIMEOUTS = 3  # Back-to-back timeouts after which a multipath flow gives up on a path
+STREAM_WINDOW = 1024 * 1024  # Bytes a stream may run ahead of its delivered data, unless the client says otherwise
+SEGMENT_CACHE_BUDGET = 64  # Default megabytes of cached segments kept for other clients of the same file
+PACING_GAIN = 1.25  # Pacing rate as a multiple of cwnd per smoothed RTT, in congestion avoidance
+PACING_GAIN_SLOW_START = 2.0  # Slow start doubles cwnd each RTT, so it paces twice as fast
+HYSTART_LOW_WINDOW = 16 * MSS  # HyStart leaves smaller windows to plain slow start
+HYSTART_MIN_SAMPLES = 8  # RTT samples in a round before its delay is judged
+HYSTART_MIN_ETA = 0.004  # Bounds on the RTT rise that ends slow start
+HYSTART_MAX_ETA = 0.016
+HYSTART_ACK_DELTA = 0.002  # Largest gap between two ACKs of one train
+LEDBAT_TARGET = 0.005  # Queuing delay a background transfer aims to add
+LEDBAT_GAIN = 1.0  # cwnd change per RTT when the delay is a full TARGET off
+LEDBAT_MIN_CWND = 2 * MSS
+LEDBAT_BASE_HISTORY = 10  # Minutes of RTT minima kept for the base delay
+LEDBAT_CURRENT_FILTER = 4  # Recent RTT samples whose minimum is the current delay
+SEQ_BITS = 32  # Width of wire sequence and ACK numbers; they wrap, stream offsets never do
+MIN_SEQ_BITS = 18  # Smallest sequence space a client may ask for, to exercise wraparound
 
 class CongestionControl:
-    def __init__(self):
+    def __init__(self, hystart=True, ssthresh=INITIAL_SSTHRESH):
         self.cwnd = INITIAL_CWND
-        self.ssthresh = INITIAL_SSTHRESH
+        self.ssthresh = ssthresh
         self.duplicate_ack_count = 0
         self.in_fast_recovery = False
         self.last_sent_byte = 0
         self.last_acked_byte = 0
         self.rtt_estimator = RTTEstimator()
-        self.unacked_packets = {}  # {seq_num: (packet_data, timestamp)}
-        self.packets_in_flight = 0
+        self.loss_detector = LossDetector()
+        self.hystart = HyStart() if hystart else None
+        self.ledbat = None  # Set for background transfers
+        self.rack = False  # Client sends SACK blocks, so losses are found by RACK, not duplicate ACKs
+        self.unacked_packets = {}  # {seq_num: Segment}
+        self.unacked_offsets = []  # Its keys in order, so ACKs bisect instead of scanning every segment
+        self.send_order = collections.OrderedDict()  # {seq_num: Segment} neither acknowledged nor SACKed, least recently sent first
+        self.sack_seen = []  # Stream ranges of the last ACK's SACK blocks, already applied
+        self.packets_in_flight = 0  # Wire bytes sent and neither acknowledged nor SACKed
+        self.last_send_time = 0
+        # NewReno recovery point and Proportional Rate Reduction (RFC 6937) state
+        self.recover = 0  # Stream offset sent when recovery began; ACKs below it are partial
+        self.recover_fs = 0  # Bytes in flight when recovery began
+        self.prr_delivered = 0  # Bytes delivered to the receiver during recovery
+        self.prr_out = 0  # Bytes sent during recovery
+        # Counters reported at the end of a transfer
+        self.timeouts = 0
+        self.fast_recoveries = 0
+        self.partial_acks = 0
+        self.retransmissions = 0
+        self.spurious_retransmits = 0
+        self.bytes_sent = 0  # Wire bytes, retransmissions included
+        self.dup_acks = 0
+        # Undo state: the window before the last reduction, kept until its
+        # retransmissions prove needed or not, by Eifel timestamps (RFC 3522)
+        # or duplicate-arrival reports (DSACK, RFC 3708)
+        self.undo_cwnd = None
+        self.undo_ssthresh = None
+        self.undo_high = 0  # Stream offset sent when the reduction happened
+        self.undo_end = None  # End offset of the first retransmission after it
+        self.undo_time = None  # Timestamp it was sent with
+        self.undo_retransmits = set()  # Retransmitted offsets not yet reported as duplicates
         print(f"Initialized CongestionControl with cwnd={self.cwnd}, ssthresh={self.ssthresh}")
 
-    def on_ack_received(self, ack_num):
-        """Handle received ACK"""
+    def on_ack_received(self, ack_num, delivered=0, rtt=None):
+        """Handle received ACK, after acknowledged packets have left the flight.
+
+        delivered is the number of wire bytes this ACK newly acknowledged,
+        rtt the RTT sample it gave, if any.
+        Returns True when the first unacknowledged segment should be
+        retransmitted: on the third duplicate ACK, and on every partial ACK
+        during recovery.
+        """
         print(f"ACK received: {ack_num}")
         if ack_num <= self.last_acked_byte:
             print(f"Duplicate ACK detected (ACK: {ack_num}), increasing duplicate count")
             self.duplicate_ack_count += 1
-            if self.duplicate_ack_count == 3:
+            self.dup_acks += 1
+            if self.in_fast_recovery:
+                # Without SACK, assume each duplicate ACK means a segment has left the network
+                delivered = delivered if self.rack else MSS
+                self.prr_delivered += delivered
+                self.prr_update(delivered)
+            elif self.duplicate_ack_count == 3 and not self.rack:
                 print(f"Triple duplicate ACK received, triggering fast retransmit")
                 self.on_triple_duplicate_ack()
+                return True
         else:
             print(f"New ACK received (ACK: {ack_num})")
             self.last_acked_byte = ack_num
             self.duplicate_ack_count = 0
             
             if self.in_fast_recovery:
-                print(f"Exiting fast recovery mode")
-                self.cwnd = self.ssthresh
-                self.in_fast_recovery = False
+                if ack_num + 1 >= self.recover:
+                    print(f"Full ACK, exiting fast recovery mode")
+                    self.cwnd = self.ssthresh
+                    self.in_fast_recovery = False
+                else:
+                    # NewReno: another segment of the same window was lost
+                    print(f"Partial ACK during recovery")
+                    self.partial_acks += 1
+                    self.prr_delivered += delivered
+                    self.prr_update(delivered)
+                    # RACK decides for itself which holes to fill
+                    return not self.rack
+            elif self.ledbat:
+                self.ledbat.on_ack(self, delivered, rtt)
             else:
                 # Normal ACK processing
                 if self.cwnd < self.ssthresh:
                     # Slow start
                     self.cwnd += MSS
                     print(f"Slow start: cwnd increased to {self.cwnd}")
+                    if self.hystart and self.hystart.on_ack(self, ack_num, rtt, time.time()):
+                        # The queue is starting to build; grow linearly from here
+                        self.ssthresh = self.cwnd
+                        print(f"HyStart: leaving slow start ({self.hystart.reason}), ssthresh={self.ssthresh}")
                 else:
                     # Congestion avoidance
-                    increment = MSS * (MSS / self.cwnd)
-                    self.cwnd += increment
+                    self.cwnd += self.ca_increment()
                     print(f"Congestion avoidance: cwnd increased to {self.cwnd:.2f}")
+        return False
+
+    def ca_increment(self):
+        """cwnd growth per ACK in congestion avoidance: one MSS per window"""
+        return MSS * (MSS / self.cwnd)
 
     def on_triple_duplicate_ack(self):
-        """Handle triple duplicate ACK"""
-        print(f"Handling triple duplicate ACK: Reducing ssthresh and cwnd")
+        """Handle triple duplicate ACK, or a loss found by RACK"""
+        print(f"Loss detected: Reducing ssthresh and entering recovery")
+        self.save_undo_state()
         self.ssthresh = max(self.cwnd // 2, 2 * MSS)
-        self.cwnd = self.ssthresh + 3 * MSS
+        self.recover = self.last_sent_byte
+        self.recover_fs = max(self.packets_in_flight, 1)
+        self.prr_delivered = 0
+        self.prr_out = 0
+        # PRR paces the reduction from here; only the retransmission goes out now
+        self.cwnd = self.packets_in_flight
         self.in_fast_recovery = True
-        print(f"ssthresh set to {self.ssthresh}, cwnd set to {self.cwnd}")
+        self.fast_recoveries += 1
+        print(f"ssthresh set to {self.ssthresh}, recovery point {self.recover}")
+
+    def prr_update(self, delivered):
+        """Set cwnd so sending during recovery tracks delivery (RFC 6937)"""
+        pipe = self.packets_in_flight
+        if pipe > self.ssthresh:
+            # Proportional part: send ssthresh/RecoverFS bytes per byte delivered
+            sndcnt = math.ceil(self.prr_delivered * self.ssthresh / self.recover_fs) - self.prr_out
+        else:
+            # Slow-start reduction bound: regrow towards ssthresh, at most one MSS ahead of delivery
+            limit = max(self.prr_delivered - self.prr_out, delivered) + MSS
+            sndcnt = min(self.ssthresh - pipe, limit)
+        self.cwnd = pipe + max(sndcnt, 0)
+        print(f"PRR: pipe={pipe}, delivered={self.prr_delivered}, out={self.prr_out}, cwnd={self.cwnd}")
+
+    def window(self):
+        """Bytes this flow may have in flight"""
+        return self.cwnd
+
+    def track(self, offset, segment):
+        """Add a segment just sent to the unacknowledged ones"""
+        self.unacked_packets[offset] = segment
+        if self.unacked_offsets and offset < self.unacked_offsets[-1]:
+            # Only segments handed over from a failed path come in below the highest
+            bisect.insort(self.unacked_offsets, offset)
+        else:
+            self.unacked_offsets.append(offset)
+        self.send_order[offset] = segment
+
+    def forget_unacked(self):
+        self.unacked_packets.clear()
+        self.unacked_offsets.clear()
+        self.send_order.clear()
+        self.sack_seen = []
+
+    def close(self):
+        """Called once the flow has nothing more to send"""
+
+    def save_undo_state(self):
+        """Remember the window before a reduction.
+
+        A reduction while the previous one's data is still outstanding joins
+        it, so undoing restores the window from before both.
+        """
+        if self.undo_cwnd is None or self.last_acked_byte + 1 >= self.undo_high:
+            self.undo_cwnd = self.cwnd
+            self.undo_ssthresh = self.ssthresh
+            self.undo_end = self.undo_time = None
+            self.undo_retransmits = set()
+        self.undo_high = self.last_sent_byte
+
+    def on_retransmit(self, offset, segment):
+        """Track retransmissions made since the last reduction"""
+        if self.undo_cwnd is None:
+            return
+        self.undo_retransmits.add(offset)
+        if self.undo_end is None:
+            self.undo_end = segment.end
+            self.undo_time = segment.sent_time
+
+    def undo(self, reason):
+        """Restore the window from before a reduction that proved spurious"""
+        self.spurious_retransmits += 1
+        self.cwnd = max(self.cwnd, self.undo_cwnd)
+        self.ssthresh = max(self.ssthresh, self.undo_ssthresh)
+        self.in_fast_recovery = False
+        print(f"Spurious retransmission detected by {reason}, restoring cwnd={self.cwnd}, ssthresh={self.ssthresh}")
+        self.undo_cwnd = self.undo_ssthresh = self.undo_end = self.undo_time = None
+        self.undo_retransmits = set()
+
+    def on_duplicate_report(self, offset):
+        """Handle a DSACK: undo once every retransmission since the reduction arrived twice"""
+        if self.undo_cwnd is None or offset not in self.undo_retransmits:
+            return
+        self.undo_retransmits.discard(offset)
+        if not self.undo_retransmits:
+            self.undo("DSACK")
+
+    def check_spurious(self, ack_num, ts_echo):
+        """Undo the last reduction if the ACK for its first retransmission echoes the original send.
+
+        The receiver echoes the timestamp of the segment that triggered the
+        ACK, so an echo older than the retransmission means the original
+        arrived and nothing was lost.
+        """
+        if self.undo_end is None or ack_num + 1 < self.undo_end:
+            return
+        if ts_echo is not None and ts_echo < self.undo_time:
+            self.undo("timestamps")
+        else:
+            # The retransmission got there first; only a DSACK can still clear it
+            self.undo_end = self.undo_time = None
+
+    def on_packet_sent(self, size, retransmission=False):
+        """Account for size wire bytes sent; retransmissions are already in flight"""
+        self.bytes_sent += size
+        if retransmission:
+            self.retransmissions += 1
+        else:
+            self.packets_in_flight += size
+        self.last_send_time = time.time()
+        if self.in_fast_recovery:
+            self.prr_out += size
 
     def on_timeout(self):
         """Handle timeout"""
         print(f"Timeout detected: Reducing ssthresh and resetting cwnd")
+        self.save_undo_state()
         self.ssthresh = max(self.cwnd // 2, 2 * MSS)
         self.cwnd = MSS
         self.in_fast_recovery = False
         self.duplicate_ack_count = 0
+        self.timeouts += 1
+        if self.hystart:
+            self.hystart.reset()
         print(f"ssthresh set to {self.ssthresh}, cwnd reset to {self.cwnd}")
 
+class CongestionManager:
+    """Congestion state shared by every flow to one host (RFC 3124).
+
+    Flows keep their own sequence and loss state but draw on one window
+    and one RTT estimate, so they never compete with each other and a new
+    flow starts with what earlier ones learnt. The window is split among
+    open flows by weight.
+    """
+    def __init__(self, ssthresh=INITIAL_SSTHRESH):
+        self.cwnd = INITIAL_CWND
+        self.ssthresh = ssthresh
+        self.rtt_estimator = RTTEstimator()
+        self.flows = []  # SharedCongestionControl of flows still sending
+        self.reduced_at = 0  # When the window was last cut for a loss
+
+    def share(self, flow):
+        """The part of the window that belongs to flow, at least one segment"""
+        total = sum(f.weight for f in self.flows) or flow.weight
+        return max(self.cwnd * flow.weight / total, MSS)
+
+class SharedCongestionControl(CongestionControl):
+    """A flow's sequence and loss state on top of a CongestionManager's window.
+
+    Only one loss per congestion event cuts the shared window: a flow that
+    finds losses within an RTT of another flow's cut recovers without a
+    second one. PRR is left out, as its accounting is per flow; the window
+    simply drops to ssthresh.
+    """
+    def __init__(self, manager, weight=1, hystart=True):
+        self.manager = manager
+        # CongestionControl.__init__ resets the window; keep what the manager has learnt
+        cwnd, ssthresh = manager.cwnd, manager.ssthresh
+        super().__init__(hystart)
+        manager.cwnd, manager.ssthresh = cwnd, ssthresh
+        self.weight = weight
+        manager.flows.append(self)
+
+    # The window and RTT estimate live in the manager
+    @property
+    def cwnd(self):
+        return self.manager.cwnd
+
+    @cwnd.setter
+    def cwnd(self, value):
+        self.manager.cwnd = value
+
+    @property
+    def ssthresh(self):
+        return self.manager.ssthresh
+
+    @ssthresh.setter
+    def ssthresh(self, value):
+        self.manager.ssthresh = value
+
+    @property
+    def rtt_estimator(self):
+        return self.manager.rtt_estimator
+
+    @rtt_estimator.setter
+    def rtt_estimator(self, value):
+        pass  # Only CongestionControl.__init__ sets it
+
+    def window(self):
+        return self.manager.share(self)
+
+    def close(self):
+        if self in self.manager.flows:
+            self.manager.flows.remove(self)
+
+    def on_triple_duplicate_ack(self):
+        now = time.time()
+        if now - self.manager.reduced_at < (self.rtt_estimator.srtt or INITIAL_RTO):
+            # Another flow already cut the window for this congestion event
+            cwnd, ssthresh = self.cwnd, self.ssthresh
+            super().on_triple_duplicate_ack()
+            self.cwnd, self.ssthresh = cwnd, ssthresh
+            return
+        super().on_triple_duplicate_ack()
+        self.manager.reduced_at = now
+        self.cwnd = self.ssthresh
+
+    def prr_update(self, delivered):
+        pass
+
+    def on_timeout(self):
+        super().on_timeout()
+        self.manager.reduced_at = time.time()
+
+class CoupledCongestionControl(CongestionControl):
+    """One path of a multipath flow, its window growth coupled with the others (LIA, RFC 6356).
+
+    Each path keeps its own window, RTT estimate and loss recovery;
+    only congestion avoidance is coupled, so that all paths together
+    grow no faster than one flow on the best of them and the transfer
+    stays fair to single-path flows at a shared bottleneck.
+    """
+    def __init__(self, coupled, hystart=True, ssthresh=INITIAL_SSTHRESH):
+        super().__init__(hystart, ssthresh)
+        self.coupled = coupled  # Every path's CoupledCongestionControl, this one included
+        coupled.append(self)
+
+    def close(self):
+        # A path no longer sending leaves the coupling
+        if self in self.coupled:
+            self.coupled.remove(self)
+
+    def ca_increment(self):
+        measured = [cc for cc in self.coupled if cc.rtt_estimator.srtt]
+        if self not in measured:
+            return super().ca_increment()
+        total = sum(cc.cwnd for cc in self.coupled)
+        alpha = (total * max(cc.cwnd / cc.rtt_estimator.srtt ** 2 for cc in measured)
+                 / sum(cc.cwnd / cc.rtt_estimator.srtt for cc in measured) ** 2)
+        return min(alpha * MSS * MSS / total, MSS * MSS / self.cwnd)
+
 class RTTEstimator:
     def __init__(self):
         self.srtt = None
@@ -95,107 +439,1839 @@ class RTTEstimator:
         self.rto = min(max(self.rto, MIN_RTO), MAX_RTO)
         print(f"Updated SRTT={self.srtt:.4f}, RTTVAR={self.rttvar:.4f}, RTO={self.rto:.4f}")
 
-def send_file(server_ip, server_port):
-    """Send file using TCP Reno-like congestion control"""
+class LossDetector:
+    """RACK time-based loss detection with tail loss probes (RFC 8985).
+
+    A segment is lost once a segment sent after it has been delivered and
+    more than one RTT plus a reordering window has passed since it was
+    sent, however many duplicate ACKs arrived. A tail loss probe resends
+    the last segment about two RTTs after the last send, so a lost tail
+    is found by RACK rather than left to the RTO.
+    """
+    def __init__(self):
+        self.xmit_time = 0  # Send time of the latest-sent segment known to be delivered
+        self.end = 0  # End offset of that segment, breaking ties in xmit_time
+        self.rtt = None  # RTT of that segment
+        self.min_rtt = None
+        self.reorder_deadline = None  # When the next not-yet-lost segment times out
+        self.probe_deadline = None
+        self.probe_sent = False  # One probe per flight, until the cumulative ACK advances
+        self.probes = 0
+        self.losses = 0
+
+    def on_delivered(self, segment, now, ts_echo=None):
+        """Record a segment that was cumulatively acknowledged or SACKed"""
+        rtt = now - segment.sent_time
+        if segment.retransmitted and self.min_rtt is not None and rtt < self.min_rtt:
+            # Too quick to be for the retransmission; the original got through
+            return
+        if segment.retransmitted and ts_echo is not None and ts_echo < segment.sent_time:
+            # The echo names an earlier send, so the original got through
+            return
+        self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+        if (segment.sent_time, segment.end) > (self.xmit_time, self.end):
+            self.xmit_time = segment.sent_time
+            self.end = segment.end
+            self.rtt = rtt
+
+    def detect_losses(self, send_order, srtt, now):
+        """Return offsets of segments now deemed lost and arm the reorder timer.
+
+        send_order holds the segments neither acknowledged nor SACKed, least recently sent first.
+        """
+        self.reorder_deadline = None
+        if self.rtt is None:
+            return []
+        reorder_window = min(self.min_rtt / 4, srtt or self.min_rtt)
+        lost = []
+        # Oldest send first, so the walk stops at the first segment that is not overdue
+        for offset, segment in send_order.items():
+            if (segment.sent_time, segment.end) >= (self.xmit_time, self.end):
+                break
+            deadline = segment.sent_time + self.rtt + reorder_window
+            if deadline > now:
+                self.reorder_deadline = deadline
+                break
+            lost.append(offset)
+        self.losses += len(lost)
+        return lost
+
+    def arm_probe(self, cc):
+        """Schedule a tail loss probe two smoothed RTTs after the last send"""
+        if not cc.rack or not cc.unacked_packets or cc.in_fast_recovery or self.probe_sent:
+            self.probe_deadline = None
+            return
+        srtt = cc.rtt_estimator.srtt
+        timeout = 2 * srtt if srtt is not None else INITIAL_RTO
+        self.probe_deadline = cc.last_send_time + min(timeout, cc.rtt_estimator.rto)
+
+class HyStart:
+    """Delay-based slow-start exit (HyStart, with the thresholds of HyStart++, RFC 9406).
+
+    Slow start ends before the bottleneck queue overflows, when the lowest
+    RTT of a round rises clearly above that of the round before, or when
+    the round's ACKs arrive as a train spanning half the minimum RTT,
+    which means the window already fills the path.
+    """
+    def __init__(self):
+        self.min_rtt = None
+        self.exits = 0
+        self.reason = None
+        self.reset()
+
+    def reset(self):
+        """Start over, as after a timeout"""
+        self.round_end = None  # Stream offset whose ACK ends the current round
+        self.round_start = 0  # Arrival time of the round's first ACK
+        self.last_ack_time = 0
+        self.train = True  # ACKs of this round have come back to back so far
+        self.last_round_min_rtt = None
+        self.round_min_rtt = None
+        self.samples = 0
+
+    def on_ack(self, cc, ack_num, rtt, now):
+        """Track a new ACK in slow start. Returns True once slow start should end"""
+        if self.round_end is None or ack_num + 1 >= self.round_end:
+            # Everything sent when the last round began is acknowledged
+            self.round_end = cc.last_sent_byte
+            self.round_start = self.last_ack_time = now
+            self.train = True
+            self.last_round_min_rtt = self.round_min_rtt
+            self.round_min_rtt = None
+            self.samples = 0
+        if rtt is not None:
+            self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+            self.round_min_rtt = rtt if self.round_min_rtt is None else min(self.round_min_rtt, rtt)
+            self.samples += 1
+        if cc.cwnd < HYSTART_LOW_WINDOW or self.min_rtt is None:
+            self.last_ack_time = now
+            return False
+        
+        if self.train and now - self.last_ack_time <= HYSTART_ACK_DELTA:
+            if now - self.round_start >= self.min_rtt / 2:
+                return self.exit("ACK train")
+        else:
+            self.train = False
+        self.last_ack_time = now
+        
+        if self.samples >= HYSTART_MIN_SAMPLES and self.last_round_min_rtt is not None:
+            eta = min(max(self.last_round_min_rtt / 8, HYSTART_MIN_ETA), HYSTART_MAX_ETA)
+            if self.round_min_rtt >= self.last_round_min_rtt + eta:
+                return self.exit("RTT increase")
+        return False
+
+    def exit(self, reason):
+        self.exits += 1
+        self.reason = reason
+        return True
+
+class Ledbat:
+    """Scavenger congestion control for background transfers (LEDBAT, RFC 6817).
+
+    cwnd grows only while the queuing delay, the current RTT above the
+    lowest RTT seen, stays under TARGET, and shrinks in proportion once it
+    goes over, so a background transfer yields to any flow that fills the
+    bottleneck queue. RTTs stand in for the RFC's one-way delays: the
+    reverse path carries only ACKs and adds little of its own.
+    """
+    def __init__(self):
+        self.base_delays = []  # [minute, lowest RTT in that minute], newest last
+        self.current_delays = []
+        self.queuing_delay = 0
+
+    def on_ack(self, cc, delivered, rtt):
+        """Adjust cc.cwnd for a new ACK that newly delivered bytes"""
+        if rtt is not None:
+            self.update_delays(rtt)
+        if not self.base_delays:
+            return
+        base = min(delay for _, delay in self.base_delays)
+        self.queuing_delay = min(self.current_delays) - base
+        
+        if cc.cwnd < cc.ssthresh and self.queuing_delay < LEDBAT_TARGET / 2:
+            # Slow start while the queue is nearly empty, as LEDBAT++ does
+            cc.cwnd += min(delivered, MSS)
+        else:
+            cc.ssthresh = min(cc.ssthresh, cc.cwnd)
+            off_target = (LEDBAT_TARGET - self.queuing_delay) / LEDBAT_TARGET
+            cc.cwnd += LEDBAT_GAIN * off_target * delivered * MSS / cc.cwnd
+        # Never more than one segment beyond what the flight can use
+        cc.cwnd = max(min(cc.cwnd, cc.packets_in_flight + delivered + MSS), LEDBAT_MIN_CWND)
+        print(f"LEDBAT: queuing delay {self.queuing_delay * 1000:.1f} ms, cwnd={cc.cwnd:.2f}")
+
+    def update_delays(self, rtt):
+        minute = int(time.time() // 60)
+        if self.base_delays and self.base_delays[-1][0] == minute:
+            self.base_delays[-1][1] = min(self.base_delays[-1][1], rtt)
+        else:
+            self.base_delays = self.base_delays[-(LEDBAT_BASE_HISTORY - 1):] + [[minute, rtt]]
+        self.current_delays = self.current_delays[-(LEDBAT_CURRENT_FILTER - 1):] + [rtt]
+
+class Segment:
+    """An unacknowledged segment"""
+    def __init__(self, data, end, compressed, frame=None):
+        self.data = data  # Wire payload
+        self.end = end  # Stream offset just past the segment
+        self.compressed = compressed
+        self.frame = frame  # (stream id, offset in that stream) in a multiplexed session
+        self.encoded = None  # JSON-encoded payload, if a SegmentCache had it
+        self.sent_time = time.time()
+        self.retransmitted = False
+        self.sacked = False
+
+class CachedSegment:
+    """A file segment as a SegmentCache holds it"""
+    def __init__(self, data, prev, hasher, last):
+        self.data = data  # Raw bytes, sent in place of a fresh read
+        self.encoded = json.dumps(data.decode('latin1')).encode()  # The same, JSON-encoded for the wire
+        self.prev = prev  # Entry the stream digest stood at before this segment, None at the start, False if unknown
+        self.hasher = hasher  # Stream digest state just after this segment
+        self.last = last  # The file ends here, so a longer read would get the same bytes
+        self.size = len(data) + len(self.encoded)
+
+class SegmentCache:
+    """File segments, read, hashed and JSON-encoded once for every flow serving the same file.
+
+    A hot file is cut at the same offsets for every client. Entries are
+    keyed by file identity (size, mtime and a sample of the content) and
+    offset. A hit takes the place of the disk read: its bytes are what is
+    sent, checksummed and retransmitted, and the stream digest jumps to
+    the cached state when the stream reached the segment through the same
+    entries. Only the per-connection fields are built per send. The least
+    recently used entries go once more than budget bytes are held, and
+    serving a changed file drops its old version's entries.
+    """
+    def __init__(self, budget=SEGMENT_CACHE_BUDGET * 1024 * 1024):
+        self.budget = budget
+        self.entries = collections.OrderedDict()  # (identity, offset) -> CachedSegment
+        self.size = 0
+        self.versions = {}  # File name -> identity last served
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def open(self, name, identity):
+        """Note the version of name about to be served, dropping what is cached for an older one"""
+        old = self.versions.get(name)
+        if old is not None and old != identity:
+            stale = [key for key in self.entries if key[0] == old]
+            for key in stale:
+                self.size -= self.entries.pop(key).size
+            self.invalidations += len(stale)
+            print(f"{name} has changed, dropped {len(stale)} cached segments")
+        self.versions[name] = identity
+
+    def read(self, stream, offset, size):
+        """Consume up to size bytes of stream at offset; return them as a CachedSegment, or None if none are ready"""
+        key = (stream.identity, offset)
+        entry = self.entries.get(key)
+        if entry is not None and (len(entry.data) == size or (entry.last and len(entry.data) < size)):
+            self.hits += 1
+            self.entries.move_to_end(key)
+            stream.replay(entry)
+            return entry
+        prev = stream.cached
+        data = stream.read(size)
+        if not data:
+            return None
+        self.misses += 1
+        # A short read is only the file's end once the source says so; otherwise it just misses later
+        entry = CachedSegment(data, prev, stream.hasher.copy(), stream.exhausted and not stream.buffered())
+        stream.cached = entry
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= old.size
+        self.entries[key] = entry
+        self.size += entry.size
+        while self.size > self.budget:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.size
+            self.evictions += 1
+        return entry
+
+    def report(self):
+        lookups = self.hits + self.misses
+        print(f"Segment cache: {self.hits} hits, {self.misses} misses "
+              f"({self.hits / lookups if lookups else 0:.1%} hit rate), {self.evictions} evictions, "
+              f"{self.invalidations} invalidated, {len(self.entries)} segments in {self.size} bytes")
+
+class Connection:
+    """Parameters agreed with one client during the handshake"""
+    def __init__(self, cid, client_address):
+        self.cid = cid
+        self.client_address = client_address
+        self.isn = random.getrandbits(SEQ_BITS)  # Wire sequence number of stream byte 0
+        self.seq_bits = SEQ_BITS
+        self.mss = MSS
+        self.peer_window = None  # Receive window advertised by the client, updated by its ACKs
+        self.wscale = 0  # The client's ACKs give its window in units of 2**wscale bytes
+        self.compression = None
+        self.held_ranges = []  # (start, end) stream ranges the client already holds
+        self.fast_open = False
+        self.sack = False  # Client reports out-of-order ranges in its ACKs
+        self.timestamps = False  # Segments carry a send timestamp the client echoes
+        self.cc = 'reno'  # Congestion control agreed for this transfer
+        self.weight = 1  # Share of a window this flow shares with others to the same host
+        self.paths = 1  # Paths the client may open for this transfer, the SYN's included
+        self.syn_ack_packet = None
+
+    @property
+    def max_outstanding(self):
+        """Most stream bytes unacknowledged at once, so numbers in flight never alias"""
+        return (1 << self.seq_bits - 1) - MAX_COMPRESS_SPAN
+
+    def wire_seq(self, offset):
+        """Translate a stream offset into a wire sequence number, modulo the sequence space"""
+        return (self.isn + offset) & ((1 << self.seq_bits) - 1)
+
+    def stream_offset(self, wire_seq, near):
+        """Translate a wire sequence or ACK number into the stream offset closest to near.
+
+        Serial number arithmetic (RFC 1982): the number is taken to lie
+        within half the sequence space of near, before or after it.
+        """
+        space = 1 << self.seq_bits
+        delta = (wire_seq - self.isn - near) % space
+        if delta >= space // 2:
+            delta -= space
+        return near + delta
+
+class StreamSource:
+    """Bounded reader over a file object or an iterable of byte chunks.
+
+    The sender pulls at most one segment at a time, so only unacknowledged
+    data is held in memory no matter how long the stream is.
+    """
+    def __init__(self, source, name="<stream>", identity=None):
+        self.name = name
+        self.identity = identity  # Only set for regular files, which can be resumed
+        self.eof = False
+        self.exhausted = False  # Underlying source has no more data
+        self.pending = bytearray()  # Bytes pulled from the source, consumed from the front
+        self.consumed = 0  # Bytes of pending already read, dropped only once they are half of it
+        self.hasher = hashlib.md5()  # Digest of everything read, sent in the FIN
+        self.cached = None  # CachedSegment whose digest state the hasher is in; None at the start, False if none
+        self.owed = 0  # Bytes the read-ahead thread has yet to deliver that a cache hit already stood in for
+        self.partial_reads = False
+        self.seekable = False
+        self.blocking = True  # Reads may wait on a producer (pipes, sockets, generators), not just the disk
+        self.read_ahead = None
+        if hasattr(source, 'read'):
+            self.file = source
+            self.chunks = None
+            # Pipes and sockets should hand over whatever is ready instead of
+            # blocking until a full segment has accumulated
+            self.seekable = source.seekable() if hasattr(source, 'seekable') else False
+            self.partial_reads = not self.seekable and hasattr(source, 'read1')
+            self.read_fn = source.read1 if self.partial_reads else source.read
+            self.blocking = not self.seekable
+        else:
+            self.file = None
+            self.chunks = iter(source)
+
+    def prefetch(self, notify=None):
+        """Read the source on a ReadAhead thread; notify is called whenever a chunk is ready"""
+        if self.file is not None:
+            self.read_ahead = ReadAhead(self.read_fn, notify)
+            return
+        def next_chunk(size):
+            # Empty chunks only mean nothing is ready yet; the end is the iterator running out
+            for chunk in self.chunks:
+                if chunk:
+                    return bytes(chunk)
+            return b''
+        self.read_ahead = ReadAhead(next_chunk, notify)
+
+    def peek(self, size):
+        """Return up to size upcoming bytes without consuming them"""
+        # Small generator chunks are coalesced into full segments, holding
+        # back at most the remainder of one chunk
+        while self.buffered() < size and not self.exhausted:
+            if self.read_ahead:
+                chunk = self.read_ahead.get()
+                if chunk is None:
+                    # The disk or the producer is behind; send what is ready rather than wait for it
+                    break
+            elif self.chunks is None:
+                chunk = self.read_fn(size - self.buffered())
+            else:
+                chunk = next(self.chunks, None)
+                if chunk == b'':
+                    continue
+            if not chunk:
+                self.exhausted = True
+                break
+            if self.owed:
+                skipped = min(self.owed, len(chunk))
+                self.owed -= skipped
+                chunk = chunk[skipped:]
+            self.pending += chunk
+            if self.partial_reads and not self.read_ahead:
+                break
+        return bytes(self.pending[self.consumed:self.consumed + size])
+
+    def buffered(self):
+        """Bytes pulled from the source but not yet consumed"""
+        return len(self.pending) - self.consumed
+
+    def consume(self, size):
+        self.consumed += size
+        # Compacting only once the spent prefix is half the buffer copies each byte a bounded number of times
+        if self.consumed * 2 >= len(self.pending):
+            del self.pending[:self.consumed]
+            self.consumed = 0
+
+    def read(self, size):
+        """Consume up to size bytes, or return b'' once the source is exhausted"""
+        data = self.peek(size)
+        self.consume(len(data))
+        if not data:
+            # A session can be idle without being finished
+            self.eof = self.exhausted
+        else:
+            self.hasher.update(data)
+            self.cached = False
+        return data
+
+    def replay(self, entry):
+        """Consume a SegmentCache entry's bytes without reading them again"""
+        size = len(entry.data)
+        skipped = min(size, self.buffered())
+        self.consume(skipped)
+        if size > skipped:
+            if self.read_ahead:
+                self.owed += size - skipped
+            else:
+                self.file.seek(size - skipped, os.SEEK_CUR)
+        if entry.prev is not False and entry.prev is self.cached:
+            # Reached through the same entries, so the digest state is the cached one
+            self.hasher = entry.hasher.copy()
+            self.cached = entry
+        else:
+            self.hasher.update(entry.data)
+            self.cached = False
+
+    def skip(self, size):
+        """Advance past size bytes the receiver already holds.
+
+        Skipped bytes are still read so the stream digest covers them.
+        """
+        while size > 0:
+            data = self.read(min(size, IDENTITY_SAMPLE))
+            if not data:
+                if self.eof or not self.read_ahead:
+                    break
+                # The bytes must go now; resuming is rare enough to wait on the disk for them
+                self.read_ahead.wait()
+                continue
+            size -= len(data)
+
+    def close(self):
+        if self.read_ahead:
+            # A read blocked on a quiet producer cannot be interrupted; its daemon thread keeps the file
+            self.read_ahead.close(wait=not self.blocking)
+            if self.read_ahead.thread.is_alive():
+                return
+        if self.file is not None and self.file is not sys.stdin.buffer:
+            self.file.close()
+
+class ReadAhead:
+    """Calls read on a background thread, keeping up to READ_AHEAD_DEPTH chunks ready.
+
+    The sender takes chunks without ever waiting on the disk or on a quiet
+    pipe: get returns None while the next one is still being read. A full
+    queue holds the thread back, so memory stays bounded however far the
+    sender lags.
+    """
+    def __init__(self, read, notify=None, chunk_size=READ_AHEAD_CHUNK, depth=READ_AHEAD_DEPTH):
+        # Only imported when read-ahead is on, keeping startup fast
+        import queue
+        import threading
+        self.read = read  # read(size) returns the next chunk, b'' at the end
+        self.notify = notify
+        self.chunk_size = chunk_size
+        self.chunks = queue.Queue(depth)
+        self.ready = None  # Chunk taken off the queue by wait
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='read-ahead', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        import queue
+        while not self.stopped.is_set():
+            try:
+                chunk = self.read(self.chunk_size)
+            except (OSError, ValueError) as e:
+                # Ends the stream early; the client's digest check catches it
+                print(f"Read-ahead failed: {e}")
+                chunk = b''
+            while not self.stopped.is_set():
+                try:
+                    self.chunks.put(chunk, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if self.notify:
+                self.notify()
+            if not chunk:
+                return
+
+    def get(self):
+        """Return the next chunk, b'' at the end of the file, or None if it is not read yet"""
+        chunk, self.ready = self.ready, None
+        if chunk is not None:
+            return chunk
+        # The sender is the only consumer, so a chunk seen here is still there to take
+        return None if self.chunks.empty() else self.chunks.get_nowait()
+
+    def wait(self):
+        """Block until the next chunk is read"""
+        if self.ready is None:
+            self.ready = self.chunks.get()
+
+    def close(self, wait=True):
+        self.stopped.set()
+        if wait:
+            self.thread.join()
+
+class SessionSource(StreamSource):
+    """Serves requested files back to back as one framed byte stream.
+
+    Each file is sent as a length-prefixed JSON header ({'id', 'name',
+    'size'} or {'id', 'name', 'error'}), its raw bytes, and a
+    length-prefixed JSON trailer holding the file's MD5. The stream only
+    ends once the client has sent its last request and everything queued
+    has been served.
+
+    Once multiplexed, each request is instead served on a stream of its
+    own (QUIC-style), framed the same way; see read_frame.
+    """
+    def __init__(self, root):
+        super().__init__((), f"<session {root}>")
+        self.root = os.path.realpath(root)
+        self.prefetching = False
+        self.notify = None
+        self.requests = []  # Queued (request id, name) pairs
+        self.seen = set()  # Request ids already queued, as requests are repeated
+        self.blocking = False  # Requested files are regular files
+        self.closing = False  # Client has sent its last request
+        self.current = None  # File being served
+        self.remaining = 0
+        self.file_hasher = None
+        self.streams = None  # Stream id (the request id) -> SessionSource for that request, once multiplexed
+        self.offsets = {}  # Stream id -> offset of its next byte
+        self.limits = {}  # Stream id -> offset the client lets it be sent up to
+        self.priorities = {}  # Stream id -> priority, lowest served first
+        self.window = STREAM_WINDOW
+        self.last_served = None
+
+    def multiplex(self, window=STREAM_WINDOW, priorities=()):
+        """Serve each request on its own stream, with window bytes of credit and the given [id, priority] pairs"""
+        self.streams = {}
+        self.window = window
+        self.priorities = {request_id: priority for request_id, priority in priorities}
+        print(f"Multiplexing requests as streams with a {window}-byte window each")
+
+    def request(self, requests, last=False):
+        """Queue [request id, name] pairs not seen before, or open a stream for each"""
+        for request_id, name in requests:
+            if request_id not in self.seen:
+                self.seen.add(request_id)
+                if self.streams is None:
+                    self.requests.append((request_id, name))
+                    print(f"Queued request {request_id}: {name}")
+                    continue
+                stream = self.streams[request_id] = SessionSource(self.root)
+                stream.request([[request_id, name]], last=True)
+                if self.prefetching:
+                    stream.prefetch(self.notify)
+                self.offsets[request_id] = 0
+                self.limits[request_id] = self.window
+                print(f"Opened stream {request_id} for {name} "
+                      f"(priority {self.priorities.get(request_id, 0)})")
+        self.closing = self.closing or last
+
+    def grant(self, limits):
+        """Raise streams' limits to the [stream id, offset] pairs the client's ACK grants"""
+        for stream_id, limit in limits:
+            if stream_id in self.limits:
+                self.limits[stream_id] = max(self.limits[stream_id], limit)
+
+    def read_frame(self, size):
+        """Consume up to size bytes of one stream; return (data, (stream id, offset)), or (b'', None).
+
+        The stream with the lowest priority value that has data and credit
+        goes first; streams of equal priority take turns.
+        """
+        def order(stream_id):
+            turn = self.last_served is not None and stream_id <= self.last_served
+            return self.priorities.get(stream_id, 0), turn, stream_id
+        for stream_id in sorted(self.streams, key=order):
+            stream, offset = self.streams[stream_id], self.offsets[stream_id]
+            if stream.eof or offset >= self.limits[stream_id]:
+                continue
+            data = stream.read(min(size, self.limits[stream_id] - offset))
+            if not data:
+                if stream.eof:
+                    print(f"Stream {stream_id} finished after {offset} bytes")
+                continue
+            self.offsets[stream_id] = offset + len(data)
+            self.last_served = stream_id
+            # Covers the connection as sent, like any stream's digest
+            self.hasher.update(data)
+            return data, (stream_id, offset)
+        self.eof = self.closing and all(stream.eof for stream in self.streams.values())
+        return b'', None
+
+    def prefetch(self, notify=None):
+        # Each requested file gets its own ReadAhead once it is opened
+        self.prefetching = True
+        self.notify = notify
+
+    def peek(self, size):
+        while self.buffered() < size:
+            chunk = self.next_chunk(size - self.buffered())
+            if not chunk:
+                break
+            self.pending += chunk
+        return bytes(self.pending[self.consumed:self.consumed + size])
+
+    def next_chunk(self, size):
+        """Produce the next piece of the framed stream, b'' when idle"""
+        if self.current is None:
+            if not self.requests:
+                self.exhausted = self.closing
+                return b''
+            request_id, name = self.requests.pop(0)
+            path = os.path.realpath(os.path.join(self.root, name))
+            header = {'id': request_id, 'name': name}
+            if not path.startswith(self.root + os.sep) or not os.path.isfile(path):
+                print(f"Request {request_id}: {name} not found")
+                header['error'] = 'not found'
+                return frame(header) + frame({'digest': None})
+            self.current = open(path, 'rb')
+            if self.prefetching:
+                self.read_ahead = ReadAhead(self.current.read, self.notify)
+            self.remaining = header['size'] = os.path.getsize(path)
+            self.file_hasher = hashlib.md5()
+            print(f"Serving request {request_id}: {name} ({self.remaining} bytes)")
+            return frame(header)
+        
+        if not self.remaining:
+            data = b''
+        elif self.read_ahead:
+            data = self.read_ahead.get()
+            if data is None:
+                # Still on its way from disk
+                return b''
+            data = data[:self.remaining]
+        else:
+            data = self.current.read(min(size, self.remaining))
+        self.file_hasher.update(data)
+        self.remaining -= len(data)
+        if not data or not self.remaining:
+            # A file that shrank while being read fails the client's digest check
+            self.close()
+            return data + frame({'digest': self.file_hasher.hexdigest()})
+        return data
+
+    def close(self):
+        if self.read_ahead:
+            self.read_ahead.close()
+            self.read_ahead = None
+        if self.current is not None:
+            self.current.close()
+            self.current = None
+        for stream in (self.streams or {}).values():
+            stream.close()
+
+def frame(header):
+    """Length-prefix a JSON header for the session stream"""
+    payload = json.dumps(header).encode()
+    return struct.pack('!I', len(payload)) + payload
+
+class SegmentCompressor:
+    """Adaptive per-segment zlib compression.
+
+    Every segment is compressed on its own, so losing one never stalls
+    decoding of the others. The raw span folded into a segment follows the
+    recent compression ratio so the base64 payload still fits in one MSS.
+    Compression backs off for a while when data turns out to be
+    incompressible or compressing is slower than the network can send.
+    """
+    def __init__(self, mss=MSS):
+        self.mss = mss
+        self.ratio = 1.0  # Smoothed raw bytes per wire byte
+        self.backoff = 0  # Segments left to send raw before probing again
+        self.cpu_rate = None  # Smoothed raw bytes compressed per second
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+
+    def span(self):
+        """Raw bytes worth reading for the next segment"""
+        if self.backoff:
+            return self.mss
+        return int(min(max(self.mss * self.ratio * 0.9, self.mss), MAX_COMPRESS_SPAN))
+
+    def encode(self, raw, send_rate=None):
+        """Return (raw bytes consumed, wire payload, compressed) for the next segment"""
+        if self.backoff:
+            self.backoff -= 1
+            return self.account(raw[:self.mss], raw[:self.mss], False)
+        
+        start = time.perf_counter()
+        packed = base64.b64encode(zlib.compress(raw, COMPRESS_LEVEL))
+        if len(packed) > self.mss and len(packed) < len(raw):
+            # Overshot the span; shrink once in proportion and retry
+            raw = raw[:int(len(raw) * self.mss / len(packed) * 0.95)]
+            packed = base64.b64encode(zlib.compress(raw, COMPRESS_LEVEL))
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        
+        ratio = len(raw) / len(packed)
+        self.ratio = 0.75 * self.ratio + 0.25 * ratio
+        rate = len(raw) / elapsed
+        self.cpu_rate = rate if self.cpu_rate is None else 0.75 * self.cpu_rate + 0.25 * rate
+        
+        if ratio < MIN_COMPRESS_RATIO:
+            print(f"Data compresses only {ratio:.2f}x, sending raw for {COMPRESS_BACKOFF} segments")
+            self.backoff = COMPRESS_BACKOFF
+        elif send_rate and self.cpu_rate < send_rate * self.ratio:
+            # Deliberate: compress only while zlib keeps up with what the path takes
+            # (cwnd/srtt). On loopback, or any path with a large window and a small
+            # RTT, it cannot, so most segments go raw there; compression pays off on
+            # bandwidth-limited paths with a real RTT (see p2_exp_compress.py)
+            print(f"Compression ({self.cpu_rate:.0f} B/s) is slower than the network, backing off")
+            self.backoff = COMPRESS_BACKOFF
+        
+        if len(packed) <= self.mss and ratio >= MIN_COMPRESS_RATIO:
+            return self.account(raw, packed, True)
+        return self.account(raw[:self.mss], raw[:self.mss], False)
+
+    def account(self, raw, payload, compressed):
+        self.raw_bytes += len(raw)
+        self.wire_bytes += len(payload)
+        return len(raw), payload, compressed
+
+def file_identity(file_path):
+    """Identify a file version by size, mtime and a hash of its first and last blocks"""
+    stat = os.stat(file_path)
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        hasher.update(file.read(IDENTITY_SAMPLE))
+        if stat.st_size > IDENTITY_SAMPLE:
+            file.seek(max(stat.st_size - IDENTITY_SAMPLE, IDENTITY_SAMPLE))
+            hasher.update(file.read(IDENTITY_SAMPLE))
+    return f"{stat.st_size}-{stat.st_mtime_ns}-{hasher.hexdigest()[:16]}"
+
+def open_source(source):
+    """Wrap a path ('-' for stdin), file object or chunk iterable as a StreamSource"""
+    if isinstance(source, StreamSource):
+        return source
+    if isinstance(source, str):
+        if source == '-':
+            return StreamSource(sys.stdin.buffer, "<stdin>")
+        identity = file_identity(source) if os.path.isfile(source) else None
+        return StreamSource(open(source, 'rb'), source, identity)
+    return StreamSource(source, getattr(source, 'name', "<stream>"))
+
+class Flow:
+    """One client connection: its stream, congestion state and place in the connection's life.
+
+    A flow is 'syn_received' until the client's first ACK, 'open' while it
+    sends, 'closing' once its FIN is out and 'closed' after the FIN-ACK or
+    the last retry. Flows never block, so one socket can serve many.
+    """
+    def __init__(self, conn, stream, cc, max_window=MAX_WINDOW, pacing=False, segment_cache=None):
+        self.conn = conn
+        self.max_window = max_window  # Send window cap, whatever cwnd and the client allow
+        self.pacing = pacing
+        # Only plain file segments are the same for every client
+        self.segment_cache = segment_cache if stream.identity and not conn.compression else None
+        self.next_send = 0  # With pacing, no new segment leaves before this time
+        self.stream = stream
+        self.cc = cc
+        self.compressor = SegmentCompressor(conn.mss) if conn.compression else None
+        self.held_ranges = conn.held_ranges
+        self.state = 'syn_received'
+        self.completed = False  # Every byte was acknowledged and the FIN sent
+        self.retries = 0  # SYN-ACK or FIN retransmissions so far
+        self.backoff = INITIAL_RTO
+        self.deadline = None  # When the SYN-ACK or FIN is next retransmitted
+        self.rto_start = time.time()  # The retransmission timer runs from the last ACK or timeout
+        self.start_time = self.rto_start
+        self.last_keepalive = 0
+
+    def available_window(self):
+        """Bytes of new data the congestion window, the client and the sequence space allow out now"""
+        cc, conn = self.cc, self.conn
+        available_window = min(cc.window(), self.max_window, conn.peer_window) - cc.packets_in_flight
+        # Unwrapping needs every number in flight within half the sequence space
+        return min(available_window, conn.max_outstanding - (cc.last_sent_byte - cc.last_acked_byte))
+
+    @property
+    def next_byte(self):
+        """Stream offset of the next new byte to send"""
+        return self.cc.last_sent_byte
+
+    @next_byte.setter
+    def next_byte(self, value):
+        self.cc.last_sent_byte = value
+
+    def send_data(self, server_socket):
+        """Send new segments while the window, and the pacing rate if any, allow"""
+        cc, conn = self.cc, self.conn
+        available_window = self.available_window()
+        print(f"\nAvailable window: {available_window} bytes, cwnd={cc.cwnd}, in-flight={cc.packets_in_flight}")
+        if not cc.unacked_packets:
+            self.rto_start = time.time()
+
+        while available_window >= conn.mss and not self.stream.eof:
+            if self.pacing and time.time() < self.next_send:
+                break
+            packet_size = self.send_segment(server_socket, conn, cc, available_window)
+            if not packet_size:
+                break
+            available_window -= packet_size
+            if self.pacing:
+                self.pace(packet_size)
+
+    def send_segment(self, server_socket, path, cc, available_window):
+        """Send the next segment of the stream on path; return its wire size, or 0 if no data is ready.
+
+        path is the Connection, or a Subflow standing in for it, and cc the
+        congestion state the segment is sent under.
+        """
+        stream, held_ranges, compressor = self.stream, self.held_ranges, self.compressor
+        while held_ranges and self.next_byte >= held_ranges[0][0]:
+            start, end = held_ranges.pop(0)
+            if end > self.next_byte:
+                print(f"Skipping bytes {self.next_byte}-{end}, already held by client")
+                stream.skip(end - self.next_byte)
+                self.next_byte = end
+        if stream.eof:
+            return 0
+
+        # Never let a segment run into a range the client already holds
+        segment_size = min(path.mss, available_window)
+        if compressor:
+            segment_size = compressor.span()
+        if held_ranges:
+            segment_size = min(segment_size, held_ranges[0][0] - self.next_byte)
+
+        compressed = False
+        frame = None
+        raw = stream.peek(segment_size) if compressor else b''
+        if raw:
+            send_rate = cc.cwnd / cc.rtt_estimator.srtt if cc.rtt_estimator.srtt else None
+            raw_size, data, compressed = compressor.encode(raw, send_rate)
+            stream.read(raw_size)
+        elif getattr(stream, 'streams', None) is not None:
+            data, frame = stream.read_frame(segment_size)
+            raw_size = len(data)
+        elif self.segment_cache:
+            entry = self.segment_cache.read(stream, self.next_byte, segment_size)
+            data = entry.data if entry else b''
+            raw_size = len(data)
+        else:
+            data = stream.read(segment_size)
+            raw_size = len(data)
+        if not data:
+            return 0
+
+        offset = self.next_byte
+        segment = Segment(data, offset + raw_size, compressed, frame)
+        if self.segment_cache:
+            segment.encoded = entry.encoded
+        packet = create_packet(path.wire_seq(offset), data, compressed=compressed, cid=path.cid,
+                               ts=segment.sent_time if path.timestamps else None, frame=frame,
+                               encoded=segment.encoded)
+        print(f"Sending packet with sequence number {offset} (size={raw_size}, wire={len(data)})")
+        server_socket.sendto(packet, path.client_address)
+
+        # The window counts wire bytes; sequence numbers count stream bytes
+        cc.track(offset, segment)
+        self.next_byte = cc.last_sent_byte = segment.end
+        cc.on_packet_sent(len(data))
+        return len(data)
+
+    def pace(self, packet_size):
+        """Hold the next segment back by packet_size at the pacing rate, so a window never leaves in one burst"""
+        cc = self.cc
+        if not cc.rtt_estimator.srtt:
+            # No RTT sample yet: the first flight goes out unpaced
+            return
+        gain = PACING_GAIN_SLOW_START if cc.cwnd < cc.ssthresh else PACING_GAIN
+        rate = gain * cc.window() / cc.rtt_estimator.srtt
+        # Idle time earns no burst credit
+        self.next_send = max(self.next_send, time.time()) + packet_size / rate
+
+    def finished(self):
+        return not self.cc.unacked_packets and self.stream.eof
+
+    def next_timer(self):
+        """Return (name, deadline) of the first timer due, or None while idle"""
+        if self.state in ('syn_received', 'closing'):
+            return ('handshake' if self.state == 'syn_received' else 'fin'), self.deadline
+        cc, loss_detector = self.cc, self.cc.loss_detector
+        # send_data has just run, so a pacing deadline still ahead is what holds back an open window
+        pace = (self.next_send if self.pacing and self.next_send > time.time() and not self.stream.eof
+                and self.available_window() >= self.conn.mss else None)
+        if not cc.unacked_packets:
+            # Idle session waiting for requests, or a quiet source: nothing can be lost
+            keepalive = self.keepalive_timer(cc.last_send_time)
+            if pace and (not keepalive or pace < keepalive[1]):
+                return 'pace', pace
+            return keepalive
+        loss_detector.arm_probe(cc)
+        timer = ('rto', self.rto_start + cc.rtt_estimator.rto)
+        for name, deadline in (('reorder', loss_detector.reorder_deadline),
+                               ('probe', loss_detector.probe_deadline), ('pace', pace)):
+            if deadline is not None and deadline < timer[1]:
+                timer = (name, deadline)
+        return timer
+
+    def keepalive_timer(self, last_send_time):
+        """Return ('keepalive', deadline) while the stream is open but has nothing to send, else None"""
+        if self.state != 'open' or self.stream.eof:
+            return None
+        return 'keepalive', max(last_send_time, self.last_keepalive) + KEEPALIVE_INTERVAL
+
+    def on_timer(self, server_socket, timer):
+        """Handle the timer returned by next_timer"""
+        cc, conn = self.cc, self.conn
+        if timer == 'pace':
+            # Nothing to do here: the next send_data may go ahead
+            return
+        if timer == 'keepalive':
+            # Without it the client takes a source that has gone quiet for a dead server
+            print(f"Nothing to send for {KEEPALIVE_INTERVAL:.0f} s, sending keepalive")
+            server_socket.sendto(json.dumps({'cid': conn.cid, 'keepalive': True}).encode(), conn.client_address)
+            self.last_keepalive = time.time()
+            return
+        self.rto_start = time.time()
+        if timer == 'handshake':
+            self.retries += 1
+            if self.retries >= MAX_HANDSHAKE_RETRIES:
+                print(f"Client {conn.cid:08x} never completed the handshake")
+                self.state = 'closed'
+                return
+            self.backoff = min(self.backoff * 2, MAX_RTO)
+            self.send_syn_ack(server_socket)
+        elif timer == 'fin':
+            self.retries += 1
+            if self.retries >= MAX_FIN_RETRIES:
+                # Every data byte was already acknowledged, so a lost FIN-ACK is harmless
+                print("No FIN-ACK received, closing anyway")
+                self.state = 'closed'
+                return
+            self.backoff = min(self.backoff * 2, MAX_RTO)
+            self.send_fin(server_socket)
+        elif timer == 'reorder':
+            retransmit_lost(server_socket, conn, cc, time.time())
+        elif timer == 'probe':
+            send_tail_loss_probe(server_socket, conn, cc)
+        else:
+            print("Timeout waiting for ACK, triggering timeout mechanism")
+            cc.on_timeout()
+            retransmit_segment(server_socket, conn, cc, cc.unacked_offsets[0])
+
+    def send_syn_ack(self, server_socket):
+        print(f"Sending SYN-ACK (isn={self.conn.isn}, attempt {self.retries + 1})")
+        server_socket.sendto(self.conn.syn_ack_packet, self.conn.client_address)
+        self.deadline = time.time() + self.backoff
+
+    def on_packet(self, server_socket, ack_data, client_address=None):
+        """Handle a packet the client sent on this connection"""
+        if ack_data.get('syn'):
+            # Our SYN-ACK was lost; the client is still retrying
+            print("Duplicate SYN, resending SYN-ACK")
+            server_socket.sendto(self.conn.syn_ack_packet, self.conn.client_address)
+        elif self.state == 'syn_received':
+            if 'ack_num' in ack_data:
+                print("Handshake complete")
+                self.state = 'open'
+        elif self.state == 'closing':
+            if ack_data.get('fin'):
+                if ack_data.get('verified'):
+                    print(f"FIN-ACK received, client verified digest {self.stream.hasher.hexdigest()}")
+                else:
+                    print(f"FIN-ACK received, but client could NOT verify digest {self.stream.hasher.hexdigest()}")
+                print("Connection closed")
+                self.state = 'closed'
+        elif 'ack_num' in ack_data:
+            self.on_ack(server_socket, ack_data)
+
+    def on_requests(self, ack_data):
+        """Take the session requests and stream credit an ACK carries"""
+        if not isinstance(self.stream, SessionSource):
+            return
+        if 'get' in ack_data:
+            # Requests are repeated on every ACK until served
+            self.stream.request(ack_data['get'], ack_data.get('last', False))
+        if 'smax' in ack_data and self.stream.streams is not None:
+            self.stream.grant(ack_data['smax'])
+
+    def on_ack(self, server_socket, ack_data):
+        cc, conn, stream = self.cc, self.conn, self.stream
+        self.rto_start = time.time()
+        self.on_requests(ack_data)
+        ack_num = conn.stream_offset(ack_data['ack_num'], cc.last_acked_byte)
+        if 'wnd' in ack_data:
+            # Flow control: the client shrinks its window while it holds out-of-order data
+            conn.peer_window = ack_data['wnd'] << conn.wscale
+        print(f"ACK received for sequence number {ack_num}")
+
+        # Update RTT if possible; an echoed timestamp is exact even for retransmissions
+        ts_echo = ack_data.get('ts_echo')
+        rtt = None
+        if ts_echo is not None:
+            if cc.unacked_offsets and cc.unacked_offsets[0] <= ack_num:
+                rtt = time.time() - ts_echo
+                cc.rtt_estimator.update(rtt)
+        elif ack_num in cc.unacked_packets:
+            send_time = cc.unacked_packets[ack_num].sent_time
+            rtt = time.time() - send_time
+            cc.rtt_estimator.update(rtt)
+
+        now = time.time()
+        delivered = remove_acked(cc, ack_num, now, ts_echo)
+        delivered += apply_sack(cc, conn, ack_data.get('sack', []), now, ts_echo)
+        cc.check_spurious(ack_num, ts_echo)
+        if 'dsack' in ack_data:
+            cc.on_duplicate_report(conn.stream_offset(ack_data['dsack'][0], ack_num))
+
+        # Process ACK
+        if cc.on_ack_received(ack_num, delivered, rtt) and cc.unacked_packets:
+            retransmit_segment(server_socket, conn, cc, cc.unacked_offsets[0])
+        if cc.rack:
+            retransmit_lost(server_socket, conn, cc, now)
+
+    def start_close(self, server_socket):
+        """Send the FIN, carrying the stream digest, once everything is acknowledged"""
+        print(f"All packets acknowledged ({self.next_byte} bytes), closing connection")
+        if self.compressor:
+            print(f"Compression: {self.compressor.raw_bytes} bytes sent as {self.compressor.wire_bytes} wire bytes")
+        self.state = 'closing'
+        self.completed = True
+        self.retries = 0
+        self.backoff = self.cc.rtt_estimator.rto
+        self.cc.close()
+        self.send_fin(server_socket)
+
+    def send_fin(self, server_socket):
+        conn = self.conn
+        fin_packet = create_packet(conn.wire_seq(self.next_byte), b'', fin=True,
+                                   digest=self.stream.hasher.hexdigest(), cid=conn.cid)
+        print(f"Sending FIN (seq={self.next_byte}, attempt {self.retries + 1})")
+        server_socket.sendto(fin_packet, conn.client_address)
+        self.deadline = time.time() + self.backoff
+
+    def report(self, cc=None):
+        cc = cc or self.cc
+        print(f"Transfer stats: {cc.timeouts} timeouts, {cc.fast_recoveries} fast recoveries, "
+              f"{cc.partial_acks} partial ACKs, {cc.retransmissions} retransmissions, "
+              f"{cc.spurious_retransmits} spurious")
+        if cc.rack:
+            print(f"Loss detection: {cc.loss_detector.losses} RACK losses, "
+                  f"{cc.loss_detector.probes} tail loss probes")
+
+class Subflow:
+    """One path of a multipath flow, standing in for the Connection with the path's own client address"""
+    def __init__(self, conn, path_id, client_address, cc):
+        self.conn = conn
+        self.path_id = path_id
+        self.client_address = client_address
+        self.cc = cc
+        self.rto_start = time.time()
+        self.timeouts = 0  # Back to back, with nothing delivered on the path in between
+        self.failed = False
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+class MultipathFlow(Flow):
+    """A flow spread over several paths, MPTCP-style.
+
+    The stream, its sequence space and flow control stay the connection's;
+    each path (Subflow) has its own client address, RTT estimate,
+    congestion window and RACK loss detection, with window growth coupled
+    across paths. New data goes to the lowest-RTT path with room; lost
+    segments are resent on the path that lost them, and a path that keeps
+    timing out hands what it has in flight to the others. The SYN's
+    address is path 0; the client opens the others with a JOIN from each.
+    Pacing is not applied, and metrics show path 0.
+    """
+    def __init__(self, conn, stream, cc, max_window=MAX_WINDOW, pacing=False, segment_cache=None):
+        super().__init__(conn, stream, cc, max_window, pacing, segment_cache)
+        self.hystart = cc.hystart is not None
+        self.sent_byte = 0  # Each path's last_sent_byte only marks the end of what it sent last
+        self.acked_byte = 0
+        self.paths = [Subflow(conn, 0, conn.client_address, cc)]
+        self.arrival = self.paths[0]  # Path the packet being handled came in on
+
+    @property
+    def next_byte(self):
+        return self.sent_byte
+
+    @next_byte.setter
+    def next_byte(self, value):
+        self.sent_byte = value
+
+    def live_paths(self):
+        """Paths still in use, lowest smoothed RTT first; those not yet measured come last"""
+        return sorted((path for path in self.paths if not path.failed),
+                      key=lambda path: path.cc.rtt_estimator.srtt or INITIAL_RTO)
+
+    def path_window(self, path):
+        """Bytes of new data path may send: its own window, within what the flow as a whole is allowed"""
+        conn = self.conn
+        in_flight = sum(p.cc.packets_in_flight for p in self.paths)
+        return min(min(path.cc.window(), self.max_window) - path.cc.packets_in_flight,
+                   conn.peer_window - in_flight,
+                   conn.max_outstanding - (self.sent_byte - self.acked_byte))
+
+    def send_data(self, server_socket):
+        """Fill each path's window in turn, fastest path first"""
+        for path in self.live_paths():
+            cc = path.cc
+            available_window = self.path_window(path)
+            print(f"\nPath {path.path_id}: available window {available_window} bytes, cwnd={cc.cwnd}, "
+                  f"in-flight={cc.packets_in_flight}")
+            if not cc.unacked_packets:
+                path.rto_start = time.time()
+            while available_window >= path.mss and not self.stream.eof:
+                packet_size = self.send_segment(server_socket, path, cc, available_window)
+                if not packet_size:
+                    return
+                available_window -= packet_size
+
+    def finished(self):
+        return self.stream.eof and not any(path.cc.unacked_packets for path in self.paths)
+
+    def next_timer(self):
+        """Return the first timer due on any path, named 'rto:<path>', 'reorder:<path>' or 'probe:<path>', or a keepalive"""
+        if self.state in ('syn_received', 'closing'):
+            return super().next_timer()
+        timer = None
+        for path in self.paths:
+            cc, loss_detector = path.cc, path.cc.loss_detector
+            if path.failed or not cc.unacked_packets:
+                continue
+            loss_detector.arm_probe(cc)
+            for name, deadline in (('rto', path.rto_start + cc.rtt_estimator.rto),
+                                   ('reorder', loss_detector.reorder_deadline),
+                                   ('probe', loss_detector.probe_deadline)):
+                if deadline is not None and (timer is None or deadline < timer[1]):
+                    timer = (f"{name}:{path.path_id}", deadline)
+        return timer or self.keepalive_timer(max(path.cc.last_send_time for path in self.paths))
+
+    def on_timer(self, server_socket, timer):
+        name, _, path_id = timer.partition(':')
+        if not path_id:
+            return super().on_timer(server_socket, timer)
+        path = self.paths[int(path_id)]
+        cc = path.cc
+        path.rto_start = time.time()
+        if name == 'reorder':
+            retransmit_lost(server_socket, path, cc, time.time())
+        elif name == 'probe':
+            send_tail_loss_probe(server_socket, path, cc)
+        else:
+            print(f"Timeout waiting for ACK on path {path.path_id}, triggering timeout mechanism")
+            path.timeouts += 1
+            cc.on_timeout()
+            others = [p for p in self.live_paths() if p is not path]
+            if path.timeouts >= MAX_PATH_TIMEOUTS and others:
+                self.fail_path(server_socket, path, others[0])
+            else:
+                retransmit_segment(server_socket, path, cc, cc.unacked_offsets[0])
+
+    def fail_path(self, server_socket, path, backup):
+        """Stop using path, resending on backup whatever it still had in flight"""
+        print(f"Path {path.path_id} timed out {path.timeouts} times in a row, "
+              f"moving its segments to path {backup.path_id}")
+        path.failed = True
+        path.cc.close()
+        for offset in path.cc.unacked_offsets:
+            segment = path.cc.unacked_packets[offset]
+            if segment.sacked:
+                continue
+            backup.cc.track(offset, segment)
+            backup.cc.packets_in_flight += len(segment.data)
+            backup.cc.last_sent_byte = max(backup.cc.last_sent_byte, segment.end)
+            retransmit_segment(server_socket, backup, backup.cc, offset)
+        # The handed-over segments were never checked against the backup's SACK blocks
+        backup.cc.sack_seen = []
+        path.cc.forget_unacked()
+        path.cc.packets_in_flight = 0
+
+    def on_packet(self, server_socket, ack_data, client_address=None):
+        path = next((path for path in self.paths if path.client_address == client_address), None)
+        if 'join' in ack_data:
+            self.join(server_socket, ack_data['join'], client_address, path)
+            return
+        self.arrival = path or self.paths[0]
+        super().on_packet(server_socket, ack_data, client_address)
+
+    def join(self, server_socket, client_path, client_address, path):
+        """Open a path from client_address, or confirm it again if the client missed the JOIN-ACK"""
+        if path is None:
+            if self.state not in ('syn_received', 'open') or len(self.paths) >= self.conn.paths:
+                print(f"Refusing a path from {client_address}")
+                return
+            cc = CoupledCongestionControl(self.cc.coupled, self.hystart, self.max_window)
+            cc.rack = True
+            path = Subflow(self.conn, len(self.paths), client_address, cc)
+            self.paths.append(path)
+            print(f"Path {path.path_id} joined from {client_address}")
+        join_ack = {'cid': self.conn.cid, 'join': client_path, 'ack': True}
+        server_socket.sendto(json.dumps(join_ack).encode(), client_address)
+
+    def on_ack(self, server_socket, ack_data):
+        conn, stream, arrival = self.conn, self.stream, self.arrival
+        now = time.time()
+        self.on_requests(ack_data)
+        ack_num = conn.stream_offset(ack_data['ack_num'], self.acked_byte)
+        if 'wnd' in ack_data:
+            conn.peer_window = ack_data['wnd'] << conn.wscale
+        print(f"ACK received for sequence number {ack_num} on path {arrival.path_id}")
+        self.acked_byte = max(self.acked_byte, ack_num)
+
+        # The client echoes the send time of the segment behind this ACK, which came and went on this path
+        rtt = None
+        if ack_data.get('ts_path') is not None:
+            rtt = now - ack_data['ts_path']
+            arrival.cc.rtt_estimator.update(rtt)
+
+        ts_echo = ack_data.get('ts_echo')
+        for path in self.paths:
+            cc = path.cc
+            delivered = remove_acked(cc, ack_num, now, ts_echo)
+            delivered += apply_sack(cc, path, ack_data.get('sack', []), now, ts_echo, near=ack_num)
+            cc.check_spurious(ack_num, ts_echo)
+            if 'dsack' in ack_data:
+                cc.on_duplicate_report(conn.stream_offset(ack_data['dsack'][0], ack_num))
+            if delivered:
+                path.timeouts = 0
+                path.rto_start = now
+            elif path is not arrival:
+                continue
+            # The path's own cumulative ACK: all it sent below its first segment not yet delivered
+            first = next((offset for offset in cc.unacked_offsets if not cc.unacked_packets[offset].sacked), None)
+            path_ack = (cc.last_sent_byte if first is None else first) - 1 if delivered else cc.last_acked_byte
+            cc.on_ack_received(path_ack, delivered, rtt if path is arrival else None)
+            retransmit_lost(server_socket, path, cc, now)
+
+    def start_close(self, server_socket):
+        for path in self.paths[1:]:
+            path.cc.close()
+        super().start_close(server_socket)
+
+    def send_fin(self, server_socket):
+        """Send the FIN on the fastest path still in use"""
+        conn, path = self.conn, self.live_paths()[0]
+        fin_packet = create_packet(conn.wire_seq(self.next_byte), b'', fin=True,
+                                   digest=self.stream.hasher.hexdigest(), cid=conn.cid)
+        print(f"Sending FIN on path {path.path_id} (seq={self.next_byte}, attempt {self.retries + 1})")
+        server_socket.sendto(fin_packet, path.client_address)
+        self.deadline = time.time() + self.backoff
+
+    def report(self):
+        for path in self.paths:
+            print(f"Path {path.path_id} ({path.client_address[0]}:{path.client_address[1]}): "
+                  f"{path.cc.bytes_sent} wire bytes sent{', failed' if path.failed else ''}")
+            super().report(path.cc)
+
+class Metrics:
+    """Live transfer metrics, served in Prometheus text format.
+
+    Nothing is recorded on the send path: a scrape reads the counters the
+    congestion controllers already keep, from the flows dict send_file
+    owns. Closed flows are folded into totals so aggregates never go back.
+    """
+    COUNTERS = (  # (name, help, value of a flow)
+        ('bytes_sent_total', 'Wire bytes sent, retransmissions included', lambda f: f.cc.bytes_sent),
+        ('bytes_acked_total', 'Stream bytes cumulatively acknowledged', lambda f: f.cc.last_acked_byte),
+        ('retransmits_total', 'Segments retransmitted', lambda f: f.cc.retransmissions),
+        ('timeouts_total', 'Retransmission timeouts', lambda f: f.cc.timeouts),
+        ('fast_recoveries_total', 'Fast recovery episodes', lambda f: f.cc.fast_recoveries),
+        ('dup_acks_total', 'Duplicate ACKs received', lambda f: f.cc.dup_acks),
+    )
+    GAUGES = (
+        ('cwnd_bytes', 'Congestion window', lambda f: f.cc.window()),
+        ('ssthresh_bytes', 'Slow start threshold', lambda f: f.cc.ssthresh),
+        ('srtt_seconds', 'Smoothed round-trip time', lambda f: f.cc.rtt_estimator.srtt or 0),
+        ('rto_seconds', 'Retransmission timeout', lambda f: f.cc.rtt_estimator.rto),
+        ('inflight_bytes', 'Wire bytes in flight', lambda f: f.cc.packets_in_flight),
+        ('goodput_bytes_per_second', 'Acknowledged stream bytes per second since the handshake',
+         lambda f: f.cc.last_acked_byte / max(time.time() - f.start_time, MIN_TIMER)),
+    )
+
+    def __init__(self, flows, segment_cache=None):
+        self.flows = flows
+        self.segment_cache = segment_cache
+        self.closed = {name: 0 for name, _, _ in self.COUNTERS}
+        self.flows_closed = 0
+
+    def on_close(self, flow):
+        for name, _, value in self.COUNTERS:
+            self.closed[name] += value(flow)
+        self.flows_closed += 1
+
+    def render(self):
+        flows = list(self.flows.values())  # One atomic copy; the send loop keeps running
+        labels = [f'cid="{f.conn.cid:08x}",client="{f.conn.client_address[0]}:{f.conn.client_address[1]}"'
+                  for f in flows]
+        lines = []
+        for kind, metrics in (('counter', self.COUNTERS), ('gauge', self.GAUGES)):
+            for name, help, value in metrics:
+                lines.append(f"# HELP p2_flow_{name} {help}")
+                lines.append(f"# TYPE p2_flow_{name} {kind}")
+                lines.extend(f"p2_flow_{name}{{{label}}} {value(f)}" for f, label in zip(flows, labels))
+        for name, help, value in self.COUNTERS:
+            lines.append(f"# HELP p2_{name} {help}, all flows")
+            lines.append(f"# TYPE p2_{name} counter")
+            lines.append(f"p2_{name} {self.closed[name] + sum(value(f) for f in flows)}")
+        lines.append("# HELP p2_inflight_bytes Wire bytes in flight, all flows")
+        lines.append("# TYPE p2_inflight_bytes gauge")
+        lines.append(f"p2_inflight_bytes {sum(f.cc.packets_in_flight for f in flows)}")
+        lines.append("# HELP p2_flows Open flows")
+        lines.append("# TYPE p2_flows gauge")
+        lines.append(f"p2_flows {len(flows)}")
+        lines.append("# HELP p2_flows_closed_total Flows closed")
+        lines.append("# TYPE p2_flows_closed_total counter")
+        lines.append(f"p2_flows_closed_total {self.flows_closed}")
+        cache = self.segment_cache
+        if cache:
+            for name, help, kind, value in (
+                    ('hits_total', 'Segments sent from the cache', 'counter', cache.hits),
+                    ('misses_total', 'Segments read and added to the cache', 'counter', cache.misses),
+                    ('evictions_total', 'Segments evicted to stay within the budget', 'counter', cache.evictions),
+                    ('invalidations_total', 'Segments dropped because their file changed', 'counter',
+                     cache.invalidations),
+                    ('bytes', 'Raw and encoded bytes held', 'gauge', cache.size)):
+                lines.append(f"# HELP p2_segment_cache_{name} {help}")
+                lines.append(f"# TYPE p2_segment_cache_{name} {kind}")
+                lines.append(f"p2_segment_cache_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host='127.0.0.1'):
+        """Answer scrapes on http://host:port/metrics from a daemon thread"""
+        # Only imported when metrics are on, keeping startup fast
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Scrapes would drown the transfer log
+
+        httpd = ThreadingHTTPServer((host, port), Handler)
+        httpd.daemon_threads = True
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        print(f"Serving metrics on http://{host}:{port}/metrics")
+        return httpd
+
+class OffloadSocket:
+    """Sender socket that queues datagrams and hands them to the kernel in batches (UDP GSO).
+
+    Each batch goes out in one sendmsg, as equal-size segments the kernel
+    splits back into datagrams; shorter packets are padded with spaces,
+    which JSON ignores. The owner flushes the queue before it waits, so
+    a burst of ACKs releases one batch and nothing is held while the
+    sender sleeps. If the kernel turns a batch down, the socket falls
+    back to one send per datagram.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self.queued = {}  # {address: [packet]}
+        self.offload = True
+        self.batches = 0
+        self.datagrams = 0
+
+    @staticmethod
+    def supported(sock):
+        """True if the kernel can segment UDP sends (Linux 4.18 or later)"""
+        if not hasattr(sock, 'sendmsg'):
+            return False
+        try:
+            sock.getsockopt(socket.IPPROTO_UDP, UDP_SEGMENT)
+            return True
+        except OSError:
+            return False
+
+    def sendto(self, packet, address):
+        self.queued.setdefault(address, []).append(packet)
+        return len(packet)
+
+    def flush(self):
+        for address, packets in self.queued.items():
+            batch, size = [], 0
+            for packet in packets:
+                # Every segment but the last is padded to the batch's largest packet
+                grown = max(size, len(packet))
+                if batch and (len(batch) == GSO_MAX_SEGMENTS or grown * (len(batch) + 1) > GSO_MAX_BYTES):
+                    self.send_batch(batch, size, address)
+                    batch, grown = [], len(packet)
+                batch.append(packet)
+                size = grown
+            if batch:
+                self.send_batch(batch, size, address)
+        self.queued = {}
+
+    def send_batch(self, batch, size, address):
+        if self.offload and len(batch) > 1:
+            buffer = b''.join(packet.ljust(size) for packet in batch[:-1]) + batch[-1]
+            try:
+                self.sock.sendmsg([buffer], [(socket.IPPROTO_UDP, UDP_SEGMENT, struct.pack('=H', size))], 0, address)
+                self.batches += 1
+                self.datagrams += len(batch)
+                return
+            except OSError as e:
+                # e.g. EIO from a device without checksum offload
+                print(f"Segmentation offload failed ({e}), sending datagrams one by one")
+                self.offload = False
+        for packet in batch:
+            self.sock.sendto(packet, address)
+
+    def close(self):
+        self.flush()
+        if self.batches:
+            print(f"Segmentation offload: {self.datagrams} datagrams in {self.batches} sends")
+        self.sock.close()
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+class Reactor:
+    """Waits until a registered socket is readable or a deadline passes (selectors: epoll on Linux).
+
+    Where Python exposes timerfd (3.13 and later on Linux), the deadline
+    is armed on one and waited on with the sockets, so timers fire with
+    the clock's precision rather than the poll timeout's milliseconds.
+    Other threads end a wait early with wakeup.
+    """
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.timerfd = None
+        if hasattr(os, 'timerfd_create'):
+            # Deadlines are time.time() values, hence the realtime clock
+            self.timerfd = os.timerfd_create(time.CLOCK_REALTIME, flags=os.TFD_NONBLOCK)
+            self.selector.register(self.timerfd, selectors.EVENT_READ)
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_r, False)
+        os.set_blocking(self.wake_w, False)
+        self.selector.register(self.wake_r, selectors.EVENT_READ)
+
+    def register(self, sock):
+        self.selector.register(sock, selectors.EVENT_READ)
+
+    def wait(self, deadline=None):
+        """Return the sockets readable before deadline, a time.time() value; None waits for a packet"""
+        if self.timerfd is not None:
+            # A deadline already past fires at once; 0 disarms the timer
+            os.timerfd_settime(self.timerfd, flags=os.TFD_TIMER_ABSTIME, initial=deadline or 0)
+            timeout = None
+        else:
+            timeout = None if deadline is None else max(deadline - time.time(), 0)
+        ready = []
+        for key, _ in self.selector.select(timeout):
+            if key.fileobj not in (self.timerfd, self.wake_r):
+                ready.append(key.fileobj)
+                continue
+            try:
+                os.read(key.fileobj, 4096)
+            except BlockingIOError:
+                pass
+        return ready
+
+    def wakeup(self):
+        """End the current or next wait; safe to call from any thread"""
+        try:
+            os.write(self.wake_w, b'\0')
+        except BlockingIOError:
+            # The pipe is full, so a wakeup is already pending
+            pass
+
+    def close(self):
+        self.selector.close()
+        for fd in (self.timerfd, self.wake_r, self.wake_w):
+            if fd is not None:
+                os.close(fd)
+
+def size_socket_buffers(sock, size):
+    """Ask for size-byte send and receive buffers, so a large window is not dropped at the socket"""
+    for option, name in ((socket.SO_SNDBUF, 'SO_SNDBUF'), (socket.SO_RCVBUF, 'SO_RCVBUF')):
+        sock.setsockopt(socket.SOL_SOCKET, option, size)
+        # Linux doubles the request for bookkeeping, then caps it at net.core.[wr]mem_max
+        granted = sock.getsockopt(socket.SOL_SOCKET, option)
+        print(f"{name}: asked for {size} bytes, got {granted}")
+        if granted < size:
+            print(f"Warning: {name} capped by the kernel; raise net.core.{'w' if option == socket.SO_SNDBUF else 'r'}mem_max")
+
+def send_file(server_ip, server_port, source="input.txt", allow_compression=False, allow_fast_open=False,
+              hystart=True, cc_algorithm='reno', max_flows=1, share=True, metrics_port=None, profiler=None,
+              max_window=MAX_WINDOW, sock_buffer=None, offload=False, pacing=False, read_ahead=False,
+              max_paths=1, segment_cache=None):
+    """Send a byte stream to each of max_flows clients using TCP Reno-like congestion control.
+
+    Flows run side by side on one socket, told apart by connection ID.
+    Reno flows to the same host share one CongestionManager unless share
+    is off. source may be a callable returning a fresh source per flow.
+    With metrics_port set, live metrics are served on that local port.
+    A StageProfiler, if given, times the socket calls. max_window caps
+    every flow's send window; sock_buffer sizes the socket buffers, by
+    default to fit a window above the usual cap. offload batches sends
+    with UDP GSO where the kernel supports it. pacing spreads each
+    window's segments over the RTT instead of sending them back to back.
+    read_ahead reads files on a background thread, so a slow disk delays
+    new data but never the handling of ACKs and timers; pipes, stdin and
+    chunk iterators are always read that way. While a quiet source leaves
+    nothing in flight, the client gets a keepalive every KEEPALIVE_INTERVAL. A client may
+    spread its transfer over up to max_paths paths (MultipathFlow).
+    segment_cache, a SegmentCache, keeps the input file's segments, read
+    and encoded, for the clients after the first.
+
+    The socket is non-blocking: one Reactor wait covers ACKs, new
+    connections and every flow's timers, and each wakeup takes all the
+    packets already queued before the flows send again.
+    """
     print(f"Server starting on {server_ip}:{server_port}")
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     server_socket.bind((server_ip, server_port))
     print(f"Server listening on {server_ip}:{server_port}")
-    
-    cc = CongestionControl()
-    file_path = "input.txt"
-    
+    server_socket.setblocking(False)
+    if sock_buffer or max_window > MAX_WINDOW:
+        size_socket_buffers(server_socket, sock_buffer or max_window)
+    offload_socket = None
+    if offload:
+        if OffloadSocket.supported(server_socket):
+            print("Using UDP segmentation offload")
+            server_socket = offload_socket = OffloadSocket(server_socket)
+        else:
+            print("UDP segmentation offload not supported here, sending datagrams one by one")
+    if profiler:
+        server_socket = profiler.wrap(server_socket, sendto='sendto', recvfrom='recvfrom')
+
+    reactor = Reactor()
+    reactor.register(server_socket)
+    flows = {}  # {cid: Flow}
+    managers = {}  # {client host: CongestionManager}
+    accepted = 0
+    metrics = Metrics(flows, segment_cache)
+    httpd = metrics.serve(metrics_port) if metrics_port else None
+
     try:
-        # Wait for initial client connection
-        print(f"Waiting for client connection...")
-        data, client_address = server_socket.recvfrom(1024)
-        print(f"Client connected from {client_address}")
-        
-        file_size = os.path.getsize(file_path)
-        print(f"File to send: {file_path} ({file_size} bytes)")
-        
-        with open(file_path, 'rb') as file:
-            while True:
-                # Calculate available window
-                available_window = min(cc.cwnd, INITIAL_SSTHRESH) - cc.packets_in_flight
-                print(f"\nAvailable window: {available_window} bytes, cwnd={cc.cwnd}, in-flight={cc.packets_in_flight}")
-                
-                # Send data while window allows
-                while available_window >= MSS and cc.last_sent_byte < file_size:
-                    file.seek(cc.last_sent_byte)
-                    data = file.read(min(MSS, available_window))
-                    if not data:
+        while accepted < max_flows or flows:
+            for flow in list(flows.values()):
+                if flow.state == 'open':
+                    flow.send_data(server_socket)
+                    if flow.finished():
+                        flow.start_close(server_socket)
+
+            # Wait for the next packet, or for the first timer of any flow to fire
+            timers = [(timer[1], timer[0]) for flow in flows.values()
+                      if flow.state != 'closed' and (timer := flow.next_timer())]
+            deadline, timer = min(timers) if timers else (None, None)
+            if deadline is not None:
+                print(f"Waiting for ACK with timeout of {max(deadline - time.time(), 0)} seconds ({timer} timer)...")
+            elif not flows:
+                print(f"Waiting for client connection...")
+            if offload_socket:
+                offload_socket.flush()
+
+            if reactor.wait(deadline):
+                # Take every packet already queued, so a burst of ACKs costs one wakeup
+                for _ in range(MAX_READ_BATCH):
+                    try:
+                        packet, client_address = server_socket.recvfrom(BUFFER_SIZE)
+                    except BlockingIOError:
                         break
-                    
-                    packet = create_packet(cc.last_sent_byte, data)
-                    print(f"Sending packet with sequence number {cc.last_sent_byte} (size={len(data)})")
-                    server_socket.sendto(packet, client_address)
-                    
-                    packet_size = len(data)
-                    cc.unacked_packets[cc.last_sent_byte] = (data, time.time())
-                    cc.last_sent_byte += packet_size
-                    cc.packets_in_flight += packet_size
-                    available_window -= packet_size
-                
-                # Handle ACKs and timeouts
-                try:
-                    server_socket.settimeout(cc.rtt_estimator.rto)
-                    print(f"Waiting for ACK with timeout of {cc.rtt_estimator.rto} seconds...")
-                    ack_packet, _ = server_socket.recvfrom(1024)
-                    ack_data = parse_ack(ack_packet)
-                    
-                    if ack_data:
-                        ack_num = ack_data['ack_num']
-                        print(f"ACK received for sequence number {ack_num}")
-                        
-                        # Update RTT if possible
-                        if ack_num in cc.unacked_packets:
-                            send_time = cc.unacked_packets[ack_num][1]
-                            rtt = time.time() - send_time
-                            cc.rtt_estimator.update(rtt)
-                        
-                        # Process ACK
-                        cc.on_ack_received(ack_num)
-                        
-                        # Remove acknowledged packets
-                        keys_to_remove = [k for k in cc.unacked_packets.keys() if k <= ack_num]
-                        for k in keys_to_remove:
-                            packet_size = len(cc.unacked_packets[k][0])
-                            cc.packets_in_flight -= packet_size
-                            del cc.unacked_packets[k]
-                            print(f"Packet with sequence number {k} acknowledged and removed from unacked list")
-                
-                except socket.timeout:
-                    print("Timeout waiting for ACK, triggering timeout mechanism")
-                    cc.on_timeout()
-                    if cc.unacked_packets:
-                        first_unacked = min(cc.unacked_packets.keys())
-                        data = cc.unacked_packets[first_unacked][0]
-                        print(f"Retransmitting packet with sequence number {first_unacked}")
-                        packet = create_packet(first_unacked, data)
-                        server_socket.sendto(packet, client_address)
-                
-                # Check if transfer is complete
-                if not cc.unacked_packets and cc.last_sent_byte >= file_size:
-                    print("All packets acknowledged, sending end marker")
-                    end_packet = create_packet(-1, b'')
-                    server_socket.sendto(end_packet, client_address)
-                    break
-    
+                    ack_data = parse_ack(packet)
+                    cid = ack_data.get('cid') if ack_data else None
+                    if cid in flows:
+                        flows[cid].on_packet(server_socket, ack_data, client_address)
+                    elif ack_data and ack_data.get('syn') and cid is not None and accepted < max_flows:
+                        accepted += 1
+                        stream = open_source(source() if callable(source) else source)
+                        print(f"Streaming from {stream.name}")
+                        if segment_cache and stream.identity:
+                            segment_cache.open(stream.name, stream.identity)
+                        if read_ahead or stream.blocking:
+                            # A chunk landing ends the wait, in case it is all the sender is waiting for.
+                            # Pipes and generators always get a reader thread: they can block for as long
+                            # as their producer is quiet, and the packet loop must not block with them
+                            stream.prefetch(reactor.wakeup)
+                        conn = negotiate(ack_data, client_address, stream, allow_compression, allow_fast_open,
+                                         cc_algorithm, max_paths)
+                        if conn.paths > 1:
+                            print(f"Multipath: the client may open {conn.paths - 1} more paths")
+                            cc = CoupledCongestionControl([], hystart, max_window)
+                        elif share and max_flows > 1 and conn.cc == 'reno':
+                            # Flows to one host see the same bottleneck; never let them compete
+                            if client_address[0] not in managers:
+                                managers[client_address[0]] = CongestionManager(max_window)
+                            manager = managers[client_address[0]]
+                            cc = SharedCongestionControl(manager, conn.weight, hystart)
+                            print(f"Sharing congestion state with {len(manager.flows) - 1} other flows "
+                                  f"to {client_address[0]} (weight {conn.weight})")
+                        else:
+                            cc = CongestionControl(hystart, max_window)
+                        cc.rack = conn.sack
+                        if conn.cc == 'ledbat':
+                            print("Background transfer: using LEDBAT congestion control")
+                            cc.ledbat = Ledbat()
+                        flow_class = MultipathFlow if conn.paths > 1 else Flow
+                        flow = flows[cid] = flow_class(conn, stream, cc, max_window, pacing, segment_cache)
+                        flow.send_syn_ack(server_socket)
+                        if conn.fast_open:
+                            # The first flight follows the SYN-ACK; the client's first ACK completes the handshake
+                            print("Fast open: data follows immediately")
+                            flow.state = 'open'
+                    else:
+                        print(f"Ignoring unexpected packet from {client_address}")
+
+            # Fire every timer now due, in any flow; an ACK just taken may have pushed its timer back
+            now = time.time()
+            for flow in list(flows.values()):
+                if flow.state != 'closed' and (timer := flow.next_timer()) and timer[1] <= now:
+                    flow.on_timer(server_socket, timer[0])
+
+            for cid in [cid for cid, flow in flows.items() if flow.state == 'closed']:
+                flow = flows.pop(cid)
+                metrics.on_close(flow)
+                flow.stream.close()
+                if flow.completed:
+                    flow.report()
+                    if segment_cache:
+                        segment_cache.report()
+                else:
+                    flow.cc.close()
+
     except Exception as e:
         print(f"Error: {e}")
     finally:
+        for flow in flows.values():
+            flow.stream.close()
+        if httpd:
+            httpd.shutdown()
+        reactor.close()
         print("Closing server socket")
         server_socket.close()
 
-def create_packet(seq_num, data):
-    """Create packet with sequence number and data"""
+def retransmit_segment(server_socket, conn, cc, offset):
+    """Resend the unacknowledged segment starting at offset"""
+    segment = cc.unacked_packets[offset]
+    print(f"Retransmitting packet with sequence number {offset}")
+    segment.sent_time = time.time()
+    segment.retransmitted = True
+    if offset in cc.send_order:
+        cc.send_order.move_to_end(offset)
+    packet = create_packet(conn.wire_seq(offset), segment.data, compressed=segment.compressed, cid=conn.cid,
+                           ts=segment.sent_time if conn.timestamps else None, frame=segment.frame,
+                           encoded=segment.encoded)
+    server_socket.sendto(packet, conn.client_address)
+    cc.on_packet_sent(len(segment.data), retransmission=True)
+    cc.on_retransmit(offset, segment)
+
+def remove_acked(cc, ack_num, now, ts_echo=None):
+    """Drop segments the cumulative ACK covers. Returns the wire bytes newly delivered"""
+    # SACKed segments already left the flight
+    delivered = 0
+    keys_to_remove = cc.unacked_offsets[:bisect.bisect_right(cc.unacked_offsets, ack_num)]
+    del cc.unacked_offsets[:len(keys_to_remove)]
+    for k in keys_to_remove:
+        segment = cc.unacked_packets.pop(k)
+        cc.send_order.pop(k, None)
+        if not segment.sacked:
+            cc.packets_in_flight -= len(segment.data)
+            delivered += len(segment.data)
+            cc.loss_detector.on_delivered(segment, now, ts_echo)
+        print(f"Packet with sequence number {k} acknowledged and removed from unacked list")
+    if keys_to_remove:
+        cc.loss_detector.probe_sent = False
+    return delivered
+
+def apply_sack(cc, conn, blocks, now, ts_echo=None, near=None):
+    """Mark segments inside the ACK's SACK blocks. Returns the wire bytes newly SACKed.
+
+    Block edges are unwrapped near the cumulative ACK, by default cc's.
+    Only the parts of the blocks the previous ACK did not already report
+    are walked, as in Linux's SACK cache.
+    """
+    delivered = 0
+    near = cc.last_acked_byte if near is None else near
+    offsets = cc.unacked_offsets
+    ranges = [(conn.stream_offset(wire_start, near), conn.stream_offset(wire_end, near))
+              for wire_start, wire_end in blocks]
+    for start, end in ranges:
+        for low, high in subtract_ranges(start, end, cc.sack_seen):
+            i = bisect.bisect_left(offsets, low)
+            if i and offsets[i - 1] >= start and cc.unacked_packets[offsets[i - 1]].end > low:
+                # Straddled the edge of a block that has since grown
+                i -= 1
+            while i < len(offsets) and offsets[i] < high:
+                segment = cc.unacked_packets[offsets[i]]
+                if segment.end <= end and not segment.sacked:
+                    segment.sacked = True
+                    del cc.send_order[offsets[i]]
+                    cc.packets_in_flight -= len(segment.data)
+                    delivered += len(segment.data)
+                    cc.loss_detector.on_delivered(segment, now, ts_echo)
+                i += 1
+    cc.sack_seen = ranges
+    return delivered
+
+def subtract_ranges(start, end, ranges):
+    """Return the pieces of [start, end) that no (start, end) pair in ranges covers"""
+    pieces = [(start, end)]
+    for covered_start, covered_end in ranges:
+        pieces = [piece for low, high in pieces
+                  for piece in ((low, min(high, covered_start)), (max(low, covered_end), high))
+                  if piece[0] < piece[1]]
+    return pieces
+
+def retransmit_lost(server_socket, conn, cc, now):
+    """Run RACK and retransmit whatever it finds lost, entering recovery if needed"""
+    lost = cc.loss_detector.detect_losses(cc.send_order, cc.rtt_estimator.srtt, now)
+    if lost and not cc.in_fast_recovery:
+        cc.on_triple_duplicate_ack()
+    for offset in lost:
+        print(f"RACK: segment {offset} is lost")
+        retransmit_segment(server_socket, conn, cc, offset)
+
+def send_tail_loss_probe(server_socket, conn, cc):
+    """Resend the last unSACKed segment so its ACK reveals any losses before it"""
+    cc.loss_detector.probe_sent = True
+    cc.loss_detector.probes += 1
+    last = next((offset for offset in reversed(cc.unacked_offsets) if not cc.unacked_packets[offset].sacked), None)
+    if last is not None:
+        print(f"Tail loss probe")
+        retransmit_segment(server_socket, conn, cc, last)
+
+def negotiate(syn, client_address, stream, allow_compression=False, allow_fast_open=False, cc_algorithm='reno',
+              max_paths=1):
+    """Answer a client's SYN: return its Connection, with the SYN-ACK to send.
+
+    The client's options are negotiated down to what this server supports
+    and echoed in the SYN-ACK. Either end can make the transfer a
+    background one by asking for ledbat. Multipath needs SACK, as
+    losses on one path must not be judged by the order data arrives in
+    over all of them.
+    """
+    conn = Connection(syn['cid'], client_address)
+    options = decode_options(base64.b64decode(syn.get('opts', '')))
+    print(f"SYN from {client_address}: cid={conn.cid:08x}, options={sorted(options)}")
+    conn.mss = min(MSS, options.get('mss', MSS))
+    conn.peer_window = options.get('window', INITIAL_SSTHRESH)
+    if 'wscale' in options:
+        conn.wscale = min(options['wscale'], MAX_WSCALE)
+    
+    resume = options.get('resume')
+    if resume and stream.identity and resume.get('file_id') == stream.identity:
+        conn.held_ranges = sorted((start, end) for start, end in resume.get('ranges', []))
+        held_bytes = sum(end - start for start, end in conn.held_ranges)
+        print(f"Resuming transfer: client holds {held_bytes} bytes in {len(conn.held_ranges)} ranges")
+    elif resume:
+        print("Client checkpoint does not match the source, restarting from byte 0")
+    
+    if allow_compression and COMPRESSION in options.get('compress', '').split(','):
+        conn.compression = COMPRESSION
+        print(f"Negotiated {conn.compression} compression")
+    conn.fast_open = allow_fast_open and options.get('fast_open', False)
+    conn.sack = options.get('sack', False)
+    conn.timestamps = options.get('timestamps', False)
+    conn.cc = 'ledbat' if 'ledbat' in (cc_algorithm, options.get('cc')) else 'reno'
+    conn.weight = max(options.get('weight', 1), 1)
+    conn.seq_bits = min(max(options.get('seq_bits', SEQ_BITS), MIN_SEQ_BITS), SEQ_BITS)
+    conn.isn &= (1 << conn.seq_bits) - 1
+    if conn.sack and conn.cc == 'reno':
+        conn.paths = max(min(options.get('multipath', 1), max_paths), 1)
+    
+    if isinstance(stream, SessionSource):
+        session = options.get('session')
+        if session is None:
+            print("Client did not ask for a session, nothing to send")
+            session = {'requests': [], 'last': True}
+        streams = options.get('streams')
+        if streams is not None:
+            # A segment holds exactly one stream's bytes, which compression would not keep to
+            conn.compression = None
+            stream.multiplex(streams.get('window', STREAM_WINDOW), streams.get('priority', []))
+        stream.request(session.get('requests', []), session.get('last', False))
+    
+    reply = {
+        'mss': conn.mss,
+        'cc': conn.cc,
+        'file_id': stream.identity,
+        'resumed': bool(conn.held_ranges),
+        'compress': conn.compression,
+        'fast_open': conn.fast_open,
+        'sack': conn.sack,
+        'timestamps': conn.timestamps,
+        'session': {} if isinstance(stream, SessionSource) else None,
+        'streams': {} if getattr(stream, 'streams', None) is not None else None,
+        'weight': conn.weight,
+        'seq_bits': conn.seq_bits,
+        'wscale': conn.wscale if 'wscale' in options else None,
+        'multipath': conn.paths if conn.paths > 1 else None,
+    }
+    conn.syn_ack_packet = json.dumps({
+        'syn': True,
+        'ack': True,
+        'cid': conn.cid,
+        'isn': conn.isn,
+        'opts': base64.b64encode(encode_options(reply)).decode('ascii')
+    }).encode()
+    
+    return conn
+
+def create_packet(seq_num, data, fin=False, digest=None, compressed=False, cid=None, ts=None, frame=None,
+                  encoded=None):
+    """Create packet with sequence number, data and segment checksum.
+
+    encoded, if given, is data already JSON-encoded as bytes (SegmentCache), spliced in as is.
+    """
+    if not isinstance(data, bytes):
+        data = data.encode('latin1')
+    crc = segment_checksum(seq_num, data)
+    if encoded and cid is not None and not (compressed or frame or fin):
+        # A cached file segment: its few fields are formatted directly, as the JSON encoder costs more than the rest
+        ts_field = '' if ts is None else f', "ts": {ts!r}'
+        return f'{{"cid": {cid}, "seq_num": {seq_num}, "crc": {crc}{ts_field}, "data": '.encode() + encoded + b'}'
     packet = {
+        'cid': cid,
         'seq_num': seq_num,
-        'data': data.decode('latin1') if isinstance(data, bytes) else data
+        'data': data.decode('latin1'),
+        'crc': crc
     }
+    if compressed:
+        packet['z'] = True
+    if ts is not None:
+        packet['ts'] = ts
+    if frame is not None:
+        packet['sid'], packet['off'] = frame
+    if fin:
+        packet['fin'] = True
+        packet['digest'] = digest
     return json.dumps(packet).encode()
 
+def segment_checksum(seq_num, data):
+    """CRC32 over the sequence number and payload, checked before reassembly"""
+    return zlib.crc32(data, zlib.crc32(seq_num.to_bytes(8, 'big', signed=True)))
+
 def parse_ack(ack_packet):
     """Parse acknowledgment packet"""
     try:
@@ -204,386 +2280,90 @@ def parse_ack(ack_packet):
         print("Error decoding ACK packet")
         return None
 
-# if __name__ == "__main__":
-#     parser = argparse.ArgumentParser(description='TCP Reno-like UDP server')
-#     parser.add_argument('server_ip', help='Server IP address')
-#     parser.add_argument('server_port', type=int, help='Server port number')
-    
-#     args = parser.parse_args()
-#     print(f"Starting TCP Reno-like UDP server")
-#     send_file(args.server_ip, args.server_port)
-
-parser = argparse.ArgumentParser(description='TCP Reno-like UDP server')
-parser.add_argument('server_ip', help='Server IP address')
-parser.add_argument('server_port', type=int, help='Server port number')
-
-args = parser.parse_args()
-print(f"Starting TCP Reno-like UDP server")
-send_file(args.server_ip, args.server_port)
-
-# import socket
-# import time
-# import json
-# import argparse
-# import os
-
-# # Constants
-# MSS = 1400  # Maximum Segment Size
-# INITIAL_CWND = MSS  # Initial congestion window size
-# INITIAL_SSTHRESH = 65535  # Initial slow start threshold
-# INITIAL_RTO = 1.0  # Initial retransmission timeout
-# ALPHA = 0.125  # RTT smoothing factor
-# BETA = 0.25  # RTT deviation factor
-# MIN_RTO = 0.2  # Minimum RTO value
-# MAX_RTO = 60.0  # Maximum RTO value
-
-# class CongestionControl:
-#     def __init__(self):
-#         self.cwnd = INITIAL_CWND
-#         self.ssthresh = INITIAL_SSTHRESH
-#         self.duplicate_ack_count = 0
-#         self.in_fast_recovery = False
-#         self.last_sent_byte = 0
-#         self.last_acked_byte = 0
-#         self.rtt_estimator = RTTEstimator()
-#         self.unacked_packets = {}  # {seq_num: (packet_data, timestamp)}
-#         self.packets_in_flight = 0
-        
-#     def on_ack_received(self, ack_num):
-#         """Handle received ACK"""
-#         if ack_num <= self.last_acked_byte:
-#             self.duplicate_ack_count += 1
-#             if self.duplicate_ack_count == 3:
-#                 self.on_triple_duplicate_ack()
-#         else:
-#             # New ACK
-#             self.last_acked_byte = ack_num
-#             self.duplicate_ack_count = 0
-            
-#             if self.in_fast_recovery:
-#                 # Exit fast recovery
-#                 self.cwnd = self.ssthresh
-#                 self.in_fast_recovery = False
-#             else:
-#                 # Normal ACK processing
-#                 if self.cwnd < self.ssthresh:
-#                     # Slow start
-#                     self.cwnd += MSS
-#                 else:
-#                     # Congestion avoidance
-#                     self.cwnd += MSS * (MSS / self.cwnd)
-    
-#     def on_triple_duplicate_ack(self):
-#         """Handle triple duplicate ACK"""
-#         self.ssthresh = max(self.cwnd // 2, 2 * MSS)
-#         self.cwnd = self.ssthresh + 3 * MSS
-#         self.in_fast_recovery = True
-    
-#     def on_timeout(self):
-#         """Handle timeout"""
-#         self.ssthresh = max(self.cwnd // 2, 2 * MSS)
-#         self.cwnd = MSS
-#         self.in_fast_recovery = False
-#         self.duplicate_ack_count = 0
-
-# class RTTEstimator:
-#     def __init__(self):
-#         self.srtt = None
-#         self.rttvar = None
-#         self.rto = INITIAL_RTO
-    
-#     def update(self, measured_rtt):
-#         """Update RTT estimates"""
-#         if self.srtt is None:
-#             self.srtt = measured_rtt
-#             self.rttvar = measured_rtt / 2
-#         else:
-#             self.rttvar = (1 - BETA) * self.rttvar + BETA * abs(self.srtt - measured_rtt)
-#             self.srtt = (1 - ALPHA) * self.srtt + ALPHA * measured_rtt
-        
-#         self.rto = self.srtt + 4 * self.rttvar
-#         self.rto = min(max(self.rto, MIN_RTO), MAX_RTO)
-
-# def send_file(server_ip, server_port):
-#     """Send file using TCP Reno-like congestion control"""
-#     server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-#     server_socket.bind((server_ip, server_port))
-#     print(f"Server listening on {server_ip}:{server_port}")
-    
-#     cc = CongestionControl()
-#     file_path = "input.txt"
-    
-#     try:
-#         # Wait for initial client connection
-#         data, client_address = server_socket.recvfrom(1024)
-#         print(f"Client connected from {client_address}")
-        
-#         file_size = os.path.getsize(file_path)
-#         with open(file_path, 'rb') as file:
-#             while True:
-#                 # Calculate available window
-#                 available_window = min(cc.cwnd, INITIAL_SSTHRESH) - cc.packets_in_flight
-                
-#                 # Send data while window allows
-#                 while available_window >= MSS and cc.last_sent_byte < file_size:
-#                     # Read and send data
-#                     file.seek(cc.last_sent_byte)
-#                     data = file.read(min(MSS, available_window))
-#                     if not data:
-#                         break
-                    
-#                     packet = create_packet(cc.last_sent_byte, data)
-#                     server_socket.sendto(packet, client_address)
-                    
-#                     # Update state
-#                     packet_size = len(data)
-#                     cc.unacked_packets[cc.last_sent_byte] = (data, time.time())
-#                     cc.last_sent_byte += packet_size
-#                     cc.packets_in_flight += packet_size
-#                     available_window -= packet_size
-                
-#                 # Handle ACKs and timeouts
-#                 try:
-#                     server_socket.settimeout(cc.rtt_estimator.rto)
-#                     ack_packet, _ = server_socket.recvfrom(1024)
-#                     ack_data = parse_ack(ack_packet)
-                    
-#                     if ack_data:
-#                         ack_num = ack_data['ack_num']
-#                         # Update RTT if possible
-#                         if ack_num in cc.unacked_packets:
-#                             send_time = cc.unacked_packets[ack_num][1]
-#                             rtt = time.time() - send_time
-#                             cc.rtt_estimator.update(rtt)
-                        
-#                         # Process ACK
-#                         cc.on_ack_received(ack_num)
-                        
-#                         # Remove acknowledged packets
-#                         keys_to_remove = [k for k in cc.unacked_packets.keys() if k <= ack_num]
-#                         for k in keys_to_remove:
-#                             packet_size = len(cc.unacked_packets[k][0])
-#                             cc.packets_in_flight -= packet_size
-#                             del cc.unacked_packets[k]
-                
-#                 except socket.timeout:
-#                     cc.on_timeout()
-#                     # Retransmit first unacked packet
-#                     if cc.unacked_packets:
-#                         first_unacked = min(cc.unacked_packets.keys())
-#                         data = cc.unacked_packets[first_unacked][0]
-#                         packet = create_packet(first_unacked, data)
-#                         server_socket.sendto(packet, client_address)
-                
-#                 # Check if transfer is complete
-#                 if not cc.unacked_packets and cc.last_sent_byte >= file_size:
-#                     # Send end marker
-#                     end_packet = create_packet(-1, b'')
-#                     server_socket.sendto(end_packet, client_address)
-#                     break
-    
-#     except Exception as e:
-#         print(f"Error: {e}")
-#     finally:
-#         server_socket.close()
-
-# def create_packet(seq_num, data):
-#     """Create packet with sequence number and data"""
-#     packet = {
-#         'seq_num': seq_num,
-#         'data': data.decode('latin1') if isinstance(data, bytes) else data
-#     }
-#     return json.dumps(packet).encode()
-
-# def parse_ack(ack_packet):
-#     """Parse acknowledgment packet"""
-#     try:
-#         return json.loads(ack_packet.decode())
-#     except json.JSONDecodeError:
-#         print("Error decoding ACK packet")
-#         return None
-
-# if __name__ == "__main__":
-#     parser = argparse.ArgumentParser(description='TCP Reno-like UDP server')
-#     parser.add_argument('server_ip', help='Server IP address')
-#     parser.add_argument('server_port', type=int, help='Server port number')
-    
-#     args = parser.parse_args()
-#     send_file(args.server_ip, args.server_port)
-
-
-# not sending end of file -1 sequence number for some reason
-# import socket
-# import time
-# import json
-# import argparse
-# import os
-
-# # Constants
-# MSS = 1400  # Maximum Segment Size
-# INITIAL_SSTHRESH = 64 * MSS  # Initial slow start threshold
-# WINDOW_SIZE = 5  # Number of packets in flight (initial)
-# DUP_ACK_THRESHOLD = 3  # Threshold for duplicate ACKs to trigger fast recovery
-# FILE_PATH = "input.txt"  # Example file path
-
-# # RTT estimation parameters
-# ALPHA = 0.125
-# BETA = 0.25
-# INITIAL_TIMEOUT = 1.0  # Initial timeout before RTT measurements
-# EstimatedRTT = INITIAL_TIMEOUT  # Initialize EstimatedRTT with a default value
-# DevRTT = 0.0  # Initialize deviation RTT
-
-# def send_file(server_ip, server_port, enable_fast_recovery):
-#     global EstimatedRTT, DevRTT
-
-#     # Initialize UDP socket
-#     server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-#     server_socket.bind((server_ip, server_port))
-
-#     print(f"Server listening on {server_ip}:{server_port}")
-
-#     client_address = None
-#     file_path = FILE_PATH  # Predefined file name
-
-#     try:
-#         # Determine the number of packets needed
-#         file_size = os.path.getsize(file_path)
-#         expected_packets_count = (file_size + MSS - 1) // MSS  # Round up division
-
-#         with open(file_path, 'rb') as file:
-#             seq_num = 0
-#             window_base = 0
-#             unacked_packets = {}
-#             last_ack_received = -1
-#             TimeoutInterval = INITIAL_TIMEOUT
-#             duplicate_ack_count = 0  # Initialize duplicate ACK counter
-#             cwnd = 1 * MSS  # Congestion window starts at 1 MSS
-#             ssthresh = INITIAL_SSTHRESH
-
-#             # Wait for client connection
-#             while client_address is None:
-#                 print("Waiting for client connection...")
-#                 data, client_address = server_socket.recvfrom(1024)  # Receive initial connection request
-#                 print(f"Connection established with client {client_address}")
-
-#             # Now we can start sending packets
-#             while True:
-#                 # Window-based sending logic
-#                 while len(unacked_packets) < cwnd / MSS and seq_num < expected_packets_count:
-#                     chunk = file.read(MSS)
-#                     if not chunk:
-#                         break  # End of file
-
-#                     # Create and send the packet
-#                     packet = create_packet(seq_num, chunk)
-#                     server_socket.sendto(packet, client_address)
-#                     unacked_packets[seq_num] = (packet, time.time())  # Track sent packets with timestamp
-#                     print(f"Sent packet {seq_num}")
-#                     seq_num += 1
-
-#                 if not unacked_packets and not chunk:
-#                     # If there are no unacknowledged packets and we reached EOF, break the loop
-#                     break
-
-#                 # Wait for ACKs and retransmit if needed
-#                 try:
-#                     server_socket.settimeout(TimeoutInterval)  # Use the current timeout interval
-#                     ack_packet, _ = server_socket.recvfrom(1024)
-
-#                     print(f"Received ACK packet: {ack_packet.decode()}")  # Log received ACK packet
-
-#                     # Validate that the ACK packet is JSON
-#                     ack_seq_num = get_seq_no_from_ack_pkt(ack_packet)
-
-#                     if ack_seq_num in unacked_packets:
-#                         # Acknowledge received ACKs
-#                         print(f"Received ACK for packet {ack_seq_num}")
-#                         send_time = unacked_packets[ack_seq_num][1]
-#                         SampleRTT = time.time() - send_time
-#                         print(f"SampleRTT for packet {ack_seq_num}: {SampleRTT:.4f} seconds")
-
-#                         # Update EstimatedRTT and DevRTT
-#                         EstimatedRTT = (1 - ALPHA) * EstimatedRTT + ALPHA * SampleRTT
-#                         DevRTT = (1 - BETA) * DevRTT + BETA * abs(SampleRTT - EstimatedRTT)
-#                         TimeoutInterval = EstimatedRTT + 4 * DevRTT
-#                         print(f"Updated TimeoutInterval: {TimeoutInterval:.4f} seconds")
-
-#                         # Slide the window base
-#                         del unacked_packets[ack_seq_num]
-#                         window_base = ack_seq_num + 1
-#                         last_ack_received = ack_seq_num
-
-#                         # Handle slow start and congestion avoidance
-#                         if cwnd < ssthresh:
-#                             # Slow start
-#                             cwnd += MSS
-#                             print(f"Slow start: increased cwnd to {cwnd / MSS} MSS")
-#                         else:
-#                             # Congestion avoidance
-#                             cwnd += MSS * (MSS / cwnd)
-#                             print(f"Congestion avoidance: increased cwnd to {cwnd / MSS} MSS")
-
-#                         duplicate_ack_count = 0  # Reset the duplicate ACK counter after receiving a new ACK
-
-#                     elif ack_seq_num == last_ack_received:
-#                         # Detect duplicate ACK
-#                         duplicate_ack_count += 1
-#                         print(f"Duplicate ACK detected: {duplicate_ack_count}")
-
-#                         if duplicate_ack_count == DUP_ACK_THRESHOLD:
-#                             # Fast retransmit and fast recovery
-#                             print(f"Entering fast recovery. Reducing cwnd and retransmitting packet {window_base}")
-#                             ssthresh = max(cwnd // 2, 1 * MSS)  # Halve the congestion window
-#                             cwnd = ssthresh + 3 * MSS  # Fast recovery step
-#                             retransmit_packet = unacked_packets[window_base][0]
-#                             server_socket.sendto(retransmit_packet, client_address)
-#                             print(f"Retransmitted packet {window_base}")
-#                     else:
-#                         print(f"Received unexpected ACK: {ack_seq_num}")
-
-#                 except socket.timeout:
-#                     # Timeout behavior: Retransmit all unacknowledged packets and reset cwnd
-#                     print("Timeout: retransmitting all unacknowledged packets")
-#                     ssthresh = max(cwnd // 2, 1 * MSS)
-#                     cwnd = 1 * MSS  # Reset to slow start
-#                     for seq, (pkt, _) in unacked_packets.items():
-#                         server_socket.sendto(pkt, client_address)
-#                         print(f"Retransmitted packet {seq}")
-
-#             print("EOF reached, entering -1 send")
-#             # Send a signal to the client that the transfer is complete
-#             end_signal = json.dumps({'seq_num': -1, 'data': ''}).encode()
-#             server_socket.sendto(end_signal, client_address)
-#             print("File transfer complete. Sent END signal to client.")
-
-#     except Exception as e:
-#         print(f"Error: {e}")
-
-# def create_packet(seq_num, chunk):
-#     """
-#     Create a packet with sequence number and chunk of data.
-#     """
-#     packet_data = json.dumps({'seq_num': seq_num, 'data': chunk.decode('latin1')})
-#     return packet_data.encode()
-
-# def get_seq_no_from_ack_pkt(ack_packet):
-#     """
-#     Extract the sequence number from an ACK packet.
-#     """
-#     try:
-#         parsed_packet = json.loads(ack_packet.decode())
-#         return parsed_packet['ack_seq']
-#     except json.JSONDecodeError:
-#         print("Received a malformed ACK packet")
-#         return -1
-
-# # Parse command-line arguments
-# parser = argparse.ArgumentParser(description='Reliable file sender over UDP with TCP Reno congestion control.')
-# parser.add_argument('server_ip', help='IP address of the server')
-# parser.add_argument('server_port', type=int, help='Port number of the server')
-# parser.add_argument('--fast-recovery', action='store_true', help='Enable fast recovery mode')
-
-# args = parser.parse_args()
-
-# # Run the server
-# send_file(args.server_ip, args.server_port, args.fast_recovery)
+def instrument(profiler):
+    """Time the packet loop's stages by rebinding this module's functions; callers need no change.
+
+    Returns a function that puts the originals back.
+    """
+    module = sys.modules[__name__]
+    return profiler.patch([
+        (module, 'print', 'print'),
+        (module, 'create_packet', 'create_packet'),
+        (module, 'parse_ack', 'parse_ack'),
+        (module, 'remove_acked', 'remove_acked'),
+        (module, 'apply_sack', 'apply_sack'),
+        (RTTEstimator, 'update', 'rtt_update'),
+        (LossDetector, 'detect_losses', 'detect_losses'),
+        (SegmentCompressor, 'encode', 'compress'),
+        (StreamSource, 'read', 'read'),
+        (OffloadSocket, 'flush', 'gso_flush'),
+    ])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='TCP Reno-like UDP server')
+    parser.add_argument('server_ip', help='Server IP address')
+    parser.add_argument('server_port', type=int, help='Server port number')
+    parser.add_argument('--input', default='input.txt', help="File to send, or '-' to stream from stdin")
+    parser.add_argument('--compress', action='store_true', help='Accept per-segment compression if the client offers it')
+    parser.add_argument('--fast_open', action='store_true', help='Send the first flight of data along with the SYN-ACK')
+    parser.add_argument('--session', metavar='DIR', help='Serve files from DIR by name to session clients instead of --input')
+    parser.add_argument('--no_hystart', action='store_true', help='Stay in slow start until the first loss')
+    parser.add_argument('--cc', choices=CC_ALGORITHMS, default='reno',
+                        help='Congestion control; ledbat sends in the background, yielding to other traffic')
+    parser.add_argument('--flows', type=int, default=1, help='Serve this many clients, side by side, before exiting')
+    parser.add_argument('--no_share', action='store_true',
+                        help='Give every flow its own congestion window, even flows to the same host')
+    parser.add_argument('--metrics_port', type=int, help='Serve live transfer metrics (Prometheus text) on this local port')
+    parser.add_argument('--max_window', type=int, default=MAX_WINDOW,
+                        help='Cap on the send window in bytes; raise it to fill paths with a large bandwidth-delay product')
+    parser.add_argument('--sock_buffer', type=int,
+                        help='SO_SNDBUF/SO_RCVBUF size in bytes (default: --max_window, when that is raised)')
+    parser.add_argument('--offload', action='store_true',
+                        help='Batch sends with UDP segmentation offload (Linux), falling back if unsupported')
+    parser.add_argument('--pacing', action='store_true',
+                        help='Spread each window over the RTT instead of sending it in one burst')
+    parser.add_argument('--read_ahead', action='store_true',
+                        help='Read files on a background thread, so a slow disk never holds up ACK processing')
+    parser.add_argument('--max_paths', type=int, default=1,
+                        help='Let a client spread its transfer over up to this many paths (multipath)')
+    parser.add_argument('--segment_cache', nargs='?', type=int, const=SEGMENT_CACHE_BUDGET, metavar='MB',
+                        help='Keep read and encoded segments of the input file, up to MB megabytes, '
+                             f'for the clients after the first (default {SEGMENT_CACHE_BUDGET})')
+    parser.add_argument('--profile', nargs='?', const='', metavar='PSTATS',
+                        help='Time each stage of the packet loop and print latency percentiles at exit; '
+                             'with PSTATS, also write cProfile stats there')
+
+    args = parser.parse_args(argv)
+    if args.session:
+        # Every client gets its own session over the same directory
+        source = lambda: SessionSource(args.session)
+    elif args.input == '-' and args.flows > 1:
+        parser.error("stdin can only be streamed to one client")
+    else:
+        source = args.input
+    profiler = StageProfiler() if args.profile is not None else None
+    # Only for this run, so later transfers in the same process are not timed
+    restore = instrument(profiler) if profiler else None
+    try:
+        print(f"Starting TCP Reno-like UDP server")
+        profile = None
+        if args.profile:
+            import cProfile
+            profile = cProfile.Profile()
+            profile.enable()
+        send_file(args.server_ip, args.server_port, source, args.compress, args.fast_open, not args.no_hystart,
+                  args.cc, args.flows, not args.no_share, args.metrics_port, profiler, args.max_window,
+                  args.sock_buffer, args.offload, args.pacing, args.read_ahead, args.max_paths,
+                  SegmentCache(args.segment_cache * 1024 * 1024) if args.segment_cache else None)
+        if profile:
+            profile.disable()
+            profile.dump_stats(args.profile)
+            print(f"cProfile stats written to {args.profile}")
+        if profiler:
+            profiler.report()
+    finally:
+        if restore:
+            restore()
+
+if __name__ == "__main__":
+    main()